@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AsteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'aste'
+
+    def ready(self):
+        # Registriamo i receiver dei segnali (es. sincronizzazione dell'indice di ricerca).
+        from . import signals  # noqa: F401
@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Asta, Notifica
+from .raccomandazioni import invalida_raccomandazioni
+from .statistiche import invalida_statistiche
+
+logger = logging.getLogger(__name__)
+
+
+def chiudi_aste_scadute(adesso=None, pks=None):
+    """
+    Chiude in blocco tutte le aste attive con `data_fine` passata (eventualmente
+    solo quelle in `pks`), crea le notifiche per vincitori e venditori con un
+    unico `bulk_create` e, dopo il commit, annuncia la chiusura sul gruppo
+    `asta_{pk}` di ciascuna asta. Restituisce la lista delle aste chiuse.
+    """
+    adesso = adesso or timezone.now()
+    with transaction.atomic():
+        scadute = Asta.objects.select_for_update().filter(stato='attiva', data_fine__lte=adesso)
+        if pks is not None:
+            scadute = scadute.filter(pk__in=pks)
+        # Il vincitore e il prezzo finale sono già salvati sull'asta (campi denormalizzati),
+        # quindi non serve interrogare le offerte asta per asta.
+        aste = list(scadute.select_related('venditore', 'miglior_offerente'))
+        if not aste:
+            return []
+
+        Asta.objects.filter(pk__in=[asta.pk for asta in aste]).update(stato='conclusa', notifica_inviata=True)
+
+        notifiche = []
+        for asta in aste:
+            if asta.notifica_inviata:
+                continue
+            vincitore = asta.miglior_offerente
+            if vincitore:
+                notifiche.append(Notifica(
+                    utente_destinatario=vincitore,
+                    messaggio=f"Congratulazioni! Hai vinto l'asta '{asta.titolo}'.",
+                    asta_riferimento=asta,
+                ))
+                notifiche.append(Notifica(
+                    utente_destinatario=asta.venditore,
+                    messaggio=f"La tua asta '{asta.titolo}' si è conclusa. È stata vinta da {vincitore.username} per €{asta.prezzo_attuale}.",
+                    asta_riferimento=asta,
+                ))
+            else:
+                notifiche.append(Notifica(
+                    utente_destinatario=asta.venditore,
+                    messaggio=f"La tua asta '{asta.titolo}' si è conclusa senza ricevere offerte.",
+                    asta_riferimento=asta,
+                ))
+        Notifica.objects.crea_notifiche(notifiche)
+
+        for asta in aste:
+            asta.stato = 'conclusa'
+            asta.notifica_inviata = True
+        transaction.on_commit(lambda: annuncia_chiusure(aste))
+        # Le nuove aste concluse possono comparire tra i suggerimenti di tutti gli utenti.
+        transaction.on_commit(invalida_raccomandazioni)
+        # Le aste chiuse escono dai conteggi per categoria della ricerca.
+        transaction.on_commit(invalida_statistiche)
+
+    logger.info("Chiuse %d aste scadute", len(aste))
+    return aste
+
+
+def annuncia_chiusure(aste):
+    # Spiegazione: Inviamo l'esito ai client collegati alla pagina di ciascuna asta,
+    # sullo stesso gruppo usato per gli aggiornamenti delle offerte.
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for asta in aste:
+        async_to_sync(channel_layer.group_send)(
+            f'asta_{asta.pk}',
+            {
+                'type': 'asta_conclusa',
+                'dati_asta': {
+                    'asta_id': asta.pk,
+                    'prezzo_finale': f"{asta.prezzo_attuale:.2f}",
+                    'vincitore': asta.miglior_offerente.username if asta.miglior_offerente else None,
+                }
+            }
+        )
+
+
+class SchedulerChiusure:
+    """
+    Tiene un min-heap di (data_fine, pk) delle aste attive che scadono entro
+    l'orizzonte di pianificazione e le chiude in blocco appena scadono.
+
+    Ogni `intervallo` secondi ricarica le aste in scadenza dal database (così
+    vengono prese anche quelle appena create o modificate) ed esegue una
+    chiusura completa come rete di sicurezza.
+    """
+
+    def __init__(self, intervallo=30):
+        self.intervallo = timedelta(seconds=intervallo)
+        self.heap = []
+        self.pianificate = set()
+        self.prossimo_aggiornamento = None
+        self._fermato = False
+
+    def aggiorna(self, adesso=None):
+        adesso = adesso or timezone.now()
+        close_old_connections()
+        chiudi_aste_scadute(adesso)
+        # Carichiamo solo le aste che scadono prima del prossimo aggiornamento (più un margine).
+        in_scadenza = Asta.objects.filter(
+            stato='attiva', data_fine__lte=adesso + 2 * self.intervallo
+        ).values_list('data_fine', 'pk')
+        for data_fine, pk in in_scadenza:
+            if pk not in self.pianificate:
+                heapq.heappush(self.heap, (data_fine, pk))
+                self.pianificate.add(pk)
+        self.prossimo_aggiornamento = adesso + self.intervallo
+
+    def estrai_scadute(self, adesso):
+        scadute = []
+        while self.heap and self.heap[0][0] <= adesso:
+            _, pk = heapq.heappop(self.heap)
+            self.pianificate.discard(pk)
+            scadute.append(pk)
+        return scadute
+
+    def secondi_di_attesa(self, adesso):
+        prossimo = self.prossimo_aggiornamento
+        if self.heap and self.heap[0][0] < prossimo:
+            prossimo = self.heap[0][0]
+        return max((prossimo - adesso).total_seconds(), 0)
+
+    def ferma(self):
+        self._fermato = True
+
+    async def esegui(self):
+        logger.info("Scheduler delle chiusure avviato (intervallo %s)", self.intervallo)
+        while not self._fermato:
+            adesso = timezone.now()
+            if self.prossimo_aggiornamento is None or adesso >= self.prossimo_aggiornamento:
+                await sync_to_async(self.aggiorna)(adesso)
+            scadute = self.estrai_scadute(adesso)
+            if scadute:
+                # `chiudi_aste_scadute` ricontrolla stato e data_fine nel database:
+                # un'asta prorogata nel frattempo non viene chiusa.
+                await sync_to_async(chiudi_aste_scadute)(adesso, pks=scadute)
+            await asyncio.sleep(self.secondi_di_attesa(timezone.now()))
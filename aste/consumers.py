@@ -1,8 +1,59 @@
+import asyncio
 import json
+import logging
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-import asyncio
+from django.conf import settings
+
+from .notifiche import gruppo_notifiche
+from .offerte import annuncia_notifiche_in_background, evento_offerta, istantanea_asta, piazza_offerta
+
+logger = logging.getLogger(__name__)
+
+
+class AggiornamentiAggregatiMixin:
+    """
+    Invio degli aggiornamenti di prezzo con coalescenza: il primo aggiornamento
+    parte subito, quelli che arrivano mentre un invio è in corso (o entro la finestra
+    `ASTE_FINESTRA_AGGIORNAMENTI_MS`) si accumulano e per ogni chiave (l'asta)
+    viene inviato solo l'ultimo stato. C'è al massimo un invio in corso per
+    connessione, quindi un client lento riceve meno messaggi ma sempre aggiornati.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.aggiornamenti_in_attesa = {}
+        self.invio_in_corso = None
+
+    def accoda_aggiornamento(self, chiave, dati):
+        precedente = self.aggiornamenti_in_attesa.get(chiave)
+        if precedente is not None:
+            logger.debug("Aggiornamento superato scartato: asta=%s canale=%s", chiave, self.channel_name)
+            if 'seq' in precedente:
+                # Il messaggio che partirà riassume anche quelli scartati: con `seq_da`
+                # il client sa che il salto di sequenza non è un messaggio perso.
+                dati = {**dati, 'seq_da': precedente.get('seq_da', precedente['seq'])}
+        self.aggiornamenti_in_attesa[chiave] = dati
+        if self.invio_in_corso is None or self.invio_in_corso.done():
+            self.invio_in_corso = asyncio.create_task(self._invia_aggiornamenti())
+
+    async def _invia_aggiornamenti(self):
+        finestra = getattr(settings, 'ASTE_FINESTRA_AGGIORNAMENTI_MS', 20) / 1000
+        while self.aggiornamenti_in_attesa:
+            da_inviare, self.aggiornamenti_in_attesa = self.aggiornamenti_in_attesa, {}
+            for dati in da_inviare.values():
+                await self.send(text_data=json.dumps(dati))
+            if finestra:
+                await asyncio.sleep(finestra)
+
+    def annulla_aggiornamenti(self):
+        self.aggiornamenti_in_attesa = {}
+        if self.invio_in_corso is not None:
+            self.invio_in_corso.cancel()
 
-class AstaConsumer(AsyncWebsocketConsumer):
+
+class AstaConsumer(AggiornamentiAggregatiMixin, AsyncWebsocketConsumer):
     # Questo metodo viene chiamato quando un client WebSocket si connette.
     async def connect(self):
         # 1. Otteniamo l'ID dell'asta dall'URL.
@@ -11,7 +62,7 @@ class AstaConsumer(AsyncWebsocketConsumer):
         
         # 2. Creiamo un nome univoco per il gruppo (la "stanza" di questa asta).
         self.asta_group_name = f'asta_{self.asta_pk}'
-        print(f"[DEBUG] CONNECT: channel_layer id: {id(self.channel_layer)} | channel_name: {self.channel_name}")
+        logger.debug("Connessione WebSocket: asta=%s canale=%s", self.asta_pk, self.channel_name)
         # 3. Aggiungiamo questo canale (la connessione del singolo client) al gruppo.
         #    Tutti i canali in questo gruppo riceveranno i messaggi inviati al gruppo.
         await self.channel_layer.group_add(
@@ -22,33 +73,163 @@ class AstaConsumer(AsyncWebsocketConsumer):
         # 4. Accettiamo la connessione WebSocket. Se non lo facciamo, verrà rifiutata.
         await self.accept()
 
+        # 5. Inviamo subito lo stato attuale: un client che si riconnette dopo un'interruzione
+        #    si riallinea senza ricaricare la pagina. La lettura avviene dopo l'iscrizione
+        #    al gruppo, quindi nessuna offerta può cadere tra l'istantanea e gli aggiornamenti.
+        await self.invia_istantanea()
+
+    async def invia_istantanea(self):
+        istantanea = await database_sync_to_async(istantanea_asta)(self.asta_pk)
+        if istantanea is not None:
+            await self.send(text_data=json.dumps(istantanea))
+
     # Questo metodo viene chiamato quando il client si disconnette.
     async def disconnect(self, close_code):
+        self.annulla_aggiornamenti()
         # Rimuoviamo il canale dal gruppo per non inviargli più messaggi.
         await self.channel_layer.group_discard(
             self.asta_group_name,
             self.channel_name
         )
-        
+        logger.debug("Disconnessione WebSocket: asta=%s canale=%s codice=%s", self.asta_pk, self.channel_name, close_code)
+
+    # Messaggi dal client: {"azione": "sincronizza"} oppure
+    # offerte inviate direttamente sul socket: {"azione": "offerta", "importo": "12.50", "id": ...}.
+    # L'utente è quello della sessione (AuthMiddlewareStack) e la validazione è la stessa
+    # di `fai_offerta`; la risposta arriva sullo stesso socket, con l'`id` scelto dal client.
     async def receive(self, text_data):
-        print("[DEBUG] receive chiamato con:", text_data)
-        
-    async def websocket_receive(self, event):
-        print("[DEBUG] websocket_receive", event)
+        try:
+            richiesta = json.loads(text_data)
+            azione = richiesta['azione']
+        except (ValueError, KeyError, TypeError):
+            await self.send(text_data=json.dumps({'esito': 'rifiuto', 'errore': 'Richiesta non valida.', 'status': 400}))
+            return
+        if azione == 'offerta':
+            await self.ricevi_offerta(richiesta)
+        elif azione == 'sincronizza':
+            # Il client ha visto un salto nella sequenza (`seq`) e chiede lo stato completo.
+            await self.invia_istantanea()
+        else:
+            await self.send(text_data=json.dumps({'esito': 'rifiuto', 'errore': 'Azione sconosciuta.', 'status': 400}))
 
+    async def ricevi_offerta(self, richiesta):
+        risposta = {'id': richiesta.get('id')}
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            risposta.update(esito='rifiuto', errore='Devi effettuare il login per fare offerte.', status=401)
+            await self.send(text_data=json.dumps(risposta))
+            return
 
+        esito = await database_sync_to_async(piazza_offerta)(
+            self.asta_pk, user, richiesta.get('importo'), annuncio_differito=True
+        )
+        if not esito.accettata:
+            logger.debug("Offerta WebSocket rifiutata: asta=%s utente=%s status=%s", self.asta_pk, user.pk, esito.status)
+            risposta.update(esito='rifiuto', errore=esito.errore, superata=esito.superata, status=esito.status)
+            await self.send(text_data=json.dumps(risposta))
+            return
+
+        evento = evento_offerta(esito.offerta)
+        risposta.update(esito='ack', **evento['dati_offerta'])
+        await self.send(text_data=json.dumps(risposta))
+        # Come `fai_offerta`: il nuovo prezzo va a tutti i client collegati all'asta,
+        # la notifica al superato parte in background.
+        if esito.notifiche:
+            annuncia_notifiche_in_background(esito.notifiche)
+        await self.channel_layer.group_send(self.asta_group_name, evento)
 
     # Questo è un metodo "ricevitore di eventi". Viene chiamato automaticamente da Channels
-    # quando la nostra vista Django invia un messaggio al gruppo con 'type': 'offerta.aggiornata'.
+    # quando `annuncia_offerta` invia un messaggio al gruppo con 'type': 'offerta_aggiornata'.
+    # Non inviamo direttamente: durante una raffica di offerte il client riceve solo il prezzo più recente.
     async def offerta_aggiornata(self, event):
-        await asyncio.sleep(0.05)
-        # Spiegazione: Per essere robusti, controlliamo se i dati sono direttamente
-        # nell'evento o in una sotto-chiave.
-        # Il backend InMemory a volte passa i dati direttamente.
-        dati = event.get('dati_offerta') or {
-            "nuovo_prezzo": event.get("nuovo_prezzo"),
-            "acquirente": event.get("acquirente")
-        }
-
-        # Invia i dati al client JavaScript
-        await self.send(text_data=json.dumps(dati))
\ No newline at end of file
+        self.accoda_aggiornamento(self.asta_pk, event['dati_offerta'])
+
+    # Evento inviato dallo scheduler delle chiusure (vedi aste/chiusura.py)
+    # quando l'asta raggiunge la sua data di fine.
+    async def asta_conclusa(self, event):
+        # Il risultato finale sostituisce eventuali prezzi ancora in attesa di invio.
+        self.annulla_aggiornamenti()
+        await self.send(text_data=json.dumps({'conclusa': True, **event['dati_asta']}))
+
+
+
+class AsteConsumer(AggiornamentiAggregatiMixin, AsyncWebsocketConsumer):
+    """
+    Un'unica connessione per seguire i prezzi di molte aste (home, ricerca, profilo).
+    Il client invia {"azione": "iscrivi" | "disiscrivi", "aste": [id, ...]} e riceve
+    gli stessi messaggi di `AstaConsumer`, che contengono sempre `asta_id`.
+    """
+
+    async def connect(self):
+        self.iscrizioni = set()
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        self.annulla_aggiornamenti()
+        for asta_id in self.iscrizioni:
+            await self.channel_layer.group_discard(f'asta_{asta_id}', self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            richiesta = json.loads(text_data)
+            azione = richiesta['azione']
+            aste = {int(asta_id) for asta_id in richiesta['aste']}
+        except (ValueError, KeyError, TypeError):
+            await self.send(text_data=json.dumps({'errore': 'Richiesta non valida.'}))
+            return
+
+        if azione == 'iscrivi':
+            limite = getattr(settings, 'ASTE_MAX_ISCRIZIONI_WS', 200)
+            nuove = sorted(aste - self.iscrizioni)
+            disponibili = max(limite - len(self.iscrizioni), 0)
+            for asta_id in nuove[:disponibili]:
+                await self.channel_layer.group_add(f'asta_{asta_id}', self.channel_name)
+                self.iscrizioni.add(asta_id)
+            if len(nuove) > disponibili:
+                logger.info("Limite iscrizioni raggiunto: canale=%s limite=%s", self.channel_name, limite)
+                await self.send(text_data=json.dumps({
+                    'errore': f"Puoi seguire al massimo {limite} aste per connessione.",
+                    'limite': limite,
+                }))
+        elif azione == 'disiscrivi':
+            for asta_id in aste & self.iscrizioni:
+                await self.channel_layer.group_discard(f'asta_{asta_id}', self.channel_name)
+                self.iscrizioni.discard(asta_id)
+                self.aggiornamenti_in_attesa.pop(asta_id, None)
+        else:
+            await self.send(text_data=json.dumps({'errore': 'Azione sconosciuta.'}))
+
+    async def offerta_aggiornata(self, event):
+        dati = event['dati_offerta']
+        self.accoda_aggiornamento(dati['asta_id'], dati)
+
+    async def asta_conclusa(self, event):
+        dati = event['dati_asta']
+        self.aggiornamenti_in_attesa.pop(dati['asta_id'], None)
+        await self.send(text_data=json.dumps({'conclusa': True, **dati}))
+
+
+class NotificheConsumer(AsyncWebsocketConsumer):
+    """
+    Canale personale dell'utente loggato: riceve le nuove notifiche (chiusure,
+    offerte superate, ...) e il numero aggiornato di notifiche non lette.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        # Solo gli utenti autenticati hanno un gruppo di notifiche.
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        self.notifiche_group_name = gruppo_notifiche(user.pk)
+        await self.channel_layer.group_add(self.notifiche_group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'notifiche_group_name'):
+            await self.channel_layer.group_discard(self.notifiche_group_name, self.channel_name)
+
+    # Evento inviato da `annuncia_notifiche` (vedi aste/notifiche.py).
+    async def notifica_nuova(self, event):
+        await self.send(text_data=json.dumps(event['dati_notifica']))
@@ -1,8 +1,21 @@
-from .models import Notifica
+from functools import cache
+
+from .models import Notifica, Profile
 
 def notifiche_non_lette(request):
     if request.user.is_authenticated:
-        # Conta le notifiche dell'utente loggato che non sono state ancora lette
-        count = Notifica.objects.filter(utente_destinatario=request.user, letta=False).count()
+        user = request.user
+
+        # Spiegazione: invece del numero passiamo una funzione, che il template chiama
+        # solo se mostra il badge (e una volta sola, grazie a `cache`). Il valore viene
+        # dal contatore sul profilo, che base.html ha già caricato per il ruolo.
+        @cache
+        def count():
+            try:
+                return user.profile.notifiche_non_lette
+            except Profile.DoesNotExist:
+                # Utenti senza profilo (es. superuser creati da riga di comando).
+                return Notifica.objects.filter(utente_destinatario=user, letta=False).count()
+
         return {'notifiche_non_lette_count': count}
-    return {'notifiche_non_lette_count': 0}
\ No newline at end of file
+    return {'notifiche_non_lette_count': 0}
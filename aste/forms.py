@@ -1,7 +1,15 @@
+import warnings
+
 from django import forms
+from django.conf import settings
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from .models import * # Importiamo il nostro modello Profile
+from .immagini import pianifica_derivati, rilascia_immagine
+from .upload import max_byte_immagine
 
 class CustomUserCreationForm(UserCreationForm):
     # Spiegazione: Stiamo estendendo il form di base per la creazione di utenti.
@@ -46,6 +54,52 @@ class CustomUserCreationForm(UserCreationForm):
         return user
     
     
+class ImmagineAstaField(forms.ImageField):
+    # Spiegazione: Sostituisce la validazione di `forms.ImageField`, che copia in memoria
+    # i file piccoli e fa `verify()` sull'intera immagine. Qui leggiamo solo l'intestazione
+    # (formato e dimensioni) direttamente dal file temporaneo, così un'immagine enorme
+    # o una "decompression bomb" viene rifiutata prima di decodificare i pixel.
+    # Il lavoro pesante (rotazione, rimozione EXIF, derivati) avviene dopo, in background.
+
+    def to_python(self, data):
+        f = forms.FileField.to_python(self, data)
+        if f is None:
+            return None
+
+        if f.size > max_byte_immagine():
+            raise forms.ValidationError(
+                f"L'immagine è troppo grande: il massimo è {filesizeformat(max_byte_immagine())}.",
+                code='file_troppo_grande',
+            )
+
+        file = f.temporary_file_path() if hasattr(f, 'temporary_file_path') else f
+        try:
+            with warnings.catch_warnings():
+                # Oltre MAX_IMAGE_PIXELS Pillow avvisa soltanto: per noi è un errore.
+                warnings.simplefilter('error', Image.DecompressionBombWarning)
+                with Image.open(file) as image:
+                    formato, (larghezza, altezza) = image.format, image.size
+        except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+            raise forms.ValidationError("L'immagine ha dimensioni eccessive.", code='dimensioni_eccessive')
+        except Exception as exc:
+            raise forms.ValidationError(self.error_messages['invalid_image'], code='invalid_image') from exc
+
+        formati = getattr(settings, 'ASTE_FORMATI_IMMAGINE', ('JPEG', 'PNG', 'WEBP', 'GIF'))
+        if formato not in formati:
+            raise forms.ValidationError(
+                f"Formato non supportato: usa {', '.join(formati)}.", code='formato_non_supportato'
+            )
+        if larghezza * altezza > getattr(settings, 'ASTE_MAX_PIXEL_IMMAGINE', 40_000_000):
+            raise forms.ValidationError(
+                f"L'immagine ha dimensioni eccessive ({larghezza}x{altezza} pixel).", code='dimensioni_eccessive'
+            )
+
+        f.content_type = Image.MIME.get(formato)
+        if hasattr(f, 'seek') and callable(f.seek):
+            f.seek(0)
+        return f
+
+
 class AstaForm(forms.ModelForm):
     # Spiegazione: Stiamo creando un form direttamente collegato al modello Asta.
     # Questo ci permette di non dover ridefinire i campi che esistono già nel modello.
@@ -56,6 +110,7 @@ class AstaForm(forms.ModelForm):
         
         # Specifichiamo quali campi del modello Asta devono apparire nel form.
         fields = ['titolo', 'descrizione', 'immagine', 'categoria', 'prezzo_base', 'rilancio_minimo', 'data_fine']
+        field_classes = {'immagine': ImmagineAstaField}
 
         # Spiegazione: Qui sta la magia! Il dizionario `widgets` ci permette di
         # sovrascrivere il widget di default per qualsiasi campo.
@@ -70,6 +125,24 @@ class AstaForm(forms.ModelForm):
                 attrs={'rows': 4, 'class':'form-control'} # Rendiamo il campo descrizione un po' più grande.
             ),
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # L'immagine attuale, da rilasciare se il venditore ne carica una nuova.
+        self.immagine_precedente = (self.instance.immagine.name, self.instance.derivati)
+
+    def save(self, commit=True):
+        # Spiegazione: Se è stata caricata una nuova immagine, i vecchi derivati non valgono più
+        # e ne generiamo di nuovi dopo il salvataggio, fuori dalla richiesta (vedi aste/immagini.py).
+        immagine_cambiata = 'immagine' in self.changed_data
+        if immagine_cambiata:
+            self.instance.derivati = {}
+        asta = super().save(commit)
+        if commit and immagine_cambiata:
+            pianifica_derivati(asta)
+            nome, derivati = self.immagine_precedente
+            transaction.on_commit(lambda: rilascia_immagine(nome, derivati))
+        return asta
         
         
 class FeedbackForm(forms.ModelForm):
@@ -133,6 +206,7 @@ class SearchForm(forms.Form):
 
     # Creiamo le scelte per l'ordinamento
     ORDINA_PER_CHOICES = (
+        ('rilevanza', 'Rilevanza (con parola chiave)'),
         ('data_fine', 'Tempo rimanente (più vicine alla scadenza)'),
         ('-data_fine', 'Tempo rimanente (più lontane dalla scadenza)'),
         ('prezzo_attuale', 'Prezzo (crescente)'),
@@ -144,4 +218,13 @@ class SearchForm(forms.Form):
         choices=ORDINA_PER_CHOICES,
         required=False,
         widget=forms.Select(attrs={'class': 'form-control'})
-    )
\ No newline at end of file
+    )
+
+    def mostra_conteggi(self, statistiche_categorie):
+        # Spiegazione: aggiunge a ogni categoria del menu il numero di aste attive,
+        # es. "Elettronica (12)". I conteggi arrivano già calcolati dalla cache,
+        # quindi il menu non richiede query aggiuntive.
+        def etichetta(categoria):
+            conteggio = statistiche_categorie.get(categoria.pk, {}).get('conteggio', 0)
+            return f"{categoria.nome} ({conteggio})"
+        self.fields['categoria'].label_from_instance = etichetta
@@ -0,0 +1,215 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from .models import Asta, ContenutoImmagine
+from .storage import CARTELLA_DERIVATI, impronta_breve
+
+logger = logging.getLogger(__name__)
+
+# Formato -> (formato Pillow, estensione, opzioni di salvataggio).
+# Il JPEG resta come alternativa per i browser senza WebP.
+FORMATI = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Formati dell'originale che vengono ricodificati senza metadati EXIF (vedi `_senza_metadati`).
+ORIGINALI_RICODIFICABILI = {
+    'JPEG': ('jpg', {'quality': 90}),
+    'WEBP': ('webp', {'quality': 90}),
+    'PNG': ('png', {'optimize': True}),
+}
+
+_esecutore = None
+
+
+def larghezze_derivati():
+    return getattr(settings, 'ASTE_LARGHEZZE_IMMAGINI', (320, 640, 1280))
+
+
+def _in_rgb(immagine):
+    # JPEG non ha trasparenza: le immagini con canale alfa (PNG, GIF, WebP)
+    # vengono appoggiate su uno sfondo bianco invece di diventare nere.
+    if immagine.mode in ('RGBA', 'LA') or (immagine.mode == 'P' and 'transparency' in immagine.info):
+        immagine = immagine.convert('RGBA')
+        sfondo = Image.new('RGB', immagine.size, (255, 255, 255))
+        sfondo.paste(immagine, mask=immagine.getchannel('A'))
+        return sfondo
+    return immagine.convert('RGB')
+
+
+def _senza_metadati(contenuto):
+    """
+    Se l'immagine ha metadati EXIF (posizione GPS, modello del telefono, ...)
+    restituisce (estensione, contenuto) della stessa immagine già ruotata e
+    ricodificata senza EXIF; altrimenti None e l'originale resta intatto.
+    """
+    with Image.open(BytesIO(contenuto)) as originale:
+        if originale.format not in ORIGINALI_RICODIFICABILI or not originale.getexif():
+            return None
+        estensione, opzioni = ORIGINALI_RICODIFICABILI[originale.format]
+        formato, profilo_colore = originale.format, originale.info.get('icc_profile')
+        pulita = ImageOps.exif_transpose(originale)
+        buffer = BytesIO()
+        # Pillow scrive l'EXIF solo se lo si passa esplicitamente; il profilo colore lo teniamo.
+        pulita.save(buffer, formato, icc_profile=profilo_colore, **opzioni)
+    return estensione, buffer.getvalue()
+
+
+def rilascia_immagine(nome, derivati=None):
+    """
+    Cancella il file `nome` (e i suoi derivati) se nessuna asta lo usa più.
+
+    Con lo storage per contenuto (vedi aste/storage.py) più aste possono
+    condividere lo stesso file: il numero di riferimenti è il numero di aste
+    con quel nome, e il file sparisce solo con l'ultima. I derivati sono
+    condivisi per impronta del contenuto (anche tra originali con estensioni
+    diverse): un gruppo di derivati si cancella solo se nessuna asta ha un
+    originale o un derivato con la stessa impronta.
+
+    Il controllo e la cancellazione avvengono sotto il lock delle righe
+    `ContenutoImmagine` delle impronte coinvolte, lo stesso che lo storage
+    prende quando salva un file e tiene fino al commit dell'asta: un
+    caricamento concorrente dello stesso contenuto o ha già la sua asta nel
+    database (e il file resta), o aspetta la cancellazione e riscrive il file.
+    """
+    if not nome:
+        return
+    storage = Asta._meta.get_field('immagine').storage
+    gruppi = {}
+    for varianti in (derivati or {}).values():
+        for derivato in varianti.values():
+            gruppi.setdefault(impronta_breve(derivato), []).append(derivato)
+    impronte = set(gruppi) | {impronta_breve(nome)}
+    with transaction.atomic():
+        ContenutoImmagine.objects.blocca(impronta for impronta in impronte if impronta)
+        if Asta.objects.filter(immagine=nome).exists():
+            return
+        storage.delete(nome)
+        for impronta, nomi in gruppi.items():
+            if impronta and _impronta_in_uso(impronta):
+                continue
+            for derivato in nomi:
+                storage.delete(derivato)
+
+
+def _impronta_in_uso(impronta):
+    # Un'asta usa i derivati di questa impronta se il suo originale ha lo stesso
+    # contenuto o se li ha già registrati (originali con nomi scelti dall'utente).
+    return Asta.objects.filter(
+        Q(immagine__startswith=f'aste_images/{impronta}') |
+        Q(derivati__icontains=f'{CARTELLA_DERIVATI}/{impronta}_')
+    ).exists()
+
+
+def _ripulisci_originale(asta_pk, storage, nome, contenuto):
+    # Sostituisce l'originale caricato con la versione senza EXIF.
+    # Restituisce (nome, contenuto) da usare per i derivati, o None se l'asta
+    # nel frattempo ha cambiato immagine.
+    ripulita = _senza_metadati(contenuto)
+    if ripulita is None:
+        return nome, contenuto
+    estensione, contenuto = ripulita
+    # Lo storage nomina il file in base al contenuto: conta solo l'estensione.
+    # Salvataggio e aggiornamento nella stessa transazione (vedi `rilascia_immagine`).
+    with transaction.atomic():
+        nuovo = storage.save(f"aste_images/ripulita.{estensione}", ContentFile(contenuto))
+        if not Asta.objects.filter(pk=asta_pk, immagine=nome).update(immagine=nuovo):
+            rilascia_immagine(nuovo)
+            return None
+    rilascia_immagine(nome)
+    return nuovo, contenuto
+
+
+def genera_derivati(asta_pk):
+    """
+    Crea le versioni ridotte (WebP e JPEG, una per ogni larghezza di
+    `ASTE_LARGHEZZE_IMMAGINI`) dell'immagine dell'asta e le registra nel campo
+    `derivati`, usato dai template per `srcset`.
+
+    Prima, se l'originale contiene metadati EXIF, lo sostituisce con una copia
+    ricodificata senza (vedi `_senza_metadati`).
+
+    I nomi dei file contengono l'impronta SHA-256 dell'originale: la stessa
+    immagine produce sempre gli stessi file, che quindi non vengono rigenerati
+    e possono essere messi in cache dal browser senza scadenza.
+    """
+    asta = Asta.objects.filter(pk=asta_pk).first()
+    if asta is None or not asta.immagine:
+        return None
+    storage = asta.immagine.storage
+    with storage.open(asta.immagine.name, 'rb') as file:
+        contenuto = file.read()
+    ripulito = _ripulisci_originale(asta_pk, storage, asta.immagine.name, contenuto)
+    if ripulito is None:
+        return None
+    nome_originale, contenuto = ripulito
+    impronta = hashlib.sha256(contenuto).hexdigest()[:16]
+
+    with Image.open(BytesIO(contenuto)) as originale:
+        # Applichiamo l'orientamento EXIF prima di ridimensionare (foto da smartphone).
+        immagine = _in_rgb(ImageOps.exif_transpose(originale))
+
+    # Le larghezze maggiori dell'originale si riducono a una sola versione
+    # alla larghezza originale: non ingrandiamo mai.
+    larghezze = sorted({min(larghezza, immagine.width) for larghezza in larghezze_derivati()})
+    derivati = {formato: {} for formato in FORMATI}
+    for larghezza in larghezze:
+        ridotta = immagine
+        if larghezza < immagine.width:
+            altezza = max(1, round(immagine.height * larghezza / immagine.width))
+            ridotta = immagine.resize((larghezza, altezza), Image.LANCZOS)
+        for formato, (formato_pil, estensione, opzioni) in FORMATI.items():
+            nome = f"{CARTELLA_DERIVATI}/{impronta}_{larghezza}.{estensione}"
+            if not storage.exists(nome):
+                buffer = BytesIO()
+                ridotta.save(buffer, formato_pil, **opzioni)
+                storage.save(nome, ContentFile(buffer.getvalue()))
+            derivati[formato][str(larghezza)] = nome
+
+    # Se nel frattempo il venditore ha cambiato immagine, questi derivati sono già vecchi.
+    aggiornate = Asta.objects.filter(pk=asta_pk, immagine=nome_originale).update(derivati=derivati)
+    if aggiornate:
+        from .signals import invalida_dettaglio_asta
+        asta.immagine.name, asta.derivati = nome_originale, derivati
+        invalida_dettaglio_asta(asta)
+    return derivati
+
+
+def _genera_in_background(asta_pk):
+    try:
+        genera_derivati(asta_pk)
+    except Exception:
+        # L'asta resta con l'immagine originale: la si può rigenerare con
+        # `python manage.py genera_derivati_immagini`.
+        logger.exception("Generazione dei derivati fallita: asta=%s", asta_pk)
+    finally:
+        # Questo thread non è gestito da Django: chiudiamo le sue connessioni.
+        connections.close_all()
+
+
+def _avvia(asta_pk):
+    global _esecutore
+    if not getattr(settings, 'ASTE_DERIVATI_IN_BACKGROUND', True):
+        genera_derivati(asta_pk)
+        return
+    if _esecutore is None:
+        _esecutore = ThreadPoolExecutor(max_workers=2, thread_name_prefix='derivati')
+    _esecutore.submit(_genera_in_background, asta_pk)
+
+
+def pianifica_derivati(asta):
+    """
+    Genera i derivati dopo il commit, in un thread separato: la richiesta
+    che ha caricato l'immagine non aspetta il ridimensionamento.
+    """
+    asta_pk = asta.pk
+    transaction.on_commit(lambda: _avvia(asta_pk))
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import time
+
+
+def worker(redis_url, gruppo, n_consumer, n_messaggi, timeout, pronti, risultati):
+    """
+    Processo separato che simula un worker Daphne: apre `n_consumer` canali,
+    li iscrive al gruppo dell'asta e registra l'istante di arrivo di ogni offerta.
+    """
+    os.environ['REDIS_URL'] = redis_url
+    import django
+    django.setup()
+    from channels.layers import get_channel_layer
+
+    async def consumer(channel_layer, canale, ricevuti):
+        while len(ricevuti) < n_messaggi:
+            messaggio = await channel_layer.receive(canale)
+            ricevuti.append((messaggio['dati_offerta']['nuovo_prezzo'], time.time()))
+
+    async def principale():
+        channel_layer = get_channel_layer()
+        canali = [await channel_layer.new_channel() for _ in range(n_consumer)]
+        for canale in canali:
+            await channel_layer.group_add(gruppo, canale)
+        pronti.put(os.getpid())
+
+        ricevuti = [[] for _ in canali]
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(consumer(channel_layer, canale, r) for canale, r in zip(canali, ricevuti))),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            pass
+        for canale in canali:
+            await channel_layer.group_discard(gruppo, canale)
+        return [arrivo for r in ricevuti for arrivo in r]
+
+    risultati.put(asyncio.run(principale()))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from aste.immagini import rilascia_immagine
+from aste.models import Asta
+from aste.storage import nome_per_contenuto
+
+
+class Command(BaseCommand):
+    help = (
+        "Sposta le immagini caricate prima dello storage per contenuto sotto il loro nome "
+        "basato sull'impronta: le copie identiche diventano un solo file e quelle non più usate vengono cancellate."
+    )
+
+    def handle(self, *args, **options):
+        storage = Asta._meta.get_field('immagine').storage
+        nomi = (
+            Asta.objects.exclude(immagine='').order_by('immagine')
+            .values_list('immagine', flat=True).distinct()
+        )
+        spostati, mancanti, peso_prima = 0, 0, 0
+        nuovi = set()
+        for nome in list(nomi):
+            if nome_per_contenuto(nome):
+                continue
+            if not storage.exists(nome):
+                mancanti += 1
+                self.stderr.write(f"File mancante: {nome}")
+                continue
+            peso_prima += storage.size(nome)
+            # Come in `Asta.save`: il nuovo file non può essere cancellato
+            # prima che le aste puntino a lui (vedi `rilascia_immagine`).
+            with transaction.atomic():
+                with storage.open(nome, 'rb') as file:
+                    nuovo = storage.save(nome, file)
+                # Se il contenuto era già archiviato il file nuovo non occupa altro spazio.
+                Asta.objects.filter(immagine=nome).update(immagine=nuovo)
+            rilascia_immagine(nome)
+            nuovi.add(nuovo)
+            spostati += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Immagini archiviate per contenuto: {spostati}."))
+        if spostati:
+            peso_dopo = sum(storage.size(nome) for nome in nuovi)
+            self.stdout.write(
+                f"  {spostati} file ({peso_prima / 1024:.0f} KB) -> {len(nuovi)} file ({peso_dopo / 1024:.0f} KB)"
+            )
+        if mancanti:
+            self.stderr.write(self.style.ERROR(f"{mancanti} immagini non trovate."))
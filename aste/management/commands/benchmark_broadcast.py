@@ -0,0 +1,158 @@
+import multiprocessing
+import statistics
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from aste.models import Asta, Categoria, Profile
+from aste.offerte import annuncia_offerta, piazza_offerta
+
+# Il worker sta in un modulo a parte: i processi avviati con 'spawn' lo importano
+# prima di django.setup(), quindi non può importare i modelli.
+from ._worker_broadcast import worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark del broadcast delle offerte: più processi worker tengono aperti N consumer "
+        "sulla stessa asta e viene misurata la latenza tra l'offerta e l'arrivo su ogni consumer. "
+        "Richiede un channel layer condiviso tra processi (REDIS_URL o --fakeredis)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processi', type=int, default=4, help="Numero di processi worker.")
+        parser.add_argument('--consumer', type=int, default=25, help="Consumer collegati per ogni processo.")
+        parser.add_argument('--offerte', type=int, default=50, help="Offerte da piazzare (e quindi messaggi da ricevere).")
+        parser.add_argument('--pausa', type=float, default=0.01, help="Secondi di attesa tra un'offerta e la successiva.")
+        parser.add_argument('--timeout', type=float, default=30, help="Secondi massimi di attesa dei worker.")
+        parser.add_argument(
+            '--fakeredis', action='store_true',
+            help="Avvia un server Redis finto (fakeredis) in questo processo invece di usare REDIS_URL."
+        )
+
+    def handle(self, *args, **options):
+        server = None
+        if options['fakeredis']:
+            server, redis_url = self.avvia_fakeredis()
+        elif settings.REDIS_URL:
+            redis_url = settings.REDIS_URL
+        else:
+            raise CommandError(
+                "Il channel layer in memoria non è condiviso tra processi: "
+                "imposta REDIS_URL oppure usa --fakeredis."
+            )
+
+        configurazione = {
+            "default": {
+                "BACKEND": "channels_redis.core.RedisChannelLayer",
+                "CONFIG": {"hosts": [redis_url]},
+            }
+        }
+        try:
+            with override_settings(CHANNEL_LAYERS=configurazione):
+                self.esegui(redis_url, options)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    def avvia_fakeredis(self):
+        try:
+            from fakeredis import TcpFakeServer
+        except ImportError:
+            raise CommandError("fakeredis non è installato (pipenv install --dev).")
+        server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, porta = server.server_address
+        return server, f"redis://{host}:{porta}/0"
+
+    def esegui(self, redis_url, options):
+        n_processi = options['processi']
+        n_consumer = options['consumer']
+        n_offerte = options['offerte']
+        prefisso = f"bench_{uuid.uuid4().hex[:8]}"
+
+        # 1. Prepariamo l'asta e due offerenti che rilanciano a turno.
+        venditore = User.objects.create_user(username=f"{prefisso}_venditore")
+        Profile.objects.create(user=venditore, ruolo='venditore')
+        categoria = Categoria.objects.create(nome=f"{prefisso}_categoria")
+        asta = Asta.objects.create(
+            venditore=venditore,
+            titolo="Asta benchmark",
+            descrizione="Asta creata da benchmark_broadcast",
+            immagine='aste_images/benchmark.jpg',
+            categoria=categoria,
+            prezzo_base=1,
+            rilancio_minimo=1,
+            data_fine=timezone.now() + timedelta(hours=1),
+        )
+        offerenti = []
+        for i in range(2):
+            user = User.objects.create_user(username=f"{prefisso}_offerente_{i}")
+            Profile.objects.create(user=user, ruolo='acquirente')
+            offerenti.append(user)
+
+        # 2. Avviamo i worker e aspettiamo che tutti i consumer siano iscritti al gruppo.
+        contesto = multiprocessing.get_context('spawn')
+        pronti, risultati = contesto.Queue(), contesto.Queue()
+        processi = [
+            contesto.Process(
+                target=worker,
+                args=(redis_url, f'asta_{asta.pk}', n_consumer, n_offerte, options['timeout'], pronti, risultati),
+            )
+            for _ in range(n_processi)
+        ]
+        try:
+            for processo in processi:
+                processo.start()
+            for _ in processi:
+                pronti.get(timeout=options['timeout'])
+
+            # 3. Piazziamo le offerte e annunciamo ciascuna come fa `fai_offerta`,
+            #    annotando l'istante in cui l'offerta è partita.
+            partenze = {}
+            for i in range(n_offerte):
+                inizio = time.time()
+                esito = piazza_offerta(asta.pk, offerenti[i % 2], asta.prezzo_base + i + 1)
+                if not esito.accettata:
+                    raise CommandError(f"Offerta rifiutata: {esito.errore}")
+                annuncia_offerta(esito.offerta)
+                partenze[f"{esito.offerta.importo:.2f}"] = inizio
+                time.sleep(options['pausa'])
+
+            arrivi = []
+            for _ in processi:
+                arrivi.extend(risultati.get(timeout=options['timeout'] + 10))
+        finally:
+            for processo in processi:
+                processo.join(timeout=5)
+                if processo.is_alive():
+                    processo.terminate()
+            asta.delete()
+            categoria.delete()
+            User.objects.filter(username__startswith=prefisso).delete()
+
+        # 4. Riepilogo delle latenze (offerta -> consumer), in millisecondi.
+        attesi = n_processi * n_consumer * n_offerte
+        latenze = sorted((arrivo - partenze[prezzo]) * 1000 for prezzo, arrivo in arrivi)
+        self.stdout.write(
+            f"Processi: {n_processi}, consumer totali: {n_processi * n_consumer}, offerte: {n_offerte}"
+        )
+        self.stdout.write(f"  messaggi consegnati: {len(latenze)}/{attesi}")
+        if latenze:
+            percentile = lambda p: latenze[min(len(latenze) - 1, int(len(latenze) * p))]
+            self.stdout.write(
+                f"  latenza p50: {statistics.median(latenze):.1f} ms, p95: {percentile(0.95):.1f} ms, "
+                f"p99: {percentile(0.99):.1f} ms, max: {latenze[-1]:.1f} ms"
+            )
+        if len(latenze) == attesi:
+            self.stdout.write(self.style.SUCCESS("Tutti i consumer hanno ricevuto tutte le offerte."))
+        else:
+            self.stderr.write(self.style.ERROR("Alcuni messaggi non sono stati consegnati."))
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.conf import settings
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from aste.models import Asta, Categoria, Profile
+from aste.offerte import piazza_offerta
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark di concorrenza: N offerenti in parallelo rilanciano sulla stessa asta "
+        "e viene misurato il numero di offerte accettate al secondo. "
+        "Con --http le offerte passano dalla vista asincrona `fai_offerta` (AsyncClient) "
+        "e vengono riportate anche le latenze p50/p99."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offerenti', type=int, default=20, help="Numero di offerenti in parallelo (thread).")
+        parser.add_argument('--offerte', type=int, default=25, help="Offerte tentate da ciascun offerente.")
+        parser.add_argument('--mantieni', action='store_true', help="Non cancella i dati creati per il benchmark.")
+        parser.add_argument(
+            '--http', action='store_true',
+            help="Invia le offerte come richieste HTTP alla vista (tutte concorrenti su un event loop).",
+        )
+
+    def handle(self, *args, **options):
+        n_offerenti = options['offerenti']
+        n_offerte = options['offerte']
+        prefisso = f"bench_{uuid.uuid4().hex[:8]}"
+
+        # 1. Prepariamo un'asta "calda" e gli offerenti.
+        venditore = User.objects.create_user(username=f"{prefisso}_venditore")
+        Profile.objects.create(user=venditore, ruolo='venditore')
+        categoria = Categoria.objects.create(nome=f"{prefisso}_categoria")
+        asta = Asta.objects.create(
+            venditore=venditore,
+            titolo="Asta benchmark",
+            descrizione="Asta creata da benchmark_offerte",
+            immagine='aste_images/benchmark.jpg',
+            categoria=categoria,
+            prezzo_base=1,
+            rilancio_minimo=1,
+            data_fine=timezone.now() + timedelta(hours=1),
+        )
+        offerenti = []
+        for i in range(n_offerenti):
+            user = User.objects.create_user(username=f"{prefisso}_offerente_{i}")
+            Profile.objects.create(user=user, ruolo='acquirente')
+            offerenti.append(user)
+
+        risultati = {'accettate': 0, 'superate': 0, 'rifiutate': 0, 'errori': 0}
+        if options['http']:
+            # AsyncClient usa l'host 'testserver', accettato di solito solo durante i test.
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                durata, latenze = asyncio.run(self.offerte_http(asta, offerenti, n_offerte, risultati))
+        else:
+            durata, latenze = self.offerte_thread(asta, offerenti, n_offerte, risultati), []
+
+        asta.refresh_from_db()
+        self.stdout.write(f"Offerenti: {n_offerenti}, tentativi: {n_offerenti * n_offerte}, durata: {durata:.2f}s")
+        for chiave, valore in risultati.items():
+            self.stdout.write(f"  {chiave}: {valore}")
+        self.stdout.write(self.style.SUCCESS(f"Offerte accettate al secondo: {risultati['accettate'] / durata:.1f}"))
+        if latenze:
+            latenze.sort()
+            p99 = latenze[min(len(latenze) - 1, int(len(latenze) * 0.99))]
+            self.stdout.write(
+                f"Latenza per offerta: p50 {statistics.median(latenze) * 1000:.1f} ms, "
+                f"p99 {p99 * 1000:.1f} ms, max {latenze[-1] * 1000:.1f} ms"
+            )
+
+        # Le offerte accettate devono coincidere con il contatore sull'asta.
+        if asta.numero_offerte != risultati['accettate'] or asta.offerte.count() != risultati['accettate']:
+            self.stderr.write(self.style.ERROR("Incoerenza: il numero di offerte salvate non corrisponde alle accettate!"))
+
+        # 3. Puliamo i dati creati, a meno che non sia richiesto di mantenerli.
+        if not options['mantieni']:
+            asta.delete()
+            categoria.delete()
+            User.objects.filter(username__startswith=prefisso).delete()
+
+    def offerte_thread(self, asta, offerenti, n_offerte, risultati):
+        # Ogni offerente è un thread che chiama direttamente `piazza_offerta`.
+        lock = threading.Lock()
+        partenza = threading.Barrier(len(offerenti))
+
+        def offerente(user):
+            # Ogni thread usa la propria connessione al database.
+            try:
+                partenza.wait()
+                for _ in range(n_offerte):
+                    # Ogni offerente rilancia sul prezzo che vede in questo momento,
+                    # esattamente come farebbe un utente negli ultimi secondi dell'asta.
+                    prezzo = Asta.objects.values_list('prezzo_attuale', flat=True).get(pk=asta.pk)
+                    try:
+                        esito = piazza_offerta(asta.pk, user, prezzo + 1)
+                        chiave = 'accettate' if esito.accettata else ('superate' if esito.superata else 'rifiutate')
+                    except Exception as e:
+                        self.stderr.write(f"Errore inatteso: {e!r}")
+                        chiave = 'errori'
+                    with lock:
+                        risultati[chiave] += 1
+            finally:
+                connection.close()
+
+        # 2. Lanciamo tutti gli offerenti insieme e misuriamo il tempo totale.
+        inizio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(offerenti)) as executor:
+            list(executor.map(offerente, offerenti))
+        durata = time.perf_counter() - inizio
+        return durata
+
+    async def offerte_http(self, asta, offerenti, n_offerte, risultati):
+        """
+        Ogni offerente è una coroutine con il proprio AsyncClient (sessione autenticata):
+        tutte le richieste sono concorrenti sullo stesso event loop, come i client
+        collegati a un worker Daphne. Restituisce la durata e le latenze delle richieste.
+        """
+        url = reverse('aste:fai_offerta', args=[asta.pk])
+        # Le risposte 409 (offerta superata) sono attese: non le vogliamo tra i warning di django.request.
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        clients = []
+        for user in offerenti:
+            client = AsyncClient()
+            await client.aforce_login(user)
+            clients.append(client)
+
+        latenze = []
+        via = asyncio.Event()
+
+        async def offerente(client):
+            await via.wait()
+            for _ in range(n_offerte):
+                # Come nella modalità a thread, si rilancia sul prezzo visto in questo momento.
+                prezzo = await Asta.objects.values_list('prezzo_attuale', flat=True).aget(pk=asta.pk)
+                inizio = time.perf_counter()
+                try:
+                    response = await client.post(url, {'importo': str(prezzo + 1)}, content_type='application/json')
+                except Exception as e:
+                    self.stderr.write(f"Errore inatteso: {e!r}")
+                    risultati['errori'] += 1
+                    continue
+                latenze.append(time.perf_counter() - inizio)
+                dati = response.json()
+                if response.status_code == 200:
+                    risultati['accettate'] += 1
+                elif dati.get('superata'):
+                    risultati['superate'] += 1
+                else:
+                    risultati['rifiutate'] += 1
+
+        compiti = [asyncio.create_task(offerente(client)) for client in clients]
+        inizio = time.perf_counter()
+        via.set()
+        await asyncio.gather(*compiti)
+        return time.perf_counter() - inizio, latenze
@@ -0,0 +1,97 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from aste.models import Asta, Categoria
+from aste.ricerca import BackendIcontains, backend_ricerca
+
+OGGETTI = [
+    'chitarra', 'orologio', 'bicicletta', 'lampada', 'divano', 'fotocamera', 'smartphone', 'giacca',
+    'libro', 'vinile', 'casco', 'moto', 'tavolo', 'quadro', 'anello', 'console', 'zaino', 'profumo',
+]
+AGGETTIVI = [
+    'vintage', 'nuovo', 'usato', 'elettrica', 'antico', 'raro', 'originale', 'artigianale',
+    'professionale', 'compatto', 'elegante', 'sportivo', 'classico', 'moderno', 'restaurato',
+]
+MARCHE = ['Fender', 'Rolex', 'Bianchi', 'Artemide', 'Canon', 'Leica', 'Ducati', 'Gibson', 'Olivetti', 'Vespa']
+PAROLE = [
+    'ottimo', 'stato', 'spedizione', 'inclusa', 'garanzia', 'scatola', 'accessori', 'perfettamente',
+    'funzionante', 'segni', 'usura', 'collezione', 'privata', 'pezzo', 'unico', 'consegna', 'mano',
+    'fattura', 'colore', 'nero', 'bianco', 'rosso', 'legno', 'metallo', 'pelle', 'anni', 'ottanta',
+]
+
+# Parole cercate: comuni, rare, prefissi e parole presenti solo nella descrizione.
+RICERCHE = ['chitarra', 'rolex vintage', 'ducati', 'chit', 'collezione privata', 'olivetti restaurato']
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un corpus di aste (annullato alla fine) e confronta la latenza della ricerca "
+        "testuale del motore configurato con quella della vecchia ricerca icontains."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--aste', type=int, default=100_000, help="Numero di aste da generare.")
+        parser.add_argument('--ripetizioni', type=int, default=5, help="Ripetizioni di ogni ricerca.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        # Tutto il corpus viene creato in una transazione annullata alla fine:
+        # il database non viene modificato.
+        with transaction.atomic():
+            self.genera_corpus(options['aste'])
+            self.confronta(options['ripetizioni'])
+            transaction.set_rollback(True)
+
+    def genera_corpus(self, quante):
+        inizio = time.perf_counter()
+        venditore = User.objects.create_user(username='benchmark_ricerca_venditore')
+        categoria = Categoria.objects.create(nome='benchmark_ricerca_categoria')
+        adesso = timezone.now()
+        aste = []
+        for i in range(quante):
+            titolo = f"{random.choice(OGGETTI)} {random.choice(MARCHE)} {random.choice(AGGETTIVI)}"
+            descrizione = ' '.join(random.choices(PAROLE + OGGETTI + AGGETTIVI, k=random.randint(15, 40)))
+            aste.append(Asta(
+                venditore=venditore,
+                titolo=titolo.capitalize(),
+                descrizione=descrizione.capitalize(),
+                immagine='aste_images/benchmark.jpg',
+                categoria=categoria,
+                prezzo_base=10,
+                prezzo_attuale=10,
+                rilancio_minimo=1,
+                data_fine=adesso + timedelta(minutes=random.randint(1, 60 * 24 * 30)),
+            ))
+        Asta.objects.bulk_create(aste, batch_size=5000)
+        # bulk_create non invia i segnali: ricostruiamo l'indice in un colpo solo.
+        backend_ricerca().ricostruisci_indice()
+        self.stdout.write(f"Generate {quante} aste in {time.perf_counter() - inizio:.1f}s")
+
+    def misura(self, backend, testo, ordinamento, ripetizioni):
+        tempi = []
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            # Come la pagina dei risultati: prima pagina ordinata più conteggio totale.
+            queryset = backend.filtra(Asta.objects.filter(stato='attiva'), testo)
+            list(queryset.order_by(*ordinamento)[:10])
+            totale = queryset.count()
+            tempi.append((time.perf_counter() - inizio) * 1000)
+        return statistics.median(tempi), totale
+
+    def confronta(self, ripetizioni):
+        backend = backend_ricerca()
+        icontains = BackendIcontains()
+        self.stdout.write(f"Motore di ricerca: {type(backend).__name__}")
+        self.stdout.write(f"{'ricerca':<24}{'icontains ms':>14}{'risultati':>11}{'indice ms':>12}{'risultati':>11}")
+        for testo in RICERCHE:
+            ms_lento, tot_lento = self.misura(icontains, testo, ['data_fine'], ripetizioni)
+            ms_indice, tot_indice = self.misura(backend, testo, ['-rilevanza', 'data_fine'], ripetizioni)
+            self.stdout.write(f"{testo:<24}{ms_lento:>14.1f}{tot_lento:>11}{ms_indice:>12.1f}{tot_indice:>11}")
@@ -0,0 +1,188 @@
+import json
+import statistics
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from aste.forms import SearchForm
+from aste.models import Asta, Offerta
+
+
+def percentile(valori, quota):
+    ordinati = sorted(valori)
+    return ordinati[min(len(ordinati) - 1, int(len(ordinati) * quota))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Misura le viste più usate (home, ricerca con ogni ordinamento, dettaglio asta, profilo "
+        "e offerta) sui dati presenti nel database, ad esempio quelli creati da `genera_dati`, "
+        "e riporta per ognuna il numero di query e la latenza p50/p95. Con --output i risultati "
+        "vengono salvati in JSON, con --confronta vengono confrontati con un'esecuzione precedente. "
+        "Le offerte piazzate durante la misura vengono annullate alla fine: per questo il lavoro "
+        "rimandato al commit (`transaction.on_commit`, es. invalidazione delle statistiche e "
+        "notifiche) non viene eseguito né misurato."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ripetizioni', type=int, default=30, help="Richieste misurate per ogni vista.")
+        parser.add_argument(
+            '--riscaldamento', type=int, default=2,
+            help="Richieste non misurate prima di ogni vista (cache e statement già pronti).",
+        )
+        parser.add_argument('--ricerca', default='chitarra', help="Parola chiave delle ricerche.")
+        parser.add_argument('--output', help="File JSON in cui salvare i risultati.")
+        parser.add_argument('--confronta', help="File JSON di un'esecuzione precedente da confrontare.")
+        parser.add_argument('--etichetta', default='', help="Descrizione dell'esecuzione salvata nel JSON.")
+
+    def handle(self, *args, **options):
+        precedente = None
+        if options['confronta']:
+            with open(options['confronta'], encoding='utf-8') as file:
+                precedente = json.load(file)
+
+        # Il client usa l'host 'testserver', accettato di solito solo durante i test.
+        # Tutto avviene in una transazione annullata: le offerte di prova non restano nel database,
+        # ma le callback `on_commit` non partono mai, quindi i tempi non le comprendono.
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), transaction.atomic():
+            risultati = {
+                'data': datetime.now().isoformat(timespec='seconds'),
+                'etichetta': options['etichetta'],
+                'database': {
+                    'aste': Asta.objects.count(),
+                    'aste_attive': Asta.objects.filter(stato='attiva').count(),
+                    'offerte': Offerta.objects.count(),
+                    'utenti': User.objects.count(),
+                },
+                'ripetizioni': options['ripetizioni'],
+                'note': "Transazione annullata: il lavoro in transaction.on_commit è escluso dai tempi.",
+                'viste': {},
+            }
+            for nome, client, metodo, url, dati in self.scenari(options['ricerca']):
+                risultati['viste'][nome] = self.misura(
+                    client, metodo, url, dati, options['ripetizioni'], options['riscaldamento']
+                )
+            transaction.set_rollback(True)
+
+        self.stampa(risultati, precedente)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(risultati, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Risultati salvati in {options['output']}"))
+
+    def scenari(self, parola):
+        # L'asta con più offerte: la pagina più pesante e quella dove si rilancia di più.
+        asta = (
+            Asta.objects.filter(stato='attiva', numero_offerte__gt=0)
+            .select_related('venditore', 'miglior_offerente').order_by('-numero_offerte').first()
+        )
+        if asta is None:
+            raise CommandError("Nessuna asta attiva con offerte: genera prima i dati con `genera_dati`.")
+        acquirente = asta.miglior_offerente
+        # Un secondo acquirente, così le offerte si alternano come in un'asta vera.
+        sfidante = (
+            User.objects.filter(profile__ruolo='acquirente').exclude(pk=acquirente.pk).order_by('pk').first()
+        )
+        if sfidante is None:
+            raise CommandError("Servono almeno due acquirenti.")
+
+        anonimo = Client()
+        clients = {}
+        for utente in (acquirente, sfidante, asta.venditore):
+            clients[utente.pk] = Client()
+            clients[utente.pk].force_login(utente)
+
+        scenari = [
+            ('home', anonimo, 'get', reverse('aste:home'), None),
+            ('home_acquirente', clients[acquirente.pk], 'get', reverse('aste:home'), None),
+        ]
+        for ordina_per, _ in SearchForm.ORDINA_PER_CHOICES:
+            scenari.append((
+                f'ricerca_{ordina_per.replace("-", "desc_")}', anonimo, 'get',
+                f"{reverse('aste:ricerca')}?keyword={parola}&ordina_per={ordina_per}", None,
+            ))
+        dettaglio = reverse('aste:dettaglio_asta', args=[asta.pk])
+        scenari += [
+            ('dettaglio_anonimo', anonimo, 'get', dettaglio, None),
+            ('dettaglio_acquirente', clients[acquirente.pk], 'get', dettaglio, None),
+            ('profilo_acquirente', clients[acquirente.pk], 'get', reverse('aste:profilo'), None),
+            ('profilo_venditore', clients[asta.venditore.pk], 'get', reverse('aste:profilo'), None),
+        ]
+
+        # Ogni offerta supera la precedente di un rilancio minimo; i due acquirenti
+        # si alternano: il client riceve (utente, importo) ad ogni richiesta.
+        prezzo = [asta.prezzo_attuale]
+        offerenti = [sfidante, acquirente]
+
+        def prossima_offerta(indice):
+            prezzo[0] += asta.rilancio_minimo
+            return clients[offerenti[indice % 2].pk], {'importo': str(prezzo[0])}
+
+        scenari.append(('fai_offerta', None, 'post', reverse('aste:fai_offerta', args=[asta.pk]), prossima_offerta))
+        return scenari
+
+    def misura(self, client, metodo, url, dati, ripetizioni, riscaldamento):
+        tempi, query, errori = [], [], 0
+        for indice in range(riscaldamento + ripetizioni):
+            if callable(dati):
+                # Le offerte cambiano a ogni richiesta (importo e offerente).
+                client, corpo = dati(indice)
+                richiesta = lambda: client.post(url, json.dumps(corpo), content_type='application/json')
+            else:
+                richiesta = lambda: getattr(client, metodo)(url)
+            with CaptureQueriesContext(connection) as eseguite:
+                inizio = time.perf_counter()
+                risposta = richiesta()
+                durata = (time.perf_counter() - inizio) * 1000
+            if indice < riscaldamento:
+                continue
+            tempi.append(durata)
+            query.append(len(eseguite))
+            if risposta.status_code >= 400:
+                errori += 1
+        return {
+            'url': url,
+            'query': max(query),
+            'query_min': min(query),
+            'p50_ms': round(statistics.median(tempi), 2),
+            'p95_ms': round(percentile(tempi, 0.95), 2),
+            'max_ms': round(max(tempi), 2),
+            'errori': errori,
+        }
+
+    def stampa(self, risultati, precedente):
+        database = risultati['database']
+        self.stdout.write(
+            f"Database: {database['aste']} aste ({database['aste_attive']} attive), "
+            f"{database['offerte']} offerte, {database['utenti']} utenti"
+        )
+        viste_precedenti = (precedente or {}).get('viste', {})
+        intestazione = f"{'vista':<28}{'query':>7}{'p50 ms':>10}{'p95 ms':>10}"
+        if precedente:
+            intestazione += f"{'Δ query':>9}{'Δ p50':>9}{'Δ p95':>9}"
+        self.stdout.write(intestazione)
+        for nome, valori in risultati['viste'].items():
+            riga = f"{nome:<28}{valori['query']:>7}{valori['p50_ms']:>10.1f}{valori['p95_ms']:>10.1f}"
+            prima = viste_precedenti.get(nome)
+            if prima:
+                riga += (
+                    f"{valori['query'] - prima['query']:>+9}"
+                    f"{self.variazione(valori['p50_ms'], prima['p50_ms']):>9}"
+                    f"{self.variazione(valori['p95_ms'], prima['p95_ms']):>9}"
+                )
+            if valori['errori']:
+                riga += self.style.ERROR(f"  {valori['errori']} risposte con errore")
+            self.stdout.write(riga)
+
+    @staticmethod
+    def variazione(attuale, prima):
+        if not prima:
+            return '-'
+        return f"{(attuale - prima) / prima * 100:+.0f}%"
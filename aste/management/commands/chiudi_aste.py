@@ -0,0 +1,32 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from aste.chiusura import SchedulerChiusure, chiudi_aste_scadute
+
+
+class Command(BaseCommand):
+    help = (
+        "Avvia lo scheduler che chiude le aste alla loro data di fine e invia le notifiche. "
+        "Con --una-volta chiude le aste già scadute ed esce."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-volta', action='store_true', help="Esegue una sola chiusura ed esce.")
+        parser.add_argument(
+            '--intervallo', type=int, default=30,
+            help="Secondi tra un ricaricamento e l'altro delle aste in scadenza (default: 30).",
+        )
+
+    def handle(self, *args, **options):
+        if options['una_volta']:
+            aste = chiudi_aste_scadute()
+            self.stdout.write(self.style.SUCCESS(f"Chiuse {len(aste)} aste."))
+            return
+
+        scheduler = SchedulerChiusure(intervallo=options['intervallo'])
+        self.stdout.write("Scheduler delle chiusure in esecuzione (CTRL+C per uscire)...")
+        try:
+            asyncio.run(scheduler.esegui())
+        except KeyboardInterrupt:
+            self.stdout.write("Scheduler fermato.")
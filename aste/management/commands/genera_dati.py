@@ -0,0 +1,269 @@
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from aste.models import Asta, Categoria, Feedback, Notifica, Offerta, Profile, ReputazioneVenditore
+from aste.raccomandazioni import invalida_raccomandazioni
+from aste.ricerca import backend_ricerca
+from aste.statistiche import invalida_statistiche
+
+from .benchmark_ricerca import AGGETTIVI, MARCHE, OGGETTI, PAROLE
+
+CATEGORIE = [
+    'Elettronica', 'Abbigliamento', 'Casa e giardino', 'Collezionismo', 'Libri', 'Musica',
+    'Sport', 'Motori', 'Gioielli', 'Arte', 'Giocattoli', 'Fotografia',
+]
+COMMENTI = [
+    'Tutto perfetto, venditore consigliato.', 'Spedizione veloce e oggetto come da descrizione.',
+    'Imballaggio curato.', 'Qualche ritardo ma alla fine tutto ok.', 'Oggetto diverso dalla foto.',
+]
+# Distribuzione dei voti: come sui siti reali, la maggior parte dei feedback è positiva.
+PESI_VOTI = [3, 4, 8, 30, 55]
+
+# Le aste generate non hanno un file: i template mostrano solo l'URL.
+IMMAGINE = 'aste_images/dati_di_carico.jpg'
+
+# Quante aste (con le relative offerte) vengono preparate in memoria per volta.
+BLOCCO_ASTE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Popola il database con dati sintetici per i test di carico (utenti, categorie, aste, "
+        "offerte, feedback e notifiche) usando bulk_create. I campi denormalizzati (prezzo "
+        "attuale, miglior offerente, numero di offerte), la reputazione dei venditori e i "
+        "contatori delle notifiche restano coerenti con le righe generate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--utenti', type=int, default=5_000, help="Numero di utenti da generare.")
+        parser.add_argument('--quota-venditori', type=float, default=0.2, help="Frazione di utenti venditori.")
+        parser.add_argument('--categorie', type=int, default=len(CATEGORIE))
+        parser.add_argument('--aste', type=int, default=100_000, help="Numero di aste da generare.")
+        parser.add_argument('--quota-concluse', type=float, default=0.3, help="Frazione di aste già concluse.")
+        parser.add_argument('--offerte', type=int, default=5_000_000, help="Numero (circa) di offerte in totale.")
+        parser.add_argument(
+            '--quota-feedback', type=float, default=0.6,
+            help="Frazione di aste concluse con vincitore per cui il vincitore lascia un feedback.",
+        )
+        parser.add_argument('--notifiche', type=int, default=200_000, help="Numero di notifiche da generare.")
+        parser.add_argument('--desideri', type=int, default=5, help="Aste massime in lista desideri per acquirente.")
+        parser.add_argument(
+            '--prefisso', default='carico',
+            help="Prefisso degli username generati (per riconoscerli e cancellarli).",
+        )
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.prefisso = options['prefisso']
+        if User.objects.filter(username__startswith=f"{self.prefisso}_").exists():
+            raise CommandError(
+                f"Esistono già utenti '{self.prefisso}_*': usa un altro --prefisso o un database vuoto."
+            )
+        inizio = time.perf_counter()
+        # Una sola transazione: su SQLite è anche molto più veloce di un commit per blocco.
+        with transaction.atomic():
+            venditori, acquirenti = self.genera_utenti(options['utenti'], options['quota_venditori'])
+            if not venditori or not acquirenti:
+                raise CommandError("Servono almeno un venditore e un acquirente.")
+            categorie = self.genera_categorie(options['categorie'])
+            aste_attive, vinte = self.genera_aste(
+                options['aste'], options['offerte'], options['quota_concluse'], venditori, acquirenti, categorie
+            )
+            self.genera_feedback(vinte, options['quota_feedback'])
+            self.genera_desideri(acquirenti, aste_attive, options['desideri'])
+            self.genera_notifiche(options['notifiche'], acquirenti, aste_attive)
+            # bulk_create non invia i segnali che aggiornano l'indice: lo ricostruiamo in un colpo solo.
+            backend_ricerca().ricostruisci_indice()
+
+        # Le statistiche e le raccomandazioni in cache non conoscono le nuove aste.
+        invalida_statistiche(prezzo=True)
+        invalida_raccomandazioni()
+        self.stdout.write(self.style.SUCCESS(f"Dati generati in {time.perf_counter() - inizio:.1f}s"))
+
+    def genera_utenti(self, quanti, quota_venditori):
+        # L'hashing della password è lento di proposito: lo calcoliamo una volta sola.
+        # Tutti gli utenti generati hanno password "password".
+        password = make_password('password')
+        n_venditori = max(1, round(quanti * quota_venditori))
+        utenti = User.objects.bulk_create(
+            [User(username=f"{self.prefisso}_{i}", password=password) for i in range(quanti)],
+            batch_size=5000,
+        )
+        Profile.objects.bulk_create(
+            [
+                Profile(user=utente, ruolo='venditore' if i < n_venditori else 'acquirente')
+                for i, utente in enumerate(utenti)
+            ],
+            batch_size=5000,
+        )
+        self.stdout.write(f"Utenti: {n_venditori} venditori, {quanti - n_venditori} acquirenti")
+        return [u.pk for u in utenti[:n_venditori]], [u.pk for u in utenti[n_venditori:]]
+
+    def genera_categorie(self, quante):
+        nomi = [CATEGORIE[i] if i < len(CATEGORIE) else f"Categoria {i + 1}" for i in range(quante)]
+        # Le categorie con lo stesso nome già presenti vengono riusate.
+        Categoria.objects.bulk_create([Categoria(nome=nome) for nome in nomi], ignore_conflicts=True)
+        return list(Categoria.objects.filter(nome__in=nomi).values_list('pk', flat=True))
+
+    def offerte_per_asta(self, n_aste, n_offerte):
+        # Poche aste "calde" ricevono gran parte delle offerte (distribuzione di Pareto),
+        # come succede davvero negli ultimi minuti delle aste più seguite.
+        pesi = [self.rng.paretovariate(1.2) for _ in range(n_aste)]
+        totale = sum(pesi)
+        return [int(n_offerte * peso / totale) for peso in pesi]
+
+    def genera_aste(self, n_aste, n_offerte, quota_concluse, venditori, acquirenti, categorie):
+        adesso = timezone.now()
+        conteggi = self.offerte_per_asta(n_aste, n_offerte)
+        aste_attive, vinte = [], []
+        offerte_create = 0
+        inizio = time.perf_counter()
+        for primo in range(0, n_aste, BLOCCO_ASTE):
+            aste, offerte_blocco = [], []
+            for quante in conteggi[primo:primo + BLOCCO_ASTE]:
+                asta, offerte = self.nuova_asta(adesso, quante, quota_concluse, venditori, acquirenti, categorie)
+                aste.append(asta)
+                offerte_blocco.append(offerte)
+            # bulk_create non chiama `Asta.save` né i segnali: i campi denormalizzati
+            # sono già stati calcolati da `nuova_asta` a partire dalle offerte.
+            Asta.objects.bulk_create(aste)
+            righe = []
+            for asta, offerte in zip(aste, offerte_blocco):
+                righe.extend(
+                    Offerta(asta_id=asta.pk, acquirente_id=acquirente_id, importo=importo)
+                    for acquirente_id, importo in offerte
+                )
+                if asta.stato == 'attiva':
+                    aste_attive.append((asta.pk, asta.titolo))
+                elif asta.miglior_offerente_id:
+                    vinte.append((asta.pk, asta.miglior_offerente_id, asta.venditore_id))
+            Offerta.objects.bulk_create(righe, batch_size=5000)
+            offerte_create += len(righe)
+            self.stdout.write(
+                f"\r  aste {primo + len(aste)}/{n_aste}, offerte {offerte_create} "
+                f"({time.perf_counter() - inizio:.0f}s)",
+                ending='',
+            )
+        self.stdout.write('')
+        self.stdout.write(f"Aste: {n_aste} ({len(aste_attive)} attive), offerte: {offerte_create}")
+        return aste_attive, vinte
+
+    def nuova_asta(self, adesso, n_offerte, quota_concluse, venditori, acquirenti, categorie):
+        rng = self.rng
+        titolo = f"{rng.choice(OGGETTI)} {rng.choice(MARCHE)} {rng.choice(AGGETTIVI)}".capitalize()
+        concluse = rng.random() < quota_concluse
+        if concluse:
+            data_fine = adesso - timedelta(minutes=rng.randint(1, 60 * 24 * 60))
+        else:
+            data_fine = adesso + timedelta(minutes=rng.randint(1, 60 * 24 * 30))
+        # Importi in centesimi: gli interi sono molto più veloci dei Decimal nel ciclo.
+        base = rng.randint(1, 500) * 100
+        rilancio = rng.choice([50, 100, 200, 500])
+        prezzo, acquirente_id, offerte = base, None, []
+        for _ in range(n_offerte):
+            # Ogni offerta supera la precedente di almeno il rilancio minimo (la prima
+            # supera il prezzo base), come richiesto da `piazza_offerta`.
+            prezzo += rilancio * rng.randint(1, 3)
+            acquirente_id = rng.choice(acquirenti)
+            offerte.append((acquirente_id, Decimal(prezzo) / 100))
+        asta = Asta(
+            venditore_id=rng.choice(venditori),
+            titolo=titolo,
+            descrizione=' '.join(rng.choices(PAROLE + OGGETTI + AGGETTIVI, k=rng.randint(15, 40))).capitalize(),
+            immagine=IMMAGINE,
+            categoria_id=rng.choice(categorie),
+            prezzo_base=Decimal(base) / 100,
+            rilancio_minimo=Decimal(rilancio) / 100,
+            data_fine=data_fine,
+            stato='conclusa' if concluse else 'attiva',
+            notifica_inviata=concluse,
+            prezzo_attuale=Decimal(prezzo) / 100,
+            miglior_offerente_id=acquirente_id,
+            numero_offerte=n_offerte,
+        )
+        return asta, offerte
+
+    def genera_feedback(self, vinte, quota):
+        feedback = []
+        # Riepilogo per venditore calcolato insieme ai feedback (bulk_create non invia
+        # i segnali che di solito aggiornano ReputazioneVenditore).
+        voti = defaultdict(Counter)
+        for asta_id, vincitore_id, venditore_id in vinte:
+            if self.rng.random() >= quota:
+                continue
+            voto = self.rng.choices(range(1, 6), weights=PESI_VOTI)[0]
+            voti[venditore_id][voto] += 1
+            feedback.append(Feedback(
+                asta_id=asta_id, autore_id=vincitore_id, destinatario_id=venditore_id,
+                voto=voto, commento=self.rng.choice(COMMENTI),
+            ))
+        Feedback.objects.bulk_create(feedback, batch_size=5000)
+        # I venditori sono nuovi: nessuno ha ancora un riepilogo.
+        ReputazioneVenditore.objects.bulk_create(
+            [
+                ReputazioneVenditore(
+                    venditore_id=venditore_id,
+                    conteggio=sum(conteggio.values()),
+                    somma_voti=sum(voto * quanti for voto, quanti in conteggio.items()),
+                    media=sum(voto * quanti for voto, quanti in conteggio.items()) / sum(conteggio.values()),
+                    **{f'voti_{voto}': conteggio[voto] for voto in range(1, 6)},
+                )
+                for venditore_id, conteggio in voti.items()
+            ],
+            batch_size=5000,
+        )
+        self.stdout.write(f"Feedback: {len(feedback)} per {len(voti)} venditori")
+
+    def genera_desideri(self, acquirenti, aste_attive, massimo):
+        if not aste_attive or massimo <= 0:
+            return
+        Desiderio = Asta.utenti_lista_desideri.through
+        righe = [
+            Desiderio(user_id=acquirente_id, asta_id=asta_id)
+            for acquirente_id in acquirenti
+            for asta_id, _ in self.rng.sample(aste_attive, min(len(aste_attive), self.rng.randint(0, massimo)))
+        ]
+        Desiderio.objects.bulk_create(righe, batch_size=5000)
+        self.stdout.write(f"Liste dei desideri: {len(righe)} aste")
+
+    def genera_notifiche(self, quante, acquirenti, aste_attive):
+        if not aste_attive:
+            return
+        non_lette = Counter()
+        righe = []
+        for _ in range(quante):
+            destinatario_id = self.rng.choice(acquirenti)
+            asta_id, titolo = self.rng.choice(aste_attive)
+            # Le notifiche più vecchie di solito sono già state lette.
+            letta = self.rng.random() < 0.7
+            if not letta:
+                non_lette[destinatario_id] += 1
+            righe.append(Notifica(
+                utente_destinatario_id=destinatario_id,
+                messaggio=f"La tua offerta su '{titolo}' è stata superata.",
+                letta=letta,
+                asta_riferimento_id=asta_id,
+            ))
+        # Niente `crea_notifiche`: non vogliamo inviarle in tempo reale.
+        # I contatori vengono aggiornati allo stesso modo, un UPDATE per quantità.
+        Notifica.objects.bulk_create(righe, batch_size=5000)
+        per_quantita = defaultdict(list)
+        for utente_id, non_letta in non_lette.items():
+            per_quantita[non_letta].append(utente_id)
+        for non_letta, utenti in per_quantita.items():
+            for primo in range(0, len(utenti), 5000):
+                Profile.objects.filter(user_id__in=utenti[primo:primo + 5000]).update(
+                    notifiche_non_lette=F('notifiche_non_lette') + non_letta
+                )
+        self.stdout.write(f"Notifiche: {quante} ({sum(non_lette.values())} non lette)")
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from aste.immagini import genera_derivati
+from aste.models import Asta
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera le versioni ridotte (WebP e JPEG) delle immagini delle aste che non le hanno ancora, "
+        "ad esempio quelle caricate prima dell'introduzione dei derivati. Con --tutte le rigenera tutte."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tutte', action='store_true',
+            help="Rigenera i derivati anche per le aste che li hanno già (es. dopo aver cambiato le larghezze).",
+        )
+
+    def handle(self, *args, **options):
+        aste = Asta.objects.exclude(immagine='').order_by('pk')
+        if not options['tutte']:
+            aste = aste.filter(derivati={})
+
+        generate, fallite, peso_originali, peso_anteprime = 0, 0, 0, 0
+        for asta in aste.only('pk', 'immagine'):
+            try:
+                derivati = genera_derivati(asta.pk)
+            except Exception as errore:
+                # Un file mancante o corrotto non deve fermare le altre aste.
+                fallite += 1
+                self.stderr.write(f"Asta {asta.pk} ({asta.immagine.name}): {errore}")
+                continue
+            if derivati:
+                generate += 1
+                # L'originale con metadati EXIF è stato sostituito da una copia ripulita
+                # (e il vecchio file rilasciato): leggiamo il nome attuale.
+                asta.refresh_from_db(fields=['immagine'])
+                storage = asta.immagine.storage
+                peso_originali += storage.size(asta.immagine.name)
+                peso_anteprime += storage.size(derivati['webp'][min(derivati['webp'], key=int)])
+
+        self.stdout.write(self.style.SUCCESS(f"Derivati generati per {generate} aste."))
+        if generate:
+            self.stdout.write(
+                f"  originali: {peso_originali / 1024:.0f} KB, "
+                f"anteprime WebP più piccole: {peso_anteprime / 1024:.0f} KB"
+            )
+        if fallite:
+            self.stderr.write(self.style.ERROR(f"{fallite} immagini non elaborate."))
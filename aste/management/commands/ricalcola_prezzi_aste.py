@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from aste.models import Asta, Offerta
+
+
+class Command(BaseCommand):
+    help = (
+        "Ricostruisce (o con --solo-verifica controlla) i campi denormalizzati "
+        "prezzo_attuale, miglior_offerente e numero_offerte di ogni asta a partire dalle offerte."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--solo-verifica',
+            action='store_true',
+            help="Non modifica nulla: segnala le aste incoerenti ed esce con errore se ce ne sono.",
+        )
+
+    def handle(self, *args, **options):
+        # Spiegazione: Con una sola query calcoliamo, per ogni asta, i valori "veri"
+        # ricavati dalla tabella delle offerte e li confrontiamo con quelli salvati.
+        offerta_top = Offerta.objects.filter(asta=OuterRef('pk')).order_by('-importo')
+        aste = Asta.objects.annotate(
+            prezzo_atteso=Coalesce(Subquery(offerta_top.values('importo')[:1]), F('prezzo_base')),
+            offerente_atteso=Subquery(offerta_top.values('acquirente')[:1]),
+            conteggio_atteso=Count('offerte'),
+        ).order_by('pk')
+
+        incoerenti = [
+            asta for asta in aste
+            if asta.prezzo_attuale != asta.prezzo_atteso
+            or asta.miglior_offerente_id != asta.offerente_atteso
+            or asta.numero_offerte != asta.conteggio_atteso
+        ]
+
+        for asta in incoerenti:
+            self.stdout.write(
+                f"Asta {asta.pk}: prezzo {asta.prezzo_attuale} -> {asta.prezzo_atteso}, "
+                f"offerente {asta.miglior_offerente_id} -> {asta.offerente_atteso}, "
+                f"offerte {asta.numero_offerte} -> {asta.conteggio_atteso}"
+            )
+
+        if options['solo_verifica']:
+            if incoerenti:
+                raise CommandError(f"{len(incoerenti)} aste hanno campi denormalizzati incoerenti.")
+            self.stdout.write(self.style.SUCCESS("Tutte le aste sono coerenti."))
+            return
+
+        with transaction.atomic():
+            for asta in incoerenti:
+                Asta.objects.filter(pk=asta.pk).update(
+                    prezzo_attuale=asta.prezzo_atteso,
+                    miglior_offerente_id=asta.offerente_atteso,
+                    numero_offerte=asta.conteggio_atteso,
+                )
+        self.stdout.write(self.style.SUCCESS(f"Aggiornate {len(incoerenti)} aste."))
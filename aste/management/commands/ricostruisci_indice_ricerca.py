@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from aste.ricerca import backend_ricerca
+
+
+class Command(BaseCommand):
+    help = "Ricostruisce da zero l'indice di ricerca testuale delle aste (es. dopo import in blocco)."
+
+    def handle(self, *args, **options):
+        backend = backend_ricerca()
+        backend.ricostruisci_indice()
+        self.stdout.write(self.style.SUCCESS(f"Indice ricostruito ({type(backend).__name__})."))
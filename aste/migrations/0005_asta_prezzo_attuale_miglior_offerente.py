@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def popola_campi_denormalizzati(apps, schema_editor):
+    # Calcoliamo per le aste esistenti prezzo attuale, miglior offerente e numero di offerte.
+    Asta = apps.get_model('aste', 'Asta')
+    Offerta = apps.get_model('aste', 'Offerta')
+    for asta in Asta.objects.all():
+        offerte = Offerta.objects.filter(asta=asta).order_by('-importo')
+        offerta_top = offerte.first()
+        asta.numero_offerte = offerte.count()
+        if offerta_top:
+            asta.prezzo_attuale = offerta_top.importo
+            asta.miglior_offerente_id = offerta_top.acquirente_id
+        else:
+            asta.prezzo_attuale = asta.prezzo_base
+            asta.miglior_offerente_id = None
+        asta.save(update_fields=['prezzo_attuale', 'miglior_offerente', 'numero_offerte'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('aste', '0004_alter_asta_categoria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asta',
+            name='miglior_offerente',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='aste_in_testa', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='asta',
+            name='numero_offerte',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='asta',
+            name='prezzo_attuale',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(popola_campi_denormalizzati, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def crea_indice_fts(apps, schema_editor):
+    # La tabella virtuale FTS5 esiste solo su SQLite: sugli altri database
+    # la ricerca usa un altro motore (vedi aste/ricerca.py).
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS aste_asta_fts USING fts5("
+        "titolo, descrizione, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO aste_asta_fts (rowid, titolo, descrizione) SELECT id, titolo, descrizione FROM aste_asta"
+    )
+
+
+def elimina_indice_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS aste_asta_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0005_asta_prezzo_attuale_miglior_offerente'),
+    ]
+
+    operations = [
+        migrations.RunPython(crea_indice_fts, elimina_indice_fts),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0006_indice_ricerca_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asta',
+            index=models.Index(condition=models.Q(('stato', 'attiva')), fields=['data_fine', 'id'], name='asta_attive_scadenza_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asta',
+            index=models.Index(fields=['venditore', '-data_inizio'], name='asta_venditore_inizio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['destinatario', '-data_creazione'], name='feedback_destinatario_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notifica',
+            index=models.Index(fields=['utente_destinatario', '-data_creazione'], name='notifica_utente_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notifica',
+            index=models.Index(condition=models.Q(('letta', False)), fields=['utente_destinatario'], name='notifica_non_lette_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offerta',
+            index=models.Index(fields=['acquirente', '-data_offerta'], name='offerta_acquirente_data_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:38
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def popola_notifiche_non_lette(apps, schema_editor):
+    # Contiamo le notifiche non lette già presenti per ogni utente.
+    Notifica = apps.get_model('aste', 'Notifica')
+    Profile = apps.get_model('aste', 'Profile')
+    conteggi = Notifica.objects.filter(letta=False).values('utente_destinatario').annotate(totale=Count('pk')).order_by()
+    for riga in conteggi:
+        Profile.objects.filter(user_id=riga['utente_destinatario']).update(notifiche_non_lette=riga['totale'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0007_indici_filtri_frequenti'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='notifiche_non_lette',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(popola_notifiche_non_lette, migrations.RunPython.noop),
+    ]
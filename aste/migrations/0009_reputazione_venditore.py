@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def popola_reputazione(apps, schema_editor):
+    # Riepilogo dei feedback già presenti, un venditore alla volta.
+    Feedback = apps.get_model('aste', 'Feedback')
+    ReputazioneVenditore = apps.get_model('aste', 'ReputazioneVenditore')
+    voti = {f'voti_{stelle}': Count('pk', filter=Q(voto=stelle)) for stelle in range(1, 6)}
+    righe = Feedback.objects.values('destinatario').annotate(
+        conteggio=Count('pk'), somma_voti=Sum('voto'), **voti
+    ).order_by()
+    ReputazioneVenditore.objects.bulk_create([
+        ReputazioneVenditore(
+            venditore_id=riga.pop('destinatario'),
+            media=riga['somma_voti'] / riga['conteggio'],
+            **riga,
+        )
+        for riga in righe
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0008_profile_notifiche_non_lette'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReputazioneVenditore',
+            fields=[
+                ('venditore', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reputazione', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('media', models.FloatField(editable=False, null=True)),
+                ('conteggio', models.PositiveIntegerField(default=0, editable=False)),
+                ('somma_voti', models.PositiveIntegerField(default=0, editable=False)),
+                ('voti_1', models.PositiveIntegerField(default=0, editable=False)),
+                ('voti_2', models.PositiveIntegerField(default=0, editable=False)),
+                ('voti_3', models.PositiveIntegerField(default=0, editable=False)),
+                ('voti_4', models.PositiveIntegerField(default=0, editable=False)),
+                ('voti_5', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+        ),
+        migrations.RunPython(popola_reputazione, migrations.RunPython.noop),
+    ]
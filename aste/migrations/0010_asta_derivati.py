@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0009_reputazione_venditore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asta',
+            name='derivati',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:08
+
+import aste.storage
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0010_asta_derivati'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='asta',
+            name='immagine',
+            field=models.ImageField(storage=aste.storage.ArchivioContenutiStorage(), upload_to='aste_images/'),
+        ),
+        migrations.AddIndex(
+            model_name='asta',
+            index=models.Index(fields=['immagine'], name='asta_immagine_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0011_archivio_immagini'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asta',
+            index=models.Index(condition=models.Q(('stato', 'attiva')), fields=['categoria', 'prezzo_attuale'], name='asta_attive_categoria_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+NOME_INDICE = 'asta_ricerca_gin_idx'
+
+
+def _indice():
+    # La stessa espressione di `BackendPostgres.vettore()` (aste/ricerca.py):
+    # PostgreSQL usa l'indice solo se la query la ripete identica.
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    return GinIndex(
+        SearchVector('titolo', weight='A', config='italian')
+        + SearchVector('descrizione', weight='B', config='italian'),
+        name=NOME_INDICE,
+    )
+
+
+def crea_indice_gin(apps, schema_editor):
+    # Solo su PostgreSQL: su SQLite la ricerca usa la tabella FTS5 della migrazione 0006.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.add_index(apps.get_model('aste', 'Asta'), _indice())
+
+
+def elimina_indice_gin(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.remove_index(apps.get_model('aste', 'Asta'), _indice())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0012_indice_statistiche_categorie'),
+    ]
+
+    operations = [
+        migrations.RunPython(crea_indice_gin, elimina_indice_gin),
+    ]
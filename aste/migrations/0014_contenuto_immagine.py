@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aste', '0013_indice_ricerca_postgres'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContenutoImmagine',
+            fields=[
+                ('impronta', models.CharField(max_length=16, primary_key=True, serialize=False)),
+            ],
+        ),
+    ]
@@ -1,7 +1,13 @@
-from django.db import models
+from collections import Counter, defaultdict
+
+from django.db import models, transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, NullIf
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .storage import archivio_immagini
+
 # - `django.db.models`: Questo è il modulo che contiene la classe base `models.Model`
 #   e tutti i tipi di campo (CharField, IntegerField, etc.) che useremo.
 # - `django.contrib.auth.models.User`: Importiamo il modello User predefinito di Django.
@@ -30,6 +36,12 @@ class Profile(models.Model):
     # `default` imposta un valore predefinito.
     ruolo = models.CharField(max_length=10, choices=RUOLI, default='acquirente')
 
+    # Contatore denormalizzato delle notifiche non lette, mostrato nel badge della navbar.
+    # Il profilo viene già letto da ogni pagina (per il ruolo), quindi il badge
+    # non costa nessuna query in più. Viene aggiornato da `NotificaManager.crea_notifiche`,
+    # dai segnali su Notifica e azzerato da `NotificheView`.
+    notifiche_non_lette = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         # Il metodo `__str__` definisce come un oggetto verrà rappresentato
         # come stringa (ad esempio, nell'interfaccia di admin). È una buona pratica
@@ -52,17 +64,14 @@ class Categoria(models.Model):
 class AstaManager(models.Manager):
     def get_aste_vinte(self, user):
         # Spiegazione: Questo metodo personalizzato trova tutte le aste vinte da un utente.
-        # 1. Filtra le aste il cui stato è 'conclusa'.
-        aste_concluse = self.filter(stato='conclusa')
-        
-        # 2. Trova gli ID delle aste dove l'offerta più alta appartiene all'utente.
-        aste_vinte_ids = [
-            asta.id for asta in aste_concluse 
-            if asta.offerte.first() and asta.offerte.first().acquirente == user
-        ]
-        
-        # 3. Restituisce il queryset finale.
-        return self.filter(pk__in=aste_vinte_ids)
+        # Il vincitore di un'asta conclusa è il suo miglior offerente, che è salvato
+        # direttamente sull'asta: basta quindi un unico filtro, senza ciclare in Python.
+        # Il risultato è un queryset "pigro", valutato solo quando serve.
+        return self.filter(stato='conclusa', miglior_offerente=user)
+
+# Campi di Asta aggiornati solo da `registra_offerta` (e dal ricalcolo), mai da un salvataggio completo.
+CAMPI_DENORMALIZZATI = ('prezzo_attuale', 'miglior_offerente_id', 'numero_offerte')
+
 
 class Asta(models.Model):
     # Il cuore del nostro sistema.
@@ -77,7 +86,12 @@ class Asta(models.Model):
     
     # `upload_to='aste_images/'` dice a Django di salvare le immagini caricate
     # in una sottocartella `aste_images` dentro la nostra cartella di file media (che configureremo).
-    immagine = models.ImageField(upload_to='aste_images/')
+    # Lo storage dà ai file un nome basato sul contenuto: immagini identiche sono un solo file (vedi aste/storage.py).
+    immagine = models.ImageField(upload_to='aste_images/', storage=archivio_immagini)
+    # Versioni ridotte dell'immagine, generate in background (vedi aste/immagini.py):
+    # {"webp": {"320": "aste_images/derivati/<impronta>_320.webp", ...}, "jpeg": {...}}.
+    # Vuoto finché non sono pronte: i template usano allora l'originale.
+    derivati = models.JSONField(default=dict, blank=True, editable=False)
     
     # Relazione molti-a-uno con Categoria.
     categoria = models.ForeignKey(Categoria, on_delete=models.PROTECT)
@@ -97,6 +111,16 @@ class Asta(models.Model):
         ('annullata', 'Annullata'),
     )
     stato = models.CharField(max_length=10, choices=STATI, default='attiva')
+
+    # Campi denormalizzati: tengono lo stato corrente dell'asta senza dover
+    # ricalcolare `Max('offerte__importo')` ad ogni pagina.
+    # Vengono aggiornati da `registra_offerta` nella stessa transazione che crea l'Offerta,
+    # e possono essere ricostruiti con `python manage.py ricalcola_prezzi_aste`.
+    prezzo_attuale = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    miglior_offerente = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='aste_in_testa'
+    )
+    numero_offerte = models.PositiveIntegerField(default=0, editable=False)
     
     # `ManyToManyField` per la lista dei desideri. Un utente può avere molte aste preferite,
     # e un'asta può essere nei preferiti di molti utenti.
@@ -105,47 +129,112 @@ class Asta(models.Model):
     objects = AstaManager()
     class Meta:
         verbose_name_plural = "Aste"
+        # Spiegazione: indici per i filtri usati a ogni pagina.
+        # - L'indice parziale contiene solo le aste attive, già in ordine di scadenza:
+        #   serve la home (con la paginazione keyset su data_fine, id) e la chiusura delle aste scadute.
+        # - (venditore, -data_inizio) serve l'elenco "le mie aste" del profilo senza ordinamenti in memoria.
+        indexes = [
+            models.Index(fields=['data_fine', 'id'], condition=models.Q(stato='attiva'), name='asta_attive_scadenza_idx'),
+            # Statistiche dei filtri per categoria (vedi aste/statistiche.py): solo le aste attive.
+            models.Index(
+                fields=['categoria', 'prezzo_attuale'], condition=models.Q(stato='attiva'), name='asta_attive_categoria_idx'
+            ),
+            models.Index(fields=['venditore', '-data_inizio'], name='asta_venditore_inizio_idx'),
+            # Per contare quante aste usano lo stesso file prima di cancellarlo.
+            models.Index(fields=['immagine'], name='asta_immagine_idx'),
+        ]
 
     def __str__(self):
         return f"Asta: {self.titolo} | Venditore: {self.venditore.username}"
+
+    def save(self, *args, **kwargs):
+        if self.immagine and not self.immagine._committed:
+            # Spiegazione: Lo storage può restituire un file già presente (stesso contenuto):
+            # salvandolo nella stessa transazione dell'asta, `rilascia_immagine` non può
+            # cancellarlo tra il salvataggio del file e quello dell'asta.
+            with transaction.atomic():
+                self._salva(*args, **kwargs)
+        else:
+            self._salva(*args, **kwargs)
+
+    def _salva(self, *args, **kwargs):
+        # Finché non ci sono offerte il prezzo attuale coincide con il prezzo base
+        # (che il venditore può ancora modificare).
+        if self._state.adding or kwargs.get('update_fields') is not None or kwargs.get('force_insert'):
+            if not self.numero_offerte:
+                self.prezzo_attuale = self.prezzo_base
+            super().save(*args, **kwargs)
+            return
+        # Spiegazione: Un salvataggio completo (form di modifica, admin) riscriverebbe anche
+        # i campi denormalizzati letti quando la pagina è stata caricata, annullando le
+        # offerte arrivate nel frattempo. Li rileggiamo dalla riga bloccata e salviamo
+        # solo gli altri campi, nella stessa transazione (le offerte aspettano il lock).
+        with transaction.atomic():
+            attuali = Asta.objects.select_for_update().filter(pk=self.pk).values(*CAMPI_DENORMALIZZATI).first()
+            if attuali is not None:
+                for campo, valore in attuali.items():
+                    setattr(self, campo, valore)
+                campi = [
+                    campo.attname for campo in self._meta.concrete_fields
+                    if not campo.primary_key and campo.attname not in CAMPI_DENORMALIZZATI
+                ]
+                if not self.numero_offerte:
+                    self.prezzo_attuale = self.prezzo_base
+                    campi.append('prezzo_attuale')
+                kwargs['update_fields'] = campi
+            elif not self.numero_offerte:
+                self.prezzo_attuale = self.prezzo_base
+            super().save(*args, **kwargs)
+
+    def _srcset(self, formato):
+        varianti = sorted((self.derivati or {}).get(formato, {}).items(), key=lambda variante: int(variante[0]))
+        return ', '.join(f"{self.immagine.storage.url(nome)} {larghezza}w" for larghezza, nome in varianti)
+
+    @property
+    def srcset_webp(self):
+        return self._srcset('webp')
+
+    @property
+    def srcset_jpeg(self):
+        return self._srcset('jpeg')
+
+    @property
+    def immagine_anteprima_url(self):
+        # Il JPEG più piccolo (per le card e lo scroll infinito), altrimenti l'originale.
+        varianti = (self.derivati or {}).get('jpeg')
+        if varianti:
+            return self.immagine.storage.url(varianti[min(varianti, key=int)])
+        return self.immagine.url if self.immagine else None
+
+    def registra_offerta(self, acquirente, importo):
+        # Spiegazione: Crea l'offerta e aggiorna i campi denormalizzati dell'asta
+        # nella stessa transazione, così i due dati non possono divergere.
+        # L'UPDATE è condizionato al numero di offerte che abbiamo letto (compare-and-swap):
+        # se nel frattempo un'altra offerta è stata registrata non aggiorna nulla
+        # e restituiamo None, lasciando al chiamante la decisione (vedi `aste.offerte`).
+        with transaction.atomic():
+            aggiornate = Asta.objects.filter(pk=self.pk, numero_offerte=self.numero_offerte).update(
+                prezzo_attuale=importo,
+                miglior_offerente=acquirente,
+                numero_offerte=F('numero_offerte') + 1,
+            )
+            if not aggiornate:
+                return None
+            offerta = Offerta.objects.create(asta=self, acquirente=acquirente, importo=importo)
+        self.prezzo_attuale = offerta.importo
+        self.miglior_offerente = acquirente
+        self.numero_offerte += 1
+        return offerta
     
     def aggiorna_stato_se_scaduta(self):
         # Spiegazione: Questo metodo controlla se l'asta è scaduta e non è già conclusa.
-        # Controlla se l'asta è scaduta e se le notifiche non sono ancora state inviate.
+        # Normalmente le aste vengono chiuse dallo scheduler (`python manage.py chiudi_aste`);
+        # questo metodo usa la stessa logica di chiusura, limitata a questa sola asta.
         if self.stato == 'attiva' and self.data_fine < timezone.now():
+            from .chiusura import chiudi_aste_scadute
+            chiudi_aste_scadute(pks=[self.pk])
             self.stato = 'conclusa'
-            
-            # Se le notifiche non sono state inviate, procedi
-            if not self.notifica_inviata:
-                # Trova il vincitore (l'utente con l'offerta più alta)
-                offerta_vincente = self.offerte.order_by('-importo').first()
-                
-                if offerta_vincente:
-                    vincitore = offerta_vincente.acquirente
-                    # Crea notifica per il VINCITORE
-                    Notifica.objects.create(
-                        utente_destinatario=vincitore,
-                        messaggio=f"Congratulazioni! Hai vinto l'asta '{self.titolo}'.",
-                        asta_riferimento=self
-                    )
-                    # Crea notifica per il VENDITORE
-                    Notifica.objects.create(
-                        utente_destinatario=self.venditore,
-                        messaggio=f"La tua asta '{self.titolo}' si è conclusa. È stata vinta da {vincitore.username} per €{offerta_vincente.importo}.",
-                        asta_riferimento=self
-                    )
-                else:
-                    # Se non ci sono offerte, crea notifica solo per il VENDITORE
-                    Notifica.objects.create(
-                        utente_destinatario=self.venditore,
-                        messaggio=f"La tua asta '{self.titolo}' si è conclusa senza ricevere offerte.",
-                        asta_riferimento=self
-                    )
-                
-                # Imposta il flag per non inviare più notifiche per questa asta
-                self.notifica_inviata = True
-
-            self.save() # Salva le modifiche (stato e flag notifica)
+            self.notifica_inviata = True
             return True
         return False
     
@@ -163,6 +252,11 @@ class Offerta(models.Model):
         unique_together = ('asta', 'importo')
         ordering = ['-importo'] # Ordina le offerte dalla più alta alla più bassa di default.
         verbose_name_plural = "Offerte"
+        # L'indice di `unique_together` copre già (asta, importo), letto anche al contrario
+        # per le offerte di un'asta dalla più alta; qui serve solo lo storico dell'acquirente.
+        indexes = [
+            models.Index(fields=['acquirente', '-data_offerta'], name='offerta_acquirente_data_idx'),
+        ]
 
     def __str__(self):
         return f"Offerta di {self.importo} su '{self.asta.titolo}' da {self.acquirente.username}"
@@ -177,10 +271,128 @@ class Feedback(models.Model):
     commento = models.TextField()
     data_creazione = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['destinatario', '-data_creazione'], name='feedback_destinatario_idx'),
+        ]
+
     def __str__(self):
         return f"Feedback da {self.autore.username} a {self.destinatario.username} per '{self.asta.titolo}'"
     
     
+class ReputazioneManager(models.Manager):
+
+    def registra_voto(self, venditore_id, voto, delta=1):
+        # Spiegazione: Aggiorna il riepilogo del venditore con un solo UPDATE atomico:
+        # `delta` vale 1 per un feedback nuovo e -1 per uno cancellato. Nella SET le
+        # colonne hanno ancora il valore precedente, quindi la media usa i nuovi totali
+        # (e torna NULL quando non resta nessun feedback).
+        if delta > 0:
+            # Al primo feedback il riepilogo non esiste ancora.
+            self.bulk_create([self.model(venditore_id=venditore_id)], ignore_conflicts=True)
+        conteggio = F('conteggio') + delta
+        somma = F('somma_voti') + delta * voto
+        campi = {
+            'conteggio': conteggio,
+            'somma_voti': somma,
+            'media': Cast(somma, FloatField()) / NullIf(conteggio, 0),
+        }
+        if 1 <= voto <= 5:
+            campi[f'voti_{voto}'] = F(f'voti_{voto}') + delta
+        self.filter(venditore_id=venditore_id).update(**campi)
+
+
+class ReputazioneVenditore(models.Model):
+    # Riepilogo dei feedback ricevuti da un venditore, aggiornato a ogni feedback
+    # (vedi aste/signals.py): ricerca e profilo non devono ricalcolare medie su Feedback.
+    venditore = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='reputazione')
+    media = models.FloatField(null=True, editable=False)
+    conteggio = models.PositiveIntegerField(default=0, editable=False)
+    somma_voti = models.PositiveIntegerField(default=0, editable=False)
+    # Istogramma delle stelle.
+    voti_1 = models.PositiveIntegerField(default=0, editable=False)
+    voti_2 = models.PositiveIntegerField(default=0, editable=False)
+    voti_3 = models.PositiveIntegerField(default=0, editable=False)
+    voti_4 = models.PositiveIntegerField(default=0, editable=False)
+    voti_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ReputazioneManager()
+
+    def __str__(self):
+        return f"Reputazione di {self.venditore.username}: {self.media} ({self.conteggio} feedback)"
+
+    def istogramma(self):
+        # Righe (stelle, quanti, percentuale) dalla 5 alla 1, per il profilo del venditore.
+        return [
+            (stelle, quanti, round(100 * quanti / self.conteggio) if self.conteggio else 0)
+            for stelle in range(5, 0, -1)
+            for quanti in [getattr(self, f'voti_{stelle}')]
+        ]
+
+
+class ContenutoImmagineManager(models.Manager):
+
+    def blocca(self, impronte):
+        # Spiegazione: Blocca (SELECT ... FOR UPDATE) le righe delle impronte fino alla fine
+        # della transazione, creandole se mancano. Va chiamato dentro `transaction.atomic()`;
+        # l'ordine fisso evita che due transazioni si aspettino a vicenda.
+        impronte = sorted(set(impronte))
+        if not impronte:
+            return
+        self.bulk_create([self.model(impronta=impronta) for impronta in impronte], ignore_conflicts=True)
+        list(self.select_for_update().filter(impronta__in=impronte).order_by('impronta'))
+
+
+class ContenutoImmagine(models.Model):
+    # Una riga per ogni contenuto archiviato (le prime 16 cifre dell'impronta SHA-256,
+    # comuni all'originale e ai suoi derivati, vedi aste/storage.py). Serve solo da lock:
+    # chi salva un file con questa impronta e chi lo cancella bloccano la stessa riga,
+    # così il controllo dei riferimenti e la cancellazione non si sovrappongono a un
+    # caricamento concorrente, su qualunque database.
+    impronta = models.CharField(max_length=16, primary_key=True)
+
+    objects = ContenutoImmagineManager()
+
+    def __str__(self):
+        return self.impronta
+
+
+class NotificaManager(models.Manager):
+
+    def crea_notifiche(self, notifiche, annuncia=True):
+        # Spiegazione: `bulk_create` non invia il segnale post_save, quindi qui
+        # aggiorniamo anche i contatori dei destinatari. Gli utenti che ricevono
+        # lo stesso numero di notifiche vengono aggiornati con un'unica query.
+        # Con `annuncia=False` l'invio in tempo reale resta al chiamante
+        # (es. la vista asincrona delle offerte, che lo fa in background).
+        notifiche = self.bulk_create(notifiche)
+        per_utente = Counter(notifica.utente_destinatario_id for notifica in notifiche)
+        per_quantita = defaultdict(list)
+        for utente_id, quante in per_utente.items():
+            per_quantita[quante].append(utente_id)
+        for quante, utenti in per_quantita.items():
+            Profile.objects.filter(user_id__in=utenti).update(notifiche_non_lette=F('notifiche_non_lette') + quante)
+
+        # Dopo il commit le inviamo in tempo reale a chi è collegato.
+        if annuncia:
+            from .notifiche import annuncia_notifiche
+            transaction.on_commit(lambda: annuncia_notifiche(notifiche))
+        return notifiche
+
+    def segna_tutte_lette(self, user):
+        # Segna come lette tutte le notifiche dell'utente e riallinea il contatore.
+        # Il profilo viene bloccato per primo: chi crea una notifica nel frattempo
+        # aspetta il lock per incrementarlo, quindi il suo +1 arriva dopo di noi.
+        # Il contatore è comunque ricalcolato dalle righe non lette (di solito 0),
+        # così un'altra sequenza di operazioni non può farlo divergere.
+        with transaction.atomic():
+            list(Profile.objects.select_for_update().filter(user=user).values_list('pk', flat=True))
+            self.filter(utente_destinatario=user, letta=False).update(letta=True)
+            Profile.objects.filter(user=user).update(
+                notifiche_non_lette=self.filter(utente_destinatario=user, letta=False).count()
+            )
+
+
 class Notifica(models.Model):
     """
     Modello per gestire le notifiche degli utenti.
@@ -202,9 +414,17 @@ class Notifica(models.Model):
     # Data e ora di creazione della notifica.
     data_creazione = models.DateTimeField(auto_now_add=True)
 
+    objects = NotificaManager()
+
     class Meta:
         # Ordiniamo le notifiche dalla più recente alla più vecchia.
         ordering = ['-data_creazione']
+        # Spiegazione: l'elenco delle notifiche legge quelle di un utente già in ordine di data;
+        # l'indice parziale contiene solo le non lette, contate a ogni pagina per il badge.
+        indexes = [
+            models.Index(fields=['utente_destinatario', '-data_creazione'], name='notifica_utente_data_idx'),
+            models.Index(fields=['utente_destinatario'], condition=models.Q(letta=False), name='notifica_non_lette_idx'),
+        ]
 
     def __str__(self):
         # Rappresentazione testuale dell'oggetto, utile nell'area admin.
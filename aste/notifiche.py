@@ -0,0 +1,60 @@
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.urls import reverse
+
+from .models import Profile
+
+
+def gruppo_notifiche(user_id):
+    # Ogni utente ha il suo gruppo, a cui sono iscritte tutte le sue schede aperte.
+    return f'notifiche_{user_id}'
+
+
+def _eventi_notifiche(notifiche):
+    # Coppie (gruppo, evento) da inviare, con il nuovo numero di notifiche non lette.
+    # Un'unica query per i contatori di tutti i destinatari.
+    non_lette = dict(
+        Profile.objects.filter(
+            user_id__in={notifica.utente_destinatario_id for notifica in notifiche}
+        ).values_list('user_id', 'notifiche_non_lette')
+    )
+    eventi = []
+    for notifica in notifiche:
+        if notifica.asta_riferimento_id:
+            url = reverse('aste:dettaglio_asta', args=[notifica.asta_riferimento_id])
+        else:
+            url = reverse('aste:notifiche')
+        eventi.append((
+            gruppo_notifiche(notifica.utente_destinatario_id),
+            {
+                'type': 'notifica_nuova',
+                'dati_notifica': {
+                    'messaggio': notifica.messaggio,
+                    'url': url,
+                    'non_lette': non_lette.get(notifica.utente_destinatario_id, 0),
+                }
+            }
+        ))
+    return eventi
+
+
+def annuncia_notifiche(notifiche):
+    """
+    Invia le notifiche appena create ai destinatari collegati via WebSocket
+    (vedi `NotificheConsumer`), insieme al nuovo numero di notifiche non lette.
+    Va chiamata dopo il commit, quando i contatori sui profili sono già aggiornati.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not notifiche:
+        return
+    for gruppo, evento in _eventi_notifiche(notifiche):
+        async_to_sync(channel_layer.group_send)(gruppo, evento)
+
+
+async def annuncia_notifiche_async(notifiche):
+    # Come `annuncia_notifiche`, per il codice asincrono (vedi `annuncia_offerta_in_background`).
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not notifiche:
+        return
+    for gruppo, evento in await sync_to_async(_eventi_notifiche)(notifiche):
+        await channel_layer.group_send(gruppo, evento)
@@ -0,0 +1,233 @@
+import asyncio
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Asta, Notifica, Offerta, Profile
+from .notifiche import annuncia_notifiche_async
+from .statistiche import registra_prezzo
+
+# Quante volte riproviamo il compare-and-swap prima di arrenderci.
+# Ogni tentativo fallito significa che un'altra offerta è appena stata accettata,
+# quindi di solito al secondo giro la nostra offerta risulta già superata.
+MAX_TENTATIVI = 5
+
+
+@dataclass
+class EsitoOfferta:
+    """
+    Risultato di `piazza_offerta`: invece di sollevare eccezioni, il servizio
+    restituisce sempre un esito che la vista può trasformare in risposta JSON.
+    """
+    accettata: bool
+    offerta: Offerta | None = None
+    errore: str = ''
+    status: int = 200
+    # True se l'offerta era valida quando l'utente l'ha inviata,
+    # ma un altro offerente è arrivato prima.
+    superata: bool = False
+    # Notifiche create dall'offerta (es. "offerta superata") ancora da inviare
+    # in tempo reale: solo con `annuncio_differito=True`, vedi `piazza_offerta`.
+    notifiche: tuple = ()
+
+
+def _rifiutata(errore, status=400, superata=False):
+    return EsitoOfferta(accettata=False, errore=errore, status=status, superata=superata)
+
+
+def _controlla_offerta(asta, acquirente, importo):
+    # Restituisce l'esito di rifiuto se l'offerta non è valida per lo stato attuale dell'asta.
+    if asta.stato != 'attiva' or asta.data_fine <= timezone.now():
+        return _rifiutata('Questa asta è conclusa.')
+
+    if importo < asta.prezzo_attuale + asta.rilancio_minimo or (
+        asta.numero_offerte and importo <= asta.prezzo_attuale
+    ):
+        # Se a condurre l'asta è un altro utente, l'offerta è stata superata:
+        # tipicamente il prezzo è salito mentre l'utente stava rilanciando.
+        superata = asta.miglior_offerente_id not in (None, acquirente.pk)
+        return _rifiutata(
+            'La tua offerta non rispetta il rilancio minimo.',
+            status=409 if superata else 400,
+            superata=superata,
+        )
+    return None
+
+
+def piazza_offerta(
+    asta_pk, acquirente, importo, annuncio_differito=False, annuncia_prezzo=False, loop_annunci=None
+):
+    """
+    Valida e registra un'offerta sull'asta `asta_pk`.
+
+    Le offerte sulla stessa asta vengono serializzate: la riga dell'asta viene
+    bloccata con SELECT ... FOR UPDATE (sui database che lo supportano) e
+    l'aggiornamento è comunque un compare-and-swap su `numero_offerte`
+    (vedi `Asta.registra_offerta`), così due offerenti concorrenti non possono
+    superare entrambi il controllo sul rilancio minimo.
+
+    Con `annuncio_differito=True` le notifiche ai superati non vengono inviate
+    dopo il commit (cioè dentro la richiesta) ma restituite in `esito.notifiche`:
+    il chiamante asincrono le invia quando vuole (vedi `AstaConsumer`).
+
+    Con `annuncia_prezzo=True` dopo il commit viene inviato anche il nuovo prezzo
+    (vedi `annuncia_offerta`). Se `loop_annunci` è un event loop di lunga durata
+    (quello del server ASGI) prezzo e notifiche partono lì in background, senza
+    far aspettare chi chiama; altrimenti vengono inviati subito, nel commit.
+    """
+    try:
+        importo = Decimal(str(importo)).quantize(Decimal('0.01'))
+    except (InvalidOperation, TypeError, ValueError):
+        return _rifiutata("Importo dell'offerta non valido.")
+    # "NaN" supera la conversione ma non si può confrontare con il prezzo.
+    if not importo.is_finite() or importo <= 0:
+        return _rifiutata("Importo dell'offerta non valido.")
+
+    try:
+        if acquirente.profile.ruolo != 'acquirente':
+            return _rifiutata('Solo gli acquirenti possono fare offerte.', status=403)
+    except Profile.DoesNotExist:
+        return _rifiutata('Solo gli acquirenti possono fare offerte.', status=403)
+
+    # Controllo preliminare senza lock: il prezzo può solo salire e un'asta conclusa
+    # non torna attiva, quindi un'offerta già insufficiente su questa lettura lo sarà
+    # anche dopo. Durante una raffica di offerte la maggior parte viene rifiutata qui,
+    # senza mettersi in coda per il lock in scrittura.
+    try:
+        rifiuto = _controlla_offerta(Asta.objects.get(pk=asta_pk), acquirente, importo)
+    except Asta.DoesNotExist:
+        return _rifiutata('Asta non trovata.', status=404)
+    if rifiuto is not None:
+        return rifiuto
+
+    for _ in range(MAX_TENTATIVI):
+        with transaction.atomic():
+            try:
+                asta = Asta.objects.select_for_update().get(pk=asta_pk)
+            except Asta.DoesNotExist:
+                return _rifiutata('Asta non trovata.', status=404)
+
+            rifiuto = _controlla_offerta(asta, acquirente, importo)
+            if rifiuto is not None:
+                return rifiuto
+
+            precedente_id = asta.miglior_offerente_id
+            try:
+                with transaction.atomic():
+                    offerta = asta.registra_offerta(acquirente, importo)
+            except IntegrityError:
+                # Stesso importo già offerto da qualcun altro (unique_together asta/importo).
+                return _rifiutata('Un altro utente ha già offerto questo importo.', status=409, superata=True)
+
+            if offerta is not None:
+                notifiche = []
+                if precedente_id not in (None, acquirente.pk):
+                    # Avvisiamo chi conduceva l'asta che la sua offerta è stata superata.
+                    notifiche = Notifica.objects.crea_notifiche([Notifica(
+                        utente_destinatario_id=precedente_id,
+                        messaggio=f"La tua offerta su '{asta.titolo}' è stata superata: il nuovo prezzo è €{offerta.importo}.",
+                        asta_riferimento=asta,
+                    )], annuncia=not (annuncio_differito or loop_annunci))
+                # Il nuovo prezzo può alzare il massimo usato dai filtri di ricerca.
+                transaction.on_commit(lambda: registra_prezzo(asta))
+                if annuncia_prezzo:
+                    transaction.on_commit(lambda: _annuncia_dopo_il_commit(offerta, notifiche, loop_annunci))
+                return EsitoOfferta(
+                    accettata=True, offerta=offerta, notifiche=tuple(notifiche) if annuncio_differito else ()
+                )
+
+    return _rifiutata("L'asta ha ricevuto troppe offerte contemporanee, riprova.", status=409, superata=True)
+
+
+def evento_offerta(offerta):
+    # Messaggio per il gruppo `asta_{pk}` (gestito da `AstaConsumer.offerta_aggiornata`).
+    return {
+        'type': 'offerta_aggiornata',
+        'dati_offerta': {
+            'asta_id': offerta.asta_id,
+            'nuovo_prezzo': f"{offerta.importo:.2f}",
+            'acquirente': offerta.acquirente.username,
+            # Numero d'ordine dell'offerta sull'asta (`numero_offerte` dopo il rilancio):
+            # cresce sempre, quindi il client riconosce messaggi vecchi o mancanti.
+            'seq': offerta.asta.numero_offerte,
+        }
+    }
+
+
+def istantanea_asta(asta_pk):
+    """
+    Stato attuale dell'asta per un client appena (ri)connesso: stessi campi
+    dei messaggi di `evento_offerta` più scadenza e stato, con `seq` uguale
+    a `numero_offerte`. Restituisce None se l'asta non esiste.
+    """
+    asta = Asta.objects.filter(pk=asta_pk).values(
+        'prezzo_attuale', 'numero_offerte', 'data_fine', 'stato', 'miglior_offerente__username'
+    ).first()
+    if asta is None:
+        return None
+    return {
+        'istantanea': True,
+        'asta_id': int(asta_pk),
+        'nuovo_prezzo': f"{asta['prezzo_attuale']:.2f}",
+        'acquirente': asta['miglior_offerente__username'],
+        'numero_offerte': asta['numero_offerte'],
+        'data_fine': asta['data_fine'].isoformat(),
+        'stato': asta['stato'],
+        'seq': asta['numero_offerte'],
+    }
+
+
+def annuncia_offerta(offerta):
+    """
+    Invia il nuovo prezzo a tutti i client collegati alla pagina dell'asta
+    (gruppo `asta_{pk}`, vedi `AstaConsumer`).
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(f'asta_{offerta.asta_id}', evento_offerta(offerta))
+
+
+def _annuncia_dopo_il_commit(offerta, notifiche, loop):
+    if loop is None:
+        # Le notifiche sono già state inviate nel commit da `crea_notifiche`.
+        annuncia_offerta(offerta)
+    else:
+        loop.call_soon_threadsafe(annuncia_offerta_in_background, offerta, notifiche)
+
+
+# Riferimenti ai broadcast lanciati in background, così il garbage collector
+# non li cancella prima che abbiano finito.
+_annunci_in_corso = set()
+
+
+def annuncia_offerta_in_background(offerta, notifiche=()):
+    """
+    Versione per l'event loop del server: il broadcast (e l'invio delle `notifiche`)
+    parte come task sul loop corrente, senza far aspettare chi chiama.
+
+    Va usata solo su un loop che sopravvive alla richiesta: quello creato da
+    asgiref per una vista async sotto un handler sincrono (WSGI, `Client` dei test)
+    viene chiuso alla risposta e i task ancora in corso vengono cancellati.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    _in_background(channel_layer.group_send(f'asta_{offerta.asta_id}', evento_offerta(offerta)))
+    if notifiche:
+        annuncia_notifiche_in_background(notifiche)
+
+
+def annuncia_notifiche_in_background(notifiche):
+    # Invio in tempo reale delle notifiche senza far aspettare chi chiama.
+    _in_background(annuncia_notifiche_async(notifiche))
+
+
+def _in_background(annuncio):
+    task = asyncio.get_running_loop().create_task(annuncio)
+    _annunci_in_corso.add(task)
+    task.add_done_callback(_annunci_in_corso.discard)
@@ -0,0 +1,46 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+# Numero di aste per pagina nella homepage (e per ogni "scroll" successivo).
+DIMENSIONE_PAGINA = 12
+
+
+def codifica_cursore(asta):
+    # Il cursore identifica l'ultima asta mostrata tramite la coppia (data_fine, id),
+    # che è anche la chiave di ordinamento della lista.
+    valore = f"{asta.data_fine.isoformat()}|{asta.pk}"
+    return base64.urlsafe_b64encode(valore.encode()).decode()
+
+
+def decodifica_cursore(cursore):
+    # Un cursore assente o non valido equivale alla prima pagina.
+    if not cursore:
+        return None
+    try:
+        data_fine, pk = base64.urlsafe_b64decode(cursore.encode()).decode().split('|')
+        return datetime.fromisoformat(data_fine), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def pagina_keyset(queryset, cursore=None, dimensione=DIMENSIONE_PAGINA):
+    """
+    Paginazione "keyset" su (data_fine, id): invece di un OFFSET, che obbliga il
+    database a scorrere tutte le righe precedenti, filtra le aste che vengono
+    dopo l'ultima mostrata. Il costo di ogni pagina resta costante.
+
+    Restituisce la lista delle aste della pagina e il cursore della pagina
+    successiva (None se non ci sono altre aste).
+    """
+    queryset = queryset.order_by('data_fine', 'pk')
+    posizione = decodifica_cursore(cursore)
+    if posizione:
+        data_fine, pk = posizione
+        queryset = queryset.filter(Q(data_fine__gt=data_fine) | Q(data_fine=data_fine, pk__gt=pk))
+
+    # Chiediamo un elemento in più per sapere se esiste una pagina successiva.
+    aste = list(queryset[:dimensione + 1])
+    prossimo = codifica_cursore(aste[dimensione - 1]) if len(aste) > dimensione else None
+    return aste[:dimensione], prossimo
@@ -0,0 +1,95 @@
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Asta
+
+# Quante aste suggerire per ogni categoria della lista dei desideri.
+SUGGERIMENTI_PER_CATEGORIA = 3
+# Le raccomandazioni vengono comunque ricalcolate dopo un'ora.
+DURATA_CACHE = 60 * 60
+
+CHIAVE_VERSIONE = 'raccomandazioni:versione'
+
+
+def _versione():
+    # La versione "globale" cambia quando cambia lo stato delle aste
+    # (es. nuove aste concluse): cambiando versione tutte le chiavi precedenti
+    # diventano irraggiungibili, senza doverle cancellare una per una.
+    versione = cache.get(CHIAVE_VERSIONE)
+    if versione is None:
+        cache.add(CHIAVE_VERSIONE, 1, None)
+        versione = cache.get(CHIAVE_VERSIONE, 1)
+    return versione
+
+
+def _chiave_utente(user_id):
+    return f'raccomandazioni:{_versione()}:{user_id}'
+
+
+def invalida_raccomandazioni(user=None):
+    """
+    Con un utente invalida solo le sue raccomandazioni (es. dopo una modifica
+    alla lista dei desideri); senza argomenti le invalida per tutti.
+    """
+    if user is not None:
+        cache.delete(_chiave_utente(user.pk))
+        return
+    try:
+        cache.incr(CHIAVE_VERSIONE)
+    except ValueError:
+        cache.set(CHIAVE_VERSIONE, 1, None)
+
+
+def _calcola_suggerimenti(user, desideri):
+    # Spiegazione: Una sola query per tutte le categorie della lista dei desideri.
+    # ROW_NUMBER() numera le aste candidate all'interno di ogni categoria
+    # (PARTITION BY categoria) e teniamo solo le prime N di ciascuna.
+    categorie_ids = {asta.categoria_id for asta in desideri}
+    candidate = Asta.objects.filter(
+        categoria_id__in=categorie_ids,
+        stato='conclusa',
+        numero_offerte__gt=0,
+    ).exclude(
+        pk__in=[asta.pk for asta in desideri]
+    ).exclude(
+        # Escludiamo le aste vinte dall'utente stesso.
+        miglior_offerente=user
+    ).annotate(
+        posizione=Window(
+            expression=RowNumber(),
+            partition_by=F('categoria'),
+            order_by=[F('data_fine').desc(), F('pk').desc()],
+        )
+    ).filter(
+        posizione__lte=SUGGERIMENTI_PER_CATEGORIA
+    ).order_by('categoria', 'posizione').values_list('categoria_id', 'pk')
+
+    suggerimenti = {}
+    for categoria_id, pk in candidate:
+        suggerimenti.setdefault(categoria_id, []).append(pk)
+    return suggerimenti
+
+
+def raccomandazioni_per_categoria(user, desideri):
+    """
+    Restituisce un dizionario {categoria_id: [Asta, ...]} con le aste suggerite
+    per le categorie della lista dei desideri `desideri`.
+
+    Gli id suggeriti sono in cache per utente; le aste vengono poi caricate
+    con un'unica query, così prezzi e offerenti mostrati sono sempre aggiornati.
+    """
+    if not desideri:
+        return {}
+    chiave = _chiave_utente(user.pk)
+    suggerimenti = cache.get(chiave)
+    if suggerimenti is None:
+        suggerimenti = _calcola_suggerimenti(user, desideri)
+        cache.set(chiave, suggerimenti, DURATA_CACHE)
+
+    tutti_ids = [pk for pks in suggerimenti.values() for pk in pks]
+    aste = Asta.objects.select_related('miglior_offerente').in_bulk(tutti_ids)
+    return {
+        categoria_id: [aste[pk] for pk in pks if pk in aste]
+        for categoria_id, pks in suggerimenti.items()
+    }
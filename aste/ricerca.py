@@ -0,0 +1,144 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.utils.module_loading import import_string
+
+from .models import Asta
+
+# Nome della tabella virtuale FTS5 (creata dalla migrazione 0006 solo su SQLite).
+TABELLA_FTS = 'aste_asta_fts'
+
+
+class BackendRicerca:
+    """
+    Interfaccia comune dei motori di ricerca testuale sulle aste.
+
+    `filtra` restringe il queryset alle aste che contengono il testo cercato
+    (in titolo o descrizione) e aggiunge l'annotazione `rilevanza`:
+    più è alta, più l'asta è pertinente.
+    """
+
+    def filtra(self, queryset, testo):
+        raise NotImplementedError
+
+    def indicizza(self, asta):
+        # Chiamato al salvataggio di un'asta (vedi aste/signals.py).
+        pass
+
+    def rimuovi(self, asta_pk):
+        # Chiamato alla cancellazione di un'asta.
+        pass
+
+    def ricostruisci_indice(self):
+        # Da usare dopo inserimenti in blocco (bulk_create non invia i segnali).
+        pass
+
+
+class BackendIcontains(BackendRicerca):
+    # Ricerca di ripiego senza indice: LIKE '%testo%' su titolo e descrizione.
+
+    def filtra(self, queryset, testo):
+        return queryset.filter(
+            Q(titolo__icontains=testo) | Q(descrizione__icontains=testo)
+        ).annotate(rilevanza=Value(0.0, output_field=FloatField()))
+
+
+class BackendFTS5(BackendRicerca):
+    """
+    Ricerca full-text con una tabella virtuale FTS5 di SQLite, con rowid = id dell'asta.
+    La rilevanza è il punteggio BM25 (con il titolo che pesa più della descrizione).
+    """
+
+    PESO_TITOLO = 10.0
+    PESO_DESCRIZIONE = 1.0
+
+    @staticmethod
+    def espressione(testo):
+        # Ogni parola diventa un prefisso tra virgolette ("chit"*), così la sintassi
+        # di FTS5 nel testo dell'utente non può generare errori e "chit" trova "chitarra".
+        parole = re.findall(r'\w+', testo.lower())
+        return ' '.join(f'"{parola}"*' for parola in parole)
+
+    def filtra(self, queryset, testo):
+        espressione = self.espressione(testo)
+        if not espressione:
+            return queryset.annotate(rilevanza=Value(0.0, output_field=FloatField()))
+        tabella = connection.ops.quote_name(TABELLA_FTS)
+        tabella_aste = connection.ops.quote_name(Asta._meta.db_table)
+        # Uniamo la tabella FTS con una JOIN sul rowid: la ricerca full-text viene eseguita
+        # una sola volta per query (una subquery correlata la ripeterebbe per ogni riga).
+        # bm25() restituisce valori negativi (più basso = più pertinente): lo invertiamo.
+        return queryset.extra(
+            tables=[TABELLA_FTS],
+            where=[f"{tabella}.rowid = {tabella_aste}.id", f"{tabella} MATCH %s"],
+            params=[espressione],
+            select={'rilevanza': f"-bm25({tabella}, {self.PESO_TITOLO}, {self.PESO_DESCRIZIONE})"},
+        )
+
+    def indicizza(self, asta):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABELLA_FTS} WHERE rowid = %s", [asta.pk])
+            cursor.execute(
+                f"INSERT INTO {TABELLA_FTS} (rowid, titolo, descrizione) VALUES (%s, %s, %s)",
+                [asta.pk, asta.titolo, asta.descrizione],
+            )
+
+    def rimuovi(self, asta_pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABELLA_FTS} WHERE rowid = %s", [asta_pk])
+
+    def ricostruisci_indice(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABELLA_FTS}")
+            cursor.execute(
+                f"INSERT INTO {TABELLA_FTS} (rowid, titolo, descrizione) "
+                f"SELECT id, titolo, descrizione FROM {Asta._meta.db_table}"
+            )
+
+
+class BackendPostgres(BackendRicerca):
+    """
+    Ricerca full-text con i tsvector di PostgreSQL (django.contrib.postgres).
+    Il filtro `@@` usa l'indice GIN creato dalla migrazione 0013 sulla stessa
+    espressione di `vettore()`: l'indice si aggiorna da solo a ogni salvataggio,
+    come la tabella FTS5 su SQLite, e la ricerca non scorre tutta la tabella.
+    """
+
+    # Configurazione esplicita: `to_tsvector` senza configurazione non si può indicizzare.
+    # Deve restare uguale a quella della migrazione 0013.
+    CONFIGURAZIONE = 'italian'
+
+    def vettore(self):
+        from django.contrib.postgres.search import SearchVector
+
+        return (
+            SearchVector('titolo', weight='A', config=self.CONFIGURAZIONE)
+            + SearchVector('descrizione', weight='B', config=self.CONFIGURAZIONE)
+        )
+
+    def filtra(self, queryset, testo):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        query = SearchQuery(testo, search_type='websearch', config=self.CONFIGURAZIONE)
+        return queryset.alias(vettore=self.vettore()).filter(vettore=query).annotate(
+            rilevanza=SearchRank(F('vettore'), query)
+        )
+
+
+@lru_cache(maxsize=None)
+def backend_ricerca():
+    """
+    Restituisce il motore di ricerca da usare: quello indicato nel setting
+    `ASTE_BACKEND_RICERCA` (percorso della classe) oppure quello adatto al database.
+    """
+    percorso = getattr(settings, 'ASTE_BACKEND_RICERCA', None)
+    if percorso:
+        return import_string(percorso)()
+    if connection.vendor == 'sqlite':
+        return BackendFTS5()
+    if connection.vendor == 'postgresql':
+        return BackendPostgres()
+    return BackendIcontains()
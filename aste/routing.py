@@ -3,4 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/asta/(?P<pk>\d+)/$', consumers.AstaConsumer.as_asgi()),
+    re_path(r'ws/aste/$', consumers.AsteConsumer.as_asgi()),
+    re_path(r'ws/notifiche/$', consumers.NotificheConsumer.as_asgi()),
 ]
\ No newline at end of file
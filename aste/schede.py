@@ -0,0 +1,36 @@
+from django.db.models import prefetch_related_objects
+
+from .models import Asta
+
+
+def prepara_schede(aste, user):
+    """
+    Prepara una pagina di aste per il template `_asta_card.html`.
+
+    Con un numero fisso di query, indipendente dal numero di card, imposta su
+    ogni asta:
+    - `miglior_offerente` già caricato (nessuna query per card nel template);
+    - `utente_sta_vincendo`: True se l'utente corrente è il miglior offerente;
+    - `nei_desideri_utente`: True se l'asta è nella lista dei desideri dell'utente.
+
+    Restituisce le aste come lista, nello stesso ordine ricevuto.
+    """
+    aste = list(aste)
+    # Carica i miglior offerenti mancanti con una sola query
+    # (non fa nulla se il queryset usava già select_related).
+    prefetch_related_objects(aste, 'miglior_offerente')
+
+    desideri_ids = set()
+    if user.is_authenticated and aste:
+        # Una sola query sulla tabella ponte della lista dei desideri,
+        # limitata alle aste della pagina.
+        desideri_ids = set(
+            Asta.utenti_lista_desideri.through.objects.filter(
+                user_id=user.pk, asta_id__in=[asta.pk for asta in aste]
+            ).values_list('asta_id', flat=True)
+        )
+
+    for asta in aste:
+        asta.utente_sta_vincendo = user.is_authenticated and asta.miglior_offerente_id == user.pk
+        asta.nei_desideri_utente = asta.pk in desideri_ids
+    return aste
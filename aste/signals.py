@@ -0,0 +1,126 @@
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .immagini import rilascia_immagine
+from .models import Asta, Feedback, Notifica, Profile, ReputazioneVenditore
+from .notifiche import annuncia_notifiche
+from .ricerca import backend_ricerca
+from .statistiche import invalida_statistiche, registra_nuova_asta
+
+# Campi che finiscono nell'indice di ricerca testuale.
+CAMPI_INDICIZZATI = {'titolo', 'descrizione'}
+
+# Campi che influiscono sulle statistiche dei filtri di ricerca (vedi aste/statistiche.py).
+CAMPI_STATISTICHE = {'categoria', 'prezzo_base', 'stato'}
+
+
+@receiver(post_save, sender=Asta)
+def aggiorna_indice_ricerca(sender, instance, created, update_fields=None, **kwargs):
+    # Se il salvataggio riguarda solo altri campi (es. lo stato), l'indice non cambia.
+    if update_fields is not None and not CAMPI_INDICIZZATI.intersection(update_fields):
+        return
+    backend_ricerca().indicizza(instance)
+
+
+@receiver(post_delete, sender=Asta)
+def rimuovi_da_indice_ricerca(sender, instance, **kwargs):
+    backend_ricerca().rimuovi(instance.pk)
+
+
+@receiver(post_save, sender=Asta)
+def aggiorna_statistiche(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        transaction.on_commit(lambda: registra_nuova_asta(instance))
+    elif update_fields is None or CAMPI_STATISTICHE.intersection(update_fields):
+        transaction.on_commit(invalida_statistiche)
+
+
+@receiver(post_delete, sender=Asta)
+def rilascia_file_immagine(sender, instance, **kwargs):
+    # Il file può essere condiviso con altre aste (stesso contenuto): lo cancella
+    # solo se era l'ultima a usarlo, e solo se la cancellazione va a buon fine.
+    nome, derivati = instance.immagine.name, instance.derivati
+    transaction.on_commit(lambda: rilascia_immagine(nome, derivati))
+
+
+@receiver(post_delete, sender=Asta)
+def rimuovi_da_statistiche(sender, instance, **kwargs):
+    # L'asta cancellata potrebbe essere quella con il prezzo più alto.
+    transaction.on_commit(lambda: invalida_statistiche(prezzo=True))
+
+
+def invalida_dettaglio_asta(asta):
+    # Il frammento in cache della pagina di dettaglio (vedi dettaglio_asta.html) cambia chiave
+    # a ogni offerta o cambio di stato; le altre modifiche (testo, immagine, feedback) lo cancellano.
+    cache.delete(make_template_fragment_key('dettaglio_asta', [asta.pk, asta.numero_offerte, asta.stato]))
+
+
+@receiver(post_save, sender=Asta)
+def aggiorna_dettaglio_asta(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalida_dettaglio_asta(instance))
+
+
+@receiver(post_save, sender=Feedback)
+@receiver(post_delete, sender=Feedback)
+def aggiorna_dettaglio_asta_feedback(sender, instance, **kwargs):
+    # Rileggiamo l'asta dopo il commit: se il feedback è stato cancellato
+    # a cascata insieme all'asta, non c'è più niente da invalidare.
+    def invalida():
+        asta = Asta.objects.filter(pk=instance.asta_id).first()
+        if asta is not None:
+            invalida_dettaglio_asta(asta)
+    transaction.on_commit(invalida)
+
+
+@receiver(pre_save, sender=Feedback)
+def ricorda_voto_precedente(sender, instance, **kwargs):
+    # Un feedback modificato (es. dall'admin) può cambiare voto o destinatario:
+    # ci serve il voto salvato per toglierlo dal riepilogo.
+    instance._voto_precedente = None
+    if not instance._state.adding:
+        instance._voto_precedente = (
+            Feedback.objects.filter(pk=instance.pk).values_list('destinatario_id', 'voto').first()
+        )
+
+
+# Riepilogo dei voti del venditore (media, conteggio, istogramma) usato da ricerca e profilo.
+@receiver(post_save, sender=Feedback)
+def registra_voto_venditore(sender, instance, created, **kwargs):
+    if created:
+        ReputazioneVenditore.objects.registra_voto(instance.destinatario_id, instance.voto)
+        return
+    precedente = getattr(instance, '_voto_precedente', None)
+    if precedente is not None and precedente != (instance.destinatario_id, instance.voto):
+        # Spiegazione: Applichiamo solo la differenza: via il voto vecchio, dentro quello nuovo.
+        with transaction.atomic():
+            ReputazioneVenditore.objects.registra_voto(*precedente, delta=-1)
+            ReputazioneVenditore.objects.registra_voto(instance.destinatario_id, instance.voto)
+
+
+@receiver(post_delete, sender=Feedback)
+def rimuovi_voto_venditore(sender, instance, **kwargs):
+    ReputazioneVenditore.objects.registra_voto(instance.destinatario_id, instance.voto, delta=-1)
+
+
+# Le notifiche create una alla volta (es. dall'admin) aggiornano il contatore del badge;
+# quelle create in blocco passano da `Notifica.objects.crea_notifiche`.
+@receiver(post_save, sender=Notifica)
+def incrementa_non_lette(sender, instance, created, **kwargs):
+    if created and not instance.letta:
+        Profile.objects.filter(user_id=instance.utente_destinatario_id).update(
+            notifiche_non_lette=F('notifiche_non_lette') + 1
+        )
+        transaction.on_commit(lambda: annuncia_notifiche([instance]))
+
+
+@receiver(post_delete, sender=Notifica)
+def decrementa_non_lette(sender, instance, **kwargs):
+    # Anche le notifiche cancellate a cascata insieme alla loro asta.
+    if not instance.letta:
+        Profile.objects.filter(user_id=instance.utente_destinatario_id, notifiche_non_lette__gt=0).update(
+            notifiche_non_lette=F('notifiche_non_lette') - 1
+        )
@@ -19,43 +19,209 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     const csrftoken = getCookie('csrftoken');
 
-    // Selettore per TUTTI i pulsanti "desideri", sia nella lista che nel dettaglio.
-    const wishListButtons = document.querySelectorAll('.desideri-btn');
+    // Gestiamo i click su TUTTI i pulsanti "desideri", sia nella lista che nel dettaglio.
+    // Usiamo un unico listener sul documento (event delegation), così funziona anche
+    // per le card aggiunte dopo il caricamento della pagina dallo scroll infinito.
+    document.addEventListener('click', function(event) {
+        const button = event.target.closest('.desideri-btn');
+        if (!button) return;
+
+        const astaId = button.dataset.astaId;
+        const url = `/asta/${astaId}/desideri/`; // L'URL della nostra API view
+
+        fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrftoken // Usiamo il token preso dal cookie
+            },
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                // Aggiorniamo il pulsante cliccato
+                if (data.added) {
+                    button.innerHTML = '♥';
+                    button.classList.remove('btn-outline-danger');
+                    button.classList.add('btn-danger');
+                } else {
+                    button.innerHTML = '♡';
+                    button.classList.remove('btn-danger');
+                    button.classList.add('btn-outline-danger');
+                }
+            }
+        })
+        .catch(error => console.error('Errore durante la richiesta desideri:', error));
+    });
 
-    wishListButtons.forEach(button => {
-        button.addEventListener('click', function(event) {
-            const astaId = this.dataset.astaId;
-            const url = `/asta/${astaId}/desideri/`; // L'URL della nostra API view
 
-            fetch(url, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': csrftoken // Usiamo il token preso dal cookie
-                },
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Aggiorniamo il pulsante cliccato
-                    if (data.added) {
-                        this.innerHTML = '♥';
-                        this.classList.remove('btn-outline-danger');
-                        this.classList.add('btn-danger');
+    // Notifiche in tempo reale: il badge esiste solo per gli utenti loggati.
+    // Ogni nuova notifica aggiorna il contatore e compare in cima alla pagina,
+    // senza dover ricaricare per sapere com'è andata un'asta.
+    const badgeNotifiche = document.getElementById('badge-notifiche');
+    const notificheLive = document.getElementById('notifiche-live');
+
+    if (badgeNotifiche) {
+        const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+        const notificheSocket = new WebSocket(protocol + window.location.host + '/ws/notifiche/');
+
+        notificheSocket.onmessage = function(e) {
+            const data = JSON.parse(e.data);
+            badgeNotifiche.textContent = data.non_lette;
+            badgeNotifiche.classList.toggle('d-none', !data.non_lette);
+
+            if (notificheLive) {
+                const avviso = document.createElement('div');
+                avviso.className = 'alert alert-info alert-dismissible';
+                const link = document.createElement('a');
+                link.href = data.url;
+                link.className = 'alert-link';
+                link.textContent = data.messaggio; // textContent: il messaggio non viene interpretato come HTML
+                const chiudi = document.createElement('button');
+                chiudi.type = 'button';
+                chiudi.className = 'close';
+                chiudi.innerHTML = '&times;';
+                chiudi.addEventListener('click', () => avviso.remove());
+                avviso.append(link, chiudi);
+                notificheLive.prepend(avviso);
+            }
+        };
+
+        notificheSocket.onerror = function(error) {
+            console.error("[WS] Errore WebSocket notifiche:", error);
+        };
+    }
+
+
+    // Scroll infinito della homepage: quando l'elemento "carica altre" diventa visibile
+    // chiediamo la pagina successiva all'endpoint JSON e aggiungiamo le card alla griglia.
+    const caricaAltre = document.getElementById('carica-altre-aste');
+    const grigliaAste = document.getElementById('griglia-aste');
+
+    if (caricaAltre && grigliaAste && 'IntersectionObserver' in window) {
+        let inCaricamento = false;
+
+        const observer = new IntersectionObserver(function(entries) {
+            if (!entries[0].isIntersecting || inCaricamento) return;
+            const prossimo = caricaAltre.dataset.prossimo;
+            if (!prossimo) return;
+
+            inCaricamento = true;
+            fetch(`${caricaAltre.dataset.url}?dopo=${encodeURIComponent(prossimo)}`)
+                .then(response => response.json())
+                .then(data => {
+                    grigliaAste.insertAdjacentHTML('beforeend', data.html);
+                    document.dispatchEvent(new CustomEvent('aste:card-aggiunte', { detail: data.aste }));
+                    if (data.prossimo) {
+                        caricaAltre.dataset.prossimo = data.prossimo;
+                        caricaAltre.querySelector('a').href = `?dopo=${data.prossimo}`;
                     } else {
-                        this.innerHTML = '♡';
-                        this.classList.remove('btn-danger');
-                        this.classList.add('btn-outline-danger');
+                        observer.disconnect();
+                        caricaAltre.remove();
                     }
-                }
-            })
-            .catch(error => console.error('Errore durante la richiesta desideri:', error));
-        });
-    });
+                })
+                .catch(error => console.error('Errore durante il caricamento delle aste:', error))
+                .finally(() => { inCaricamento = false; });
+        }, { rootMargin: '400px' });
+
+        observer.observe(caricaAltre);
+    }
 
     
+    // Prezzi in tempo reale sulle card (home, ricerca, profilo): un'unica connessione
+    // a ws/aste/ su cui ci iscriviamo alle aste attive mostrate nella pagina.
+    // La pagina di dettaglio ha già il suo socket, quindi qui non serve.
+    const utenteCorrente = document.body.dataset.utente;
+
+    function iscriviCardVisibili(socket, iscritte) {
+        const nuove = [];
+        document.querySelectorAll('[data-asta-live]').forEach(card => {
+            const id = parseInt(card.dataset.astaLive, 10);
+            if (!iscritte.has(id)) {
+                iscritte.add(id);
+                nuove.push(id);
+            }
+        });
+        if (nuove.length) {
+            socket.send(JSON.stringify({ azione: 'iscrivi', aste: nuove }));
+        }
+    }
+
+    function aggiornaCard(data) {
+        const prezzo = document.getElementById(`prezzo-asta-${data.asta_id}`);
+        const info = document.getElementById(`acquirente-info-${data.asta_id}`);
+        if (!prezzo || !info) return;
+
+        const riga = document.createElement('p');
+        if (data.conclusa) {
+            prezzo.innerHTML = `Prezzo finale: <strong>€${data.prezzo_finale}</strong>`;
+            riga.className = 'text-danger font-weight-bold';
+            riga.textContent = 'Asta Conclusa!';
+            const esito = document.createElement('p');
+            esito.innerHTML = '<small></small>';
+            esito.firstChild.textContent = data.vincitore ? `Vinta da: ${data.vincitore}` : 'Nessuna offerta ricevuta.';
+            info.replaceChildren(riga, esito);
+            return;
+        }
+
+        prezzo.innerHTML = `Prezzo attuale: <strong>€${data.nuovo_prezzo}</strong>`;
+        if (data.acquirente === utenteCorrente) {
+            riga.className = 'text-success font-weight-bold';
+            riga.textContent = 'Stai vincendo tu!';
+        } else {
+            riga.innerHTML = '<small></small>';
+            riga.firstChild.textContent = `Ultima offerta di: ${data.acquirente}`;
+        }
+        info.replaceChildren(riga);
+    }
+
+    if (document.querySelector('[data-asta-live]') && !document.getElementById('dettaglio-asta-container')) {
+        const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+        const asteSocket = new WebSocket(protocol + window.location.host + '/ws/aste/');
+        const iscritte = new Set();
+
+        asteSocket.onopen = function() {
+            iscriviCardVisibili(asteSocket, iscritte);
+            // Le card caricate dallo scroll infinito vengono seguite anche loro.
+            document.addEventListener('aste:card-aggiunte', () => iscriviCardVisibili(asteSocket, iscritte));
+        };
+
+        asteSocket.onmessage = function(e) {
+            const data = JSON.parse(e.data);
+            if (data.errore) {
+                console.warn('[WS] ' + data.errore);
+                return;
+            }
+            aggiornaCard(data);
+        };
+
+        asteSocket.onerror = function(error) {
+            console.error("[WS] Errore WebSocket aste:", error);
+        };
+    }
+
+
     // Possiamo aggiungere qui anche lo script per le offerte
     const offertaForm = document.getElementById('offerta-form');
+    // Socket della pagina di dettaglio (aperto più sotto): se è connesso le offerte
+    // viaggiano su di esso, altrimenti usiamo la normale richiesta POST.
+    let astaSocket = null;
+    let ultimaRichiesta = 0;
+
+    function mostraEsitoOfferta(accettata, dati) {
+        const errorDiv = document.getElementById('error-message');
+        if (accettata) {
+            // Successo! Aggiorniamo la pagina
+            errorDiv.style.display = 'none';
+            document.querySelector('#prezzo-attuale').innerHTML = `Prezzo attuale: € ${dati.nuovo_prezzo}`;
+            document.querySelector('#acquirente-attuale').innerHTML = `<small>Offerta fatta da: ${dati.acquirente}</small>`;
+            offertaForm.reset();
+        } else {
+            // Errore! Mostriamo il messaggio di errore
+            errorDiv.textContent = dati.errore;
+            errorDiv.style.display = 'block';
+        }
+    }
 
     if (offertaForm) {
         offertaForm.addEventListener('submit', function(event) {
@@ -63,12 +229,18 @@ document.addEventListener('DOMContentLoaded', function() {
             // 1. Impediamo l'invio tradizionale del form, che ricaricherebbe la pagina
             event.preventDefault();
 
-            // Leggiamo l'URL dall'attributo data-url che abbiamo messo nel form!
-            const url = offertaForm.dataset.url; 
-            
             const importo = offertaForm.querySelector('#importo-offerta').value;
-            
-            // 2. Usiamo l'API `fetch` per la nostra richiesta AJAX
+
+            // 2a. Se il WebSocket è aperto, l'offerta è un solo messaggio sul socket:
+            //     la risposta (ack o rifiuto) arriva in astaSocket.onmessage.
+            if (astaSocket && astaSocket.readyState === WebSocket.OPEN) {
+                astaSocket.send(JSON.stringify({ azione: 'offerta', importo: importo, id: ++ultimaRichiesta }));
+                return;
+            }
+
+            // 2b. Altrimenti usiamo l'API `fetch` per la nostra richiesta AJAX.
+            //     Leggiamo l'URL dall'attributo data-url che abbiamo messo nel form!
+            const url = offertaForm.dataset.url; 
             fetch(url, {
                 method: 'POST',
                 headers: {
@@ -80,18 +252,7 @@ document.addEventListener('DOMContentLoaded', function() {
             .then(response => response.json()) // 3. Attendiamo la risposta e la convertiamo in JSON
             .then(data => {
                 // 4. Gestiamo la risposta del server
-                const errorDiv = document.getElementById('error-message');
-                if (data.success) {
-                    // Successo! Aggiorniamo la pagina
-                    errorDiv.style.display = 'none';
-                    document.querySelector('#prezzo-attuale').innerHTML = `Prezzo attuale: € ${data.nuovo_prezzo}`;
-                    document.querySelector('#acquirente-attuale').innerHTML = `<small>Offerta fatta da: ${data.acquirente}</small>`;
-                    offertaForm.reset();
-                } else {
-                    // Errore! Mostriamo il messaggio di errore
-                    errorDiv.textContent = data.error;
-                    errorDiv.style.display = 'block';
-                }
+                mostraEsitoOfferta(data.success, { ...data, errore: data.error });
             })
             .catch(error => {
                 console.error('Errore Fetch:', error);
@@ -144,17 +305,38 @@ document.addEventListener('DOMContentLoaded', function() {
 
     if (astaDetailContainer) {
         const astaId = astaDetailContainer.dataset.astaId;
-        
-        if (astaId) {
+        // Numero dell'ultima offerta mostrata (`seq` nei messaggi del server):
+        // i messaggi con seq più basso sono vecchi e vengono ignorati.
+        let ultimoSeq = parseInt(astaDetailContainer.dataset.seq || '0', 10);
+        let tentativiRiconnessione = 0;
+
+        function mostraPrezzo(data) {
+            document.querySelector('#prezzo-attuale').innerHTML = `Prezzo attuale: € ${data.nuovo_prezzo}`;
+            document.querySelector('#acquirente-attuale').innerHTML = data.acquirente
+                ? `<small>Offerta fatta da: ${data.acquirente}</small>`
+                : '<small>Nessuna offerta ancora ricevuta.</small>';
+        }
+
+        function mostraConclusa(vincitore) {
+            // L'asta è stata chiusa dallo scheduler: togliamo il form e mostriamo l'esito.
+            const form = document.getElementById('offerta-form');
+            if (form) form.remove();
+            const esito = vincitore ? `Vinta da: ${vincitore}` : 'Nessuna offerta ricevuta.';
+            document.querySelector('#acquirente-attuale').innerHTML =
+                `<span class="text-danger font-weight-bold">Asta Conclusa!</span> <small>${esito}</small>`;
+        }
+
+        function connettiAsta() {
             console.log(`[WS] Tentativo di connessione all'asta ${astaId}...`);
 
             const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
             const socketUrl = protocol + window.location.host + '/ws/asta/' + astaId + '/';
-            const astaSocket = new WebSocket(socketUrl);
+            astaSocket = new WebSocket(socketUrl);
 
             // Evento: Connessione Aperta
             astaSocket.onopen = function(e) {
                 console.log(`[WS] Connessione per asta ${astaId} stabilita con successo!`);
+                tentativiRiconnessione = 0;
             };
 
             // Evento: Messaggio Ricevuto
@@ -162,18 +344,43 @@ document.addEventListener('DOMContentLoaded', function() {
                 console.log("[WS] Messaggio ricevuto dal server:", e.data);
                 try {
                     const data = JSON.parse(e.data);
-                    if (!data.nuovo_prezzo || !data.acquirente) return;
+                    if (data.istantanea) {
+                        // Stato completo inviato alla connessione (o su richiesta di sincronizzazione).
+                        ultimoSeq = data.seq;
+                        mostraPrezzo(data);
+                        if (data.stato === 'conclusa') mostraConclusa(data.acquirente);
+                        return;
+                    }
+                    if (data.esito) {
+                        // Risposta a un'offerta inviata da noi su questo socket.
+                        if (data.esito === 'ack') ultimoSeq = Math.max(ultimoSeq, data.seq);
+                        mostraEsitoOfferta(data.esito === 'ack', data);
+                        return;
+                    }
+                    if (data.conclusa) {
+                        mostraConclusa(data.vincitore);
+                        return;
+                    }
+                    if (!data.nuovo_prezzo || !data.acquirente || data.seq <= ultimoSeq) return;
 
-                    document.querySelector('#prezzo-attuale').innerHTML = `Prezzo attuale: € ${data.nuovo_prezzo}`;
-                    document.querySelector('#acquirente-attuale').innerHTML = `<small>Offerta fatta da: ${data.acquirente}</small>`;
+                    // Se mancano offerte tra l'ultima mostrata e questa (e il server non le ha
+                    // riassunte in questo messaggio, vedi `seq_da`), chiediamo lo stato completo.
+                    if ((data.seq_da || data.seq) > ultimoSeq + 1) {
+                        astaSocket.send(JSON.stringify({ azione: 'sincronizza' }));
+                    }
+                    ultimoSeq = data.seq;
+                    mostraPrezzo(data);
                 } catch (err) {
                     console.warn("Errore parsing messaggio:", err);
                 }
             };
 
-            // Evento: Connessione Chiusa
+            // Evento: Connessione Chiusa. Ci riconnettiamo con attesa crescente (max 30s):
+            // alla riconnessione il server invia l'istantanea e la pagina si riallinea da sola.
             astaSocket.onclose = function(e) {
                 console.error(`[WS] Socket dell'asta ${astaId} chiuso inaspettatamente. Codice: ${e.code}`);
+                const attesa = Math.min(30000, 1000 * 2 ** tentativiRiconnessione++);
+                setTimeout(connettiAsta, attesa);
             };
 
             // Evento: Errore di Connessione
@@ -181,6 +388,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 console.error("[WS] Errore WebSocket:", error);
             };
         }
+
+        if (astaId) {
+            connettiAsta();
+        }
     }
 
 
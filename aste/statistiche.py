@@ -0,0 +1,97 @@
+from django.core.cache import cache
+from django.db.models import Count, Max, Min
+
+from .models import Asta
+
+# Valore usato per il cursore dei prezzi quando non ci sono aste.
+PREZZO_MAX_DEFAULT = 1000
+
+CHIAVE_PREZZO_MAX = 'statistiche:prezzo_max'
+CHIAVE_VERSIONE_CATEGORIE = 'statistiche:categorie:versione'
+
+
+def _chiave_categorie():
+    # Come per le raccomandazioni, invalidare significa cambiare versione:
+    # un aggiornamento incrementale calcolato su dati vecchi scrive su una chiave
+    # che nessuno leggerà più, invece di sovrascrivere dati appena ricalcolati.
+    versione = cache.get(CHIAVE_VERSIONE_CATEGORIE)
+    if versione is None:
+        cache.add(CHIAVE_VERSIONE_CATEGORIE, 1, None)
+        versione = cache.get(CHIAVE_VERSIONE_CATEGORIE, 1)
+    return f'statistiche:categorie:{versione}'
+
+
+def prezzo_max():
+    """
+    Prezzo attuale più alto tra tutte le aste, usato per dimensionare il cursore
+    dei prezzi nella ricerca. Calcolato una volta e poi solo aggiornato.
+    """
+    valore = cache.get(CHIAVE_PREZZO_MAX)
+    if valore is None:
+        valore = Asta.objects.aggregate(massimo=Max('prezzo_attuale'))['massimo'] or PREZZO_MAX_DEFAULT
+        cache.set(CHIAVE_PREZZO_MAX, valore, None)
+    return valore
+
+
+def statistiche_categorie():
+    """
+    Per ogni categoria: numero di aste attive e fascia di prezzo attuale,
+    nel formato {categoria_id: {'conteggio': n, 'prezzo_min': x, 'prezzo_max': y}}.
+    """
+    chiave = _chiave_categorie()
+    valore = cache.get(chiave)
+    if valore is None:
+        righe = Asta.objects.filter(stato='attiva').values('categoria_id').annotate(
+            conteggio=Count('pk'), prezzo_min=Min('prezzo_attuale'), prezzo_max=Max('prezzo_attuale')
+        ).order_by()
+        valore = {
+            riga['categoria_id']: {
+                'conteggio': riga['conteggio'],
+                'prezzo_min': riga['prezzo_min'],
+                'prezzo_max': riga['prezzo_max'],
+            }
+            for riga in righe
+        }
+        cache.set(chiave, valore, None)
+    return valore
+
+
+def registra_prezzo(asta):
+    """
+    Aggiornamento incrementale dopo un'offerta (o la creazione di un'asta):
+    alza il massimo globale e quello della categoria se il nuovo prezzo li supera.
+    """
+    massimo = cache.get(CHIAVE_PREZZO_MAX)
+    if massimo is not None and asta.prezzo_attuale > massimo:
+        cache.set(CHIAVE_PREZZO_MAX, asta.prezzo_attuale, None)
+
+    chiave = _chiave_categorie()
+    categorie = cache.get(chiave)
+    if categorie is None:
+        return
+    dati = categorie.get(asta.categoria_id)
+    if dati and asta.prezzo_attuale > dati['prezzo_max']:
+        dati['prezzo_max'] = asta.prezzo_attuale
+        cache.set(chiave, categorie, None)
+
+
+def registra_nuova_asta(asta):
+    # Il massimo globale si aggiorna in modo incrementale; i conteggi per categoria
+    # invece si ricalcolano, perché un +1 applicato a una cache già ricalcolata
+    # dopo il commit conterebbe l'asta due volte.
+    registra_prezzo(asta)
+    invalida_statistiche()
+
+
+def invalida_statistiche(prezzo=False):
+    """
+    Da chiamare quando le aste attive cambiano in un modo che non si può
+    aggiornare in modo incrementale (chiusure, cancellazioni, modifiche):
+    le statistiche verranno ricalcolate alla prossima richiesta.
+    """
+    try:
+        cache.incr(CHIAVE_VERSIONE_CATEGORIE)
+    except ValueError:
+        cache.set(CHIAVE_VERSIONE_CATEGORIE, 1, None)
+    if prezzo:
+        cache.delete(CHIAVE_PREZZO_MAX)
@@ -0,0 +1,75 @@
+import hashlib
+import posixpath
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+# Cartella delle versioni ridotte delle immagini (vedi aste/immagini.py): i loro nomi
+# sono già calcolati dall'impronta dell'originale e vengono salvati così come sono.
+CARTELLA_DERIVATI = 'aste_images/derivati'
+
+# Nomi generati da `ArchivioContenutiStorage` (e dai derivati):
+# un'impronta esadecimale, eventualmente seguita dalla larghezza, e l'estensione.
+NOME_PER_CONTENUTO = re.compile(r'(^|/)([0-9a-f]{16,64})(_\d+)?\.[a-z0-9]+$')
+
+
+def nome_per_contenuto(nome):
+    return bool(NOME_PER_CONTENUTO.search(nome))
+
+
+def impronta_breve(nome):
+    # Le prime 16 cifre dell'impronta: le stesse nell'originale (32 cifre) e nei
+    # suoi derivati (vedi aste/immagini.py). None per i nomi scelti dall'utente.
+    corrispondenza = NOME_PER_CONTENUTO.search(nome)
+    return corrispondenza.group(2)[:16] if corrispondenza else None
+
+
+@deconstructible
+class ArchivioContenutiStorage(FileSystemStorage):
+    """
+    Storage su filesystem in cui il nome del file è l'impronta SHA-256 del suo
+    contenuto (nella cartella di `upload_to`, con l'estensione originale).
+
+    Lo stesso file caricato più volte (aste rimesse in vendita, fixture dei test)
+    occupa spazio una volta sola: il secondo salvataggio trova il file già presente
+    e restituisce lo stesso nome. Più aste possono quindi condividere un file,
+    che va cancellato solo quando non è più usato da nessuna (vedi
+    `aste.immagini.rilascia_immagine`). `_save` blocca la riga dell'impronta
+    (`ContenutoImmagine`) fino al commit: chi salva un file deve farlo nella
+    stessa transazione in cui registra il nome nell'asta, così un rilascio
+    concorrente vede l'asta o arriva prima del salvataggio. Poiché l'URL cambia quando cambia il
+    contenuto, i file possono essere serviti con cache senza scadenza.
+    """
+
+    def __init__(self, **kwargs):
+        # Due salvataggi concorrenti dello stesso contenuto scrivono gli stessi byte:
+        # sovrascrivere è innocuo (senza, FileSystemStorage cercherebbe un nome libero).
+        # `allow_overwrite` esiste da Django 5.1: vedi la versione fissata nel Pipfile.
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def _save(self, name, content):
+        # Il nome scelto dall'utente non conta mai (potrebbe imitare un'impronta):
+        # solo i derivati, generati da noi, mantengono il loro nome.
+        if posixpath.dirname(name) != CARTELLA_DERIVATI:
+            impronta = hashlib.sha256()
+            for blocco in content.chunks():
+                impronta.update(blocco)
+            cartella, nome_file = posixpath.split(name)
+            estensione = posixpath.splitext(nome_file)[1].lower()
+            name = posixpath.join(cartella, impronta.hexdigest()[:32] + estensione)
+        from .models import ContenutoImmagine
+
+        # Il controllo e la scrittura avvengono sotto il lock dell'impronta, che resta
+        # fino al commit della transazione esterna (vedi `rilascia_immagine`).
+        with transaction.atomic():
+            ContenutoImmagine.objects.blocca(filter(None, [impronta_breve(name)]))
+            if self.exists(name):
+                return name
+            return super()._save(name, content)
+
+
+archivio_immagini = ArchivioContenutiStorage()
+
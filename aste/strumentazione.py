@@ -0,0 +1,305 @@
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+# Limiti superiori (ms e numero di query) degli intervalli degli istogrammi;
+# l'ultimo intervallo raccoglie tutto quello che li supera.
+INTERVALLI_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+INTERVALLI_QUERY = (1, 2, 5, 10, 20, 50, 100)
+
+# Misure della richiesta in corso, lette dai wrapper delle query e dei template.
+_misure_correnti = ContextVar('misure_strumentazione', default=None)
+
+# Liste di parametri di lunghezza variabile, es. `IN (%s, %s, %s)`.
+_LISTA_PARAMETRI = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+def strumentazione_attiva():
+    return getattr(settings, 'ASTE_STRUMENTAZIONE', False)
+
+
+def soglia_query_ripetute():
+    return getattr(settings, 'ASTE_SOGLIA_QUERY_RIPETUTE', 5)
+
+
+def firma_query(sql):
+    # La stessa query con parametri diversi ha lo stesso testo (i valori sono `%s`):
+    # uniamo anche le liste di parametri, così `pk IN (...)` dà sempre la stessa firma.
+    return _LISTA_PARAMETRI.sub('%s, ...', sql)
+
+
+class MisureRichiesta:
+    """Query, tempo SQL e tempo di rendering di una singola richiesta."""
+
+    def __init__(self):
+        self.query = 0
+        self.sql_ms = 0.0
+        self.render_ms = 0.0
+        self.firme = Counter()
+        self.in_render = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # Wrapper di `connection.execute_wrapper` (vedi `_misura_query`).
+        inizio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_ms += (time.perf_counter() - inizio) * 1000
+            self.query += 1
+            self.firme[firma_query(sql)] += 1
+
+    def query_ripetute(self):
+        # Firme eseguite molte volte nella stessa richiesta: il sintomo tipico
+        # del problema N+1 (una query per ogni elemento di una lista).
+        soglia = soglia_query_ripetute()
+        return {firma: volte for firma, volte in self.firme.items() if volte >= soglia}
+
+
+def _istogramma(intervalli):
+    return [0] * (len(intervalli) + 1)
+
+
+class StatisticheVista:
+
+    def __init__(self):
+        self.richieste = 0
+        self.totale_ms = 0.0
+        self.sql_ms = 0.0
+        self.render_ms = 0.0
+        self.query = 0
+        self.max_ms = 0.0
+        self.max_query = 0
+        self.latenze = _istogramma(INTERVALLI_MS)
+        self.conteggi_query = _istogramma(INTERVALLI_QUERY)
+        self.ripetute = Counter()
+
+    def registra(self, totale_ms, misure, ripetute):
+        self.richieste += 1
+        self.totale_ms += totale_ms
+        self.sql_ms += misure.sql_ms
+        self.render_ms += misure.render_ms
+        self.query += misure.query
+        self.max_ms = max(self.max_ms, totale_ms)
+        self.max_query = max(self.max_query, misure.query)
+        self.latenze[bisect_left(INTERVALLI_MS, totale_ms)] += 1
+        self.conteggi_query[bisect_left(INTERVALLI_QUERY, misure.query)] += 1
+        # Per ogni firma teniamo il massimo di esecuzioni in una richiesta.
+        for firma, volte in ripetute.items():
+            self.ripetute[firma] = max(self.ripetute[firma], volte)
+
+    def percentile(self, quota):
+        # Dall'istogramma si ricava solo il limite superiore dell'intervallo
+        # che contiene il percentile: abbastanza per accorgersi di un peggioramento.
+        obiettivo, visti = quota * self.richieste, 0
+        for limite, quante in zip(INTERVALLI_MS, self.latenze):
+            visti += quante
+            if visti >= obiettivo:
+                return limite
+        return None
+
+    def riepilogo(self, vista):
+        return {
+            'vista': vista,
+            'richieste': self.richieste,
+            'media_ms': round(self.totale_ms / self.richieste, 2),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max_ms, 2),
+            'media_query': round(self.query / self.richieste, 1),
+            'max_query': self.max_query,
+            'media_sql_ms': round(self.sql_ms / self.richieste, 2),
+            'media_render_ms': round(self.render_ms / self.richieste, 2),
+            'latenze': dict(zip([*map(str, INTERVALLI_MS), 'oltre'], self.latenze)),
+            'query': dict(zip([*map(str, INTERVALLI_QUERY), 'oltre'], self.conteggi_query)),
+            'query_ripetute': dict(self.ripetute.most_common()),
+        }
+
+
+class RegistroStrumentazione:
+    """
+    Statistiche aggregate per vista, in memoria nel processo corrente
+    (ogni worker ha le sue). Si leggono dalla pagina di amministrazione
+    `admin/strumentazione/`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._viste = {}
+
+    def registra(self, vista, totale_ms, misure):
+        ripetute = misure.query_ripetute()
+        with self._lock:
+            statistiche = self._viste.get(vista)
+            if statistiche is None:
+                statistiche = self._viste[vista] = StatisticheVista()
+            nuove = [firma for firma in ripetute if firma not in statistiche.ripetute]
+            statistiche.registra(totale_ms, misure, ripetute)
+        # Segnaliamo ogni query ripetuta solo la prima volta che compare in una vista.
+        for firma in nuove:
+            logger.warning("Query ripetuta %d volte in %s: %s", ripetute[firma], vista, firma)
+
+    def riepilogo(self):
+        with self._lock:
+            righe = [statistiche.riepilogo(vista) for vista, statistiche in self._viste.items()]
+        return sorted(righe, key=lambda riga: riga['media_ms'] * riga['richieste'], reverse=True)
+
+    def azzera(self):
+        with self._lock:
+            self._viste.clear()
+
+
+registro = RegistroStrumentazione()
+
+
+def _misura_query(execute, sql, params, many, context):
+    # Installato una volta su ogni connessione: misura la query per la richiesta
+    # del contesto corrente, anche quando gira nel thread di `sync_to_async`
+    # (le viste async), dove la connessione non è quella del middleware.
+    misure = _misure_correnti.get()
+    if misure is None:
+        return execute(sql, params, many, context)
+    return misure(execute, sql, params, many, context)
+
+
+def _installa_wrapper(connection, **kwargs):
+    # Ricevitore di `connection_created`: la stessa connessione può riaprirsi più volte.
+    if _misura_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_misura_query)
+
+
+def _installa_sulle_connessioni_aperte():
+    # Le connessioni sono per thread: quelle già aperte non inviano `connection_created`.
+    for connection in connections.all(initialized_only=True):
+        _installa_wrapper(connection)
+
+
+# `Template.render` è sostituito solo finché c'è almeno una richiesta misurata in corso.
+_lock_render = threading.Lock()
+_richieste_in_corso = 0
+_render_originale = Template.render
+
+
+def _render_misurato(self, context):
+    # Misura solo il template più esterno: `{% include %}` chiama di nuovo `render`.
+    misure = _misure_correnti.get()
+    if misure is None or misure.in_render:
+        return _render_originale(self, context)
+    misure.in_render = True
+    inizio = time.perf_counter()
+    try:
+        return _render_originale(self, context)
+    finally:
+        misure.render_ms += (time.perf_counter() - inizio) * 1000
+        misure.in_render = False
+
+
+@contextmanager
+def _render_misurati():
+    global _richieste_in_corso, _render_originale
+    with _lock_render:
+        if not _richieste_in_corso:
+            _render_originale = Template.render
+            Template.render = _render_misurato
+        _richieste_in_corso += 1
+    try:
+        yield
+    finally:
+        with _lock_render:
+            _richieste_in_corso -= 1
+            if not _richieste_in_corso:
+                Template.render = _render_originale
+
+
+class StrumentazioneMiddleware:
+    """
+    Misura per ogni richiesta il numero di query, il tempo passato nel database,
+    il tempo di rendering dei template e le query ripetute (N+1). I valori sono
+    inviati nell'intestazione `Server-Timing` (visibile negli strumenti per
+    sviluppatori del browser) e sommati per vista in `registro`.
+
+    È attivo solo con `ASTE_STRUMENTAZIONE = True`: altrimenti solleva
+    MiddlewareNotUsed e Django lo toglie dalla catena, senza alcun costo.
+    Il tempo di rendering comprende le query eseguite dal template
+    (es. querysets "pigri" valutati solo nel ciclo `{% for %}`).
+
+    Sono contate le query eseguite nel contesto della richiesta, anche da
+    `sync_to_async` nelle viste async (es. `fai_offerta`). Non lo sono quelle
+    di thread avviati a parte (derivati delle immagini) né il lavoro che
+    continua dopo la risposta (annunci in background).
+
+    Supporta sia le richieste sincrone sia quelle async: essendo il primo
+    della catena, non obbliga Django a convertire le viste async.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not strumentazione_attiva():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        connection_created.connect(_installa_wrapper, dispatch_uid='aste_strumentazione')
+        _installa_sulle_connessioni_aperte()
+        self.connessioni_pronte = False
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        misure = MisureRichiesta()
+        token = _misure_correnti.set(misure)
+        inizio = time.perf_counter()
+        try:
+            with _render_misurati():
+                response = self.get_response(request)
+        finally:
+            _misure_correnti.reset(token)
+        return self.concludi(request, response, misure, inizio)
+
+    async def __acall__(self, request):
+        if not self.connessioni_pronte:
+            # Le query delle viste async girano nel thread di `sync_to_async`,
+            # che può avere connessioni aperte prima del caricamento del middleware.
+            await sync_to_async(_installa_sulle_connessioni_aperte)()
+            self.connessioni_pronte = True
+        misure = MisureRichiesta()
+        token = _misure_correnti.set(misure)
+        inizio = time.perf_counter()
+        try:
+            with _render_misurati():
+                response = await self.get_response(request)
+        finally:
+            _misure_correnti.reset(token)
+        return self.concludi(request, response, misure, inizio)
+
+    def concludi(self, request, response, misure, inizio):
+        totale_ms = (time.perf_counter() - inizio) * 1000
+        ripetute = misure.query_ripetute()
+        metriche = [
+            f'sql;dur={misure.sql_ms:.1f};desc="{misure.query} query"',
+            f'render;dur={misure.render_ms:.1f}',
+            f'totale;dur={totale_ms:.1f}',
+        ]
+        if ripetute:
+            # Solo il numero: il testo delle query non va mostrato ai client.
+            metriche.append(f'ripetute;desc="{len(ripetute)} query ripetute"')
+        response['Server-Timing'] = ', '.join(metriche)
+
+        match = request.resolver_match
+        registro.registra(match.view_name if match else 'non risolta', totale_ms, misure)
+        return response
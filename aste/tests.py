@@ -1,15 +1,51 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, TransactionTestCase
 
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.urls import reverse
 from datetime import timedelta
+from decimal import Decimal
+import asyncio
+from io import BytesIO, StringIO
+import importlib.util
+import json
+import threading
+import time
+import os
+import re
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
+from django.db.models import Count, Max, Min, Q, QuerySet, Sum
+from django.test.utils import CaptureQueriesContext, override_settings
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
 
 # Ci serve per creare un file finto in memoria
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from django.template.base import Template
 
 # Importiamo i modelli necessari per creare dati di test
-from .models import Asta, Categoria, Profile
+from .chiusura import SchedulerChiusure, chiudi_aste_scadute
+from .immagini import rilascia_immagine
+from .storage import ArchivioContenutiStorage, impronta_breve
+from .models import Asta, Categoria, ContenutoImmagine, Feedback, Notifica, Offerta, Profile, ReputazioneVenditore
+from .consumers import AstaConsumer, AsteConsumer, NotificheConsumer
+from .views import ModificaAstaView, servi_media
+from .offerte import piazza_offerta
+from .paginazione import DIMENSIONE_PAGINA
+from .raccomandazioni import raccomandazioni_per_categoria
+from .statistiche import prezzo_max, statistiche_categorie
+from .strumentazione import MisureRichiesta, StrumentazioneMiddleware, registro
 
 # --- Test per la Logica dei Modelli ---
 
@@ -69,8 +105,1574 @@ class AstaModelTests(TestCase):
         self.assertEqual(asta_attiva.stato, 'attiva')
 
 
+class PrezzoDenormalizzatoTests(TestCase):
+
+    def setUp(self):
+        self.venditore = User.objects.create_user(username='venditore_prezzi', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.acquirente = User.objects.create_user(username='acquirente_prezzi', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        self.categoria = Categoria.objects.create(nome='Musica')
+        self.asta = Asta.objects.create(
+            venditore=self.venditore,
+            titolo="Chitarra",
+            descrizione="Chitarra acustica",
+            prezzo_base=Decimal('100.00'),
+            rilancio_minimo=Decimal('5.00'),
+            categoria=self.categoria,
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+
+    def test_prezzo_iniziale_uguale_al_prezzo_base(self):
+        self.assertEqual(self.asta.prezzo_attuale, Decimal('100.00'))
+        self.assertEqual(self.asta.numero_offerte, 0)
+        self.assertIsNone(self.asta.miglior_offerente)
+
+    def test_registra_offerta_aggiorna_i_campi(self):
+        """
+        Verifica che prezzo attuale, miglior offerente e numero di offerte
+        vengano aggiornati insieme alla creazione dell'offerta.
+        """
+        self.asta.registra_offerta(self.acquirente, Decimal('110.00'))
+
+        asta = Asta.objects.get(pk=self.asta.pk)
+        self.assertEqual(asta.prezzo_attuale, Decimal('110.00'))
+        self.assertEqual(asta.miglior_offerente, self.acquirente)
+        self.assertEqual(asta.numero_offerte, 1)
+
+    def test_salvataggio_di_istanza_vecchia_non_annulla_le_offerte(self):
+        # Istanza caricata prima dell'offerta (es. form di modifica o admin aperti).
+        vecchia = Asta.objects.get(pk=self.asta.pk)
+        self.asta.registra_offerta(self.acquirente, Decimal('110.00'))
+
+        vecchia.titolo = "Chitarra classica"
+        vecchia.save()
+        asta = Asta.objects.get(pk=self.asta.pk)
+        self.assertEqual(asta.titolo, "Chitarra classica")
+        self.assertEqual(asta.prezzo_attuale, Decimal('110.00'))
+        self.assertEqual(asta.miglior_offerente, self.acquirente)
+        self.assertEqual(asta.numero_offerte, 1)
+
+    def test_modifica_rifiutata_se_arriva_un_offerta_prima_del_salvataggio(self):
+        self.client.login(username='venditore_prezzi', password='password123')
+        # Il form richiede un'immagine: basta il nome di quella già salvata.
+        Asta.objects.filter(pk=self.asta.pk).update(immagine='aste_images/chitarra.jpg')
+        self.asta.registra_offerta(self.acquirente, Decimal('110.00'))
+        # Simuliamo l'offerta arrivata dopo il controllo iniziale dei permessi.
+        with mock.patch.object(ModificaAstaView, 'test_func', return_value=True):
+            response = self.client.post(reverse('aste:modifica_asta', args=[self.asta.pk]), {
+                'titolo': "Modificata", 'descrizione': "x", 'categoria': self.categoria.pk,
+                'prezzo_base': '1.00', 'rilancio_minimo': '1.00',
+                'data_fine': (timezone.now() + timedelta(days=2)).strftime('%Y-%m-%dT%H:%M'),
+            })
+        self.assertRedirects(response, reverse('aste:home'))
+        asta = Asta.objects.get(pk=self.asta.pk)
+        self.assertEqual((asta.titolo, asta.prezzo_base), ("Chitarra", Decimal('100.00')))
+
+    def test_comando_ricalcola_corregge_le_incoerenze(self):
+        """
+        Verifica che il comando di verifica segnali un'incoerenza e che il ricalcolo la corregga.
+        """
+        # Creiamo un'offerta "a mano", senza passare da registra_offerta.
+        Offerta.objects.create(asta=self.asta, acquirente=self.acquirente, importo=Decimal('120.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('ricalcola_prezzi_aste', '--solo-verifica', stdout=StringIO())
+
+        call_command('ricalcola_prezzi_aste', stdout=StringIO())
+        asta = Asta.objects.get(pk=self.asta.pk)
+        self.assertEqual(asta.prezzo_attuale, Decimal('120.00'))
+        self.assertEqual(asta.miglior_offerente, self.acquirente)
+        self.assertEqual(asta.numero_offerte, 1)
+        call_command('ricalcola_prezzi_aste', '--solo-verifica', stdout=StringIO())
+
+
+class PiazzaOffertaTests(TestCase):
+
+    def setUp(self):
+        self.venditore = User.objects.create_user(username='venditore_offerte', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.mario = User.objects.create_user(username='mario', password='password123')
+        Profile.objects.create(user=self.mario, ruolo='acquirente')
+        self.luigi = User.objects.create_user(username='luigi', password='password123')
+        Profile.objects.create(user=self.luigi, ruolo='acquirente')
+        self.categoria = Categoria.objects.create(nome='Arte')
+        self.asta = Asta.objects.create(
+            venditore=self.venditore,
+            titolo="Quadro",
+            descrizione="Olio su tela",
+            prezzo_base=Decimal('50.00'),
+            rilancio_minimo=Decimal('5.00'),
+            categoria=self.categoria,
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+
+    def test_offerta_valida_accettata(self):
+        esito = piazza_offerta(self.asta.pk, self.mario, '55')
+        self.assertTrue(esito.accettata)
+        self.assertEqual(esito.offerta.importo, Decimal('55.00'))
+
+    def test_offerta_superata_non_solleva_eccezioni(self):
+        """
+        Due offerenti rilanciano sullo stesso prezzo: il secondo riceve un esito
+        "superata" invece di un IntegrityError.
+        """
+        self.assertTrue(piazza_offerta(self.asta.pk, self.mario, '60').accettata)
+        esito = piazza_offerta(self.asta.pk, self.luigi, '60')
+        self.assertFalse(esito.accettata)
+        self.assertTrue(esito.superata)
+        self.assertEqual(esito.status, 409)
+        self.assertEqual(Offerta.objects.filter(asta=self.asta).count(), 1)
+
+    def test_importi_non_validi_rifiutati_senza_eccezioni(self):
+        for importo in ('NaN', 'sNaN', 'Infinity', '-Infinity', '-5', '0', 'abc', None):
+            esito = piazza_offerta(self.asta.pk, self.mario, importo)
+            self.assertFalse(esito.accettata, importo)
+            self.assertEqual(esito.status, 400)
+        self.assertFalse(Offerta.objects.filter(asta=self.asta).exists())
+
+    def test_offerta_rifiutata_dopo_la_scadenza(self):
+        Asta.objects.filter(pk=self.asta.pk).update(data_fine=timezone.now() - timedelta(minutes=1))
+        esito = piazza_offerta(self.asta.pk, self.mario, '100')
+        self.assertFalse(esito.accettata)
+        self.assertEqual(esito.status, 400)
+
+    def test_vista_restituisce_json_per_offerta_superata(self):
+        piazza_offerta(self.asta.pk, self.mario, '60')
+        self.client.login(username='luigi', password='password123')
+        response = self.client.post(
+            reverse('aste:fai_offerta', args=[self.asta.pk]),
+            data={'importo': '60'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(response.json()['superata'])
+
+    def test_vista_rifiuta_corpo_json_non_oggetto(self):
+        self.client.login(username='luigi', password='password123')
+        for corpo in ('[1]', '"x"', 'null', 'non json'):
+            response = self.client.post(
+                reverse('aste:fai_offerta', args=[self.asta.pk]), data=corpo, content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.json()['success'])
+
+    async def test_vista_asincrona_accetta_offerta(self):
+        await self.async_client.aforce_login(self.mario)
+        response = await self.async_client.post(
+            reverse('aste:fai_offerta', args=[self.asta.pk]),
+            data={'importo': '70'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['nuovo_prezzo'], '70.00')
+        asta = await Asta.objects.aget(pk=self.asta.pk)
+        self.assertEqual(asta.prezzo_attuale, Decimal('70.00'))
+
+    def test_offerta_insufficiente_rifiutata_senza_lock(self):
+        # Il controllo preliminare rifiuta l'offerta senza aprire la transazione con il lock.
+        piazza_offerta(self.asta.pk, self.mario, '60')
+        with CaptureQueriesContext(connection) as contesto:
+            esito = piazza_offerta(self.asta.pk, self.luigi, '61')
+        self.assertEqual(esito.status, 409)
+        self.assertFalse(any('FOR UPDATE' in q['sql'] or 'SAVEPOINT' in q['sql'] for q in contesto.captured_queries))
+
+
+class ChiusuraAsteTests(TestCase):
+
+    def setUp(self):
+        self.venditore = User.objects.create_user(username='venditore_chiusure', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.acquirente = User.objects.create_user(username='acquirente_chiusure', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        self.categoria = Categoria.objects.create(nome='Sport')
+
+    def crea_asta(self, titolo, data_fine):
+        return Asta.objects.create(
+            venditore=self.venditore,
+            titolo=titolo,
+            descrizione="Test chiusure",
+            immagine='aste_images/test_chiusure.jpg',
+            prezzo_base=Decimal('10.00'),
+            rilancio_minimo=Decimal('1.00'),
+            categoria=self.categoria,
+            data_fine=data_fine
+        )
+
+    def test_chiusura_in_blocco_con_notifiche(self):
+        """
+        Verifica che tutte le aste scadute vengano chiuse insieme, con le notifiche
+        per vincitore e venditore, e che quelle ancora attive non vengano toccate.
+        """
+        con_offerte = self.crea_asta("Con offerte", timezone.now() + timedelta(minutes=1))
+        con_offerte.registra_offerta(self.acquirente, Decimal('15.00'))
+        Asta.objects.filter(pk=con_offerte.pk).update(data_fine=timezone.now() - timedelta(seconds=1))
+        senza_offerte = self.crea_asta("Senza offerte", timezone.now() - timedelta(hours=1))
+        attiva = self.crea_asta("Attiva", timezone.now() + timedelta(days=1))
+
+        chiuse = chiudi_aste_scadute()
+
+        self.assertEqual({asta.pk for asta in chiuse}, {con_offerte.pk, senza_offerte.pk})
+        self.assertEqual(Asta.objects.get(pk=attiva.pk).stato, 'attiva')
+        self.assertEqual(Notifica.objects.filter(utente_destinatario=self.acquirente).count(), 1)
+        self.assertEqual(Notifica.objects.filter(utente_destinatario=self.venditore).count(), 2)
+
+        # Una seconda esecuzione non trova nulla da chiudere né duplica le notifiche.
+        self.assertEqual(chiudi_aste_scadute(), [])
+        self.assertEqual(Notifica.objects.count(), 3)
+
+    def test_scheduler_estrae_le_aste_in_ordine_di_scadenza(self):
+        adesso = timezone.now()
+        prima = self.crea_asta("Prima", adesso + timedelta(seconds=5))
+        seconda = self.crea_asta("Seconda", adesso + timedelta(seconds=10))
+        self.crea_asta("Lontana", adesso + timedelta(days=1))
+
+        scheduler = SchedulerChiusure(intervallo=30)
+        scheduler.aggiorna(adesso)
+
+        # L'asta lontana non entra nell'heap; la prima scadenza determina l'attesa.
+        self.assertEqual(len(scheduler.heap), 2)
+        self.assertAlmostEqual(scheduler.secondi_di_attesa(adesso), 5, places=3)
+        self.assertEqual(scheduler.estrai_scadute(adesso + timedelta(seconds=6)), [prima.pk])
+        self.assertEqual(scheduler.estrai_scadute(adesso + timedelta(seconds=11)), [seconda.pk])
+
+    def test_aste_vinte_numero_di_query_costante(self):
+        """
+        Il numero di query di `get_aste_vinte` non deve crescere con il numero di aste concluse.
+        """
+        def crea_aste_vinte(quante):
+            for i in range(quante):
+                asta = self.crea_asta(f"Vinta {i}", timezone.now() + timedelta(minutes=1))
+                asta.registra_offerta(self.acquirente, Decimal('20.00'))
+            Asta.objects.update(data_fine=timezone.now() - timedelta(seconds=1))
+            chiudi_aste_scadute()
+
+        crea_aste_vinte(2)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(Asta.objects.get_aste_vinte(self.acquirente)), 2)
+
+        crea_aste_vinte(10)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(Asta.objects.get_aste_vinte(self.acquirente)), 12)
+
+    def test_dettaglio_non_chiude_l_asta(self):
+        """
+        La pagina di dettaglio non esegue più la chiusura durante la GET.
+        """
+        scaduta = self.crea_asta("Scaduta", timezone.now() - timedelta(minutes=1))
+        self.client.get(reverse('aste:dettaglio_asta', args=[scaduta.pk]))
+        self.assertEqual(Asta.objects.get(pk=scaduta.pk).stato, 'attiva')
+        self.assertFalse(Notifica.objects.exists())
+
+
+class NotificheNonLetteTests(TestCase):
+    """
+    Il badge delle notifiche usa il contatore sul profilo invece di un COUNT a ogni pagina.
+    """
+
+    def setUp(self):
+        self.venditore = User.objects.create_user(username='venditore_badge', password='password123')
+        self.profilo_venditore = Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.categoria = Categoria.objects.create(nome='Badge')
+        self.client.login(username='venditore_badge', password='password123')
+
+    def crea_asta_scaduta(self):
+        return Asta.objects.create(
+            venditore=self.venditore,
+            titolo="Scaduta",
+            descrizione="Test badge",
+            immagine='aste_images/test_badge.jpg',
+            prezzo_base=Decimal('10.00'),
+            rilancio_minimo=Decimal('1.00'),
+            categoria=self.categoria,
+            data_fine=timezone.now() - timedelta(minutes=1)
+        )
+
+    def contatore(self):
+        self.profilo_venditore.refresh_from_db()
+        return self.profilo_venditore.notifiche_non_lette
+
+    def test_contatore_segue_creazione_lettura_e_cancellazione(self):
+        self.crea_asta_scaduta()
+        scaduta = self.crea_asta_scaduta()
+        chiudi_aste_scadute()
+        Notifica.objects.create(utente_destinatario=self.venditore, messaggio="Dall'admin")
+        self.assertEqual(self.contatore(), 3)
+
+        # Cancellando l'asta spariscono a cascata anche le sue notifiche.
+        scaduta.delete()
+        self.assertEqual(self.contatore(), 2)
+
+        with CaptureQueriesContext(connection) as contesto:
+            response = self.client.get(reverse('aste:home'))
+        self.assertContains(response, '<span id="badge-notifiche" class="badge badge-danger">2</span>', html=True)
+        self.assertFalse(any('aste_notifica' in query['sql'] for query in contesto.captured_queries))
+
+        self.client.get(reverse('aste:notifiche'))
+        self.assertEqual(self.contatore(), 0)
+        self.assertFalse(Notifica.objects.filter(utente_destinatario=self.venditore, letta=False).exists())
+
+    def test_notifica_creata_durante_la_lettura_resta_nel_contatore(self):
+        Notifica.objects.create(utente_destinatario=self.venditore, messaggio="Vecchia")
+        aggiorna = QuerySet.update
+
+        def nuova_notifica_dopo_la_lettura(queryset, **campi):
+            risultato = aggiorna(queryset, **campi)
+            if queryset.model is Notifica:
+                # Una notifica arriva tra la lettura e l'aggiornamento del contatore.
+                Notifica.objects.create(utente_destinatario=self.venditore, messaggio="Nuova")
+            return risultato
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=nuova_notifica_dopo_la_lettura):
+            Notifica.objects.segna_tutte_lette(self.venditore)
+        self.assertEqual(self.contatore(), 1)
+        self.assertEqual(Notifica.objects.filter(utente_destinatario=self.venditore, letta=False).count(), 1)
+
+
+class NotificheTempoRealeTests(TestCase):
+
+    def setUp(self):
+        self.venditore = User.objects.create_user(username='venditore_push', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.primo = User.objects.create_user(username='primo_push', password='password123')
+        self.profilo_primo = Profile.objects.create(user=self.primo, ruolo='acquirente')
+        self.secondo = User.objects.create_user(username='secondo_push', password='password123')
+        Profile.objects.create(user=self.secondo, ruolo='acquirente')
+        self.asta = Asta.objects.create(
+            venditore=self.venditore,
+            titolo="Bicicletta",
+            descrizione="Da corsa",
+            immagine='aste_images/test_push.jpg',
+            prezzo_base=Decimal('100.00'),
+            rilancio_minimo=Decimal('5.00'),
+            categoria=Categoria.objects.create(nome='Ciclismo'),
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+
+    def connetti(self, user):
+        communicator = WebsocketCommunicator(NotificheConsumer.as_asgi(), '/ws/notifiche/')
+        communicator.scope['user'] = user
+        return communicator
+
+    def offerte_in_sequenza(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            piazza_offerta(self.asta.pk, self.primo, '110.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            piazza_offerta(self.asta.pk, self.secondo, '120.00')
+
+    def test_offerta_superata_arriva_in_tempo_reale(self):
+        async def scenario():
+            communicator = self.connetti(self.primo)
+            connesso, _ = await communicator.connect()
+            self.assertTrue(connesso)
+            await sync_to_async(self.offerte_in_sequenza)()
+            messaggio = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return messaggio
+
+        messaggio = async_to_sync(scenario)()
+        self.assertIn("superata", messaggio['messaggio'])
+        self.assertEqual(messaggio['non_lette'], 1)
+        self.assertEqual(messaggio['url'], reverse('aste:dettaglio_asta', args=[self.asta.pk]))
+        self.profilo_primo.refresh_from_db()
+        self.assertEqual(self.profilo_primo.notifiche_non_lette, 1)
+
+    def test_utente_anonimo_rifiutato(self):
+        async def scenario():
+            connesso, _ = await self.connetti(AnonymousUser()).connect()
+            return connesso
+
+        self.assertFalse(async_to_sync(scenario)())
+
+
+class OffertaSenzaAttesaNotificheTests(TransactionTestCase):
+    # TransactionTestCase: le callback on_commit partono al commit vero, dentro la
+    # richiesta, come in produzione (con TestCase non partirebbero affatto).
+
+    def setUp(self):
+        venditore = User.objects.create_user(username='venditore_attesa')
+        Profile.objects.create(user=venditore, ruolo='venditore')
+        self.primo = User.objects.create_user(username='primo_attesa')
+        Profile.objects.create(user=self.primo, ruolo='acquirente')
+        self.secondo = User.objects.create_user(username='secondo_attesa')
+        Profile.objects.create(user=self.secondo, ruolo='acquirente')
+        self.asta = Asta.objects.create(
+            venditore=venditore, titolo="Lampada", descrizione="Design",
+            immagine='aste_images/test_attesa.jpg', prezzo_base=Decimal('10.00'),
+            rilancio_minimo=Decimal('1.00'), categoria=Categoria.objects.create(nome='Arredo'),
+            data_fine=timezone.now() + timedelta(days=1),
+        )
+        piazza_offerta(self.asta.pk, self.primo, '11.00')
+
+    def test_con_client_sincrono_prezzo_e_notifica_arrivano(self):
+        # Sotto un handler sincrono il loop di asgiref si chiude con la risposta:
+        # gli invii non possono restare in sospeso su quel loop.
+        channel_layer = get_channel_layer()
+        canale = async_to_sync(channel_layer.new_channel)()
+        for gruppo in (f'asta_{self.asta.pk}', f'notifiche_{self.primo.pk}'):
+            async_to_sync(channel_layer.group_add)(gruppo, canale)
+        self.client.force_login(self.secondo)
+        response = self.client.post(
+            reverse('aste:fai_offerta', args=[self.asta.pk]), {'importo': '12.00'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        async def ricevi():
+            return await asyncio.wait_for(channel_layer.receive(canale), timeout=5)
+        ricevuti = {messaggio['type']: messaggio for messaggio in (async_to_sync(ricevi)(), async_to_sync(ricevi)())}
+        self.assertEqual(ricevuti['offerta_aggiornata']['dati_offerta']['nuovo_prezzo'], '12.00')
+        self.assertIn("superata", ricevuti['notifica_nuova']['dati_notifica']['messaggio'])
+
+    def test_risposta_non_aspetta_la_notifica_al_superato(self):
+        asta, primo = self.asta, self.primo
+        channel_layer = get_channel_layer()
+        group_send = channel_layer.group_send
+
+        async def scenario():
+            sblocca = asyncio.Event()
+
+            async def invio_lento(gruppo, messaggio):
+                # Il channel layer è lento solo per le notifiche.
+                if gruppo.startswith('notifiche_'):
+                    await sblocca.wait()
+                await group_send(gruppo, messaggio)
+
+            communicator = WebsocketCommunicator(NotificheConsumer.as_asgi(), '/ws/notifiche/')
+            communicator.scope['user'] = primo
+            await communicator.connect()
+            # Sotto ASGI, come con Daphne: gli invii partono sul loop della richiesta.
+            await self.async_client.aforce_login(self.secondo)
+            try:
+                with mock.patch.object(channel_layer, 'group_send', invio_lento):
+                    response = await asyncio.wait_for(self.async_client.post(
+                        reverse('aste:fai_offerta', args=[asta.pk]), {'importo': '12.00'},
+                        content_type='application/json',
+                    ), timeout=5)
+                    sblocca.set()
+                    messaggio = await communicator.receive_json_from(timeout=5)
+            finally:
+                sblocca.set()
+                await communicator.disconnect()
+            return response, messaggio
+
+        response, messaggio = async_to_sync(scenario)()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("superata", messaggio['messaggio'])
+        self.assertEqual(messaggio['non_lette'], 1)
+
+
+@skipUnless(
+    importlib.util.find_spec('channels_redis') and importlib.util.find_spec('fakeredis'),
+    "servono channels_redis e fakeredis (dev-packages)"
+)
+class ChannelLayerRedisTests(TestCase):
+    """
+    Con REDIS_URL i gruppi passano da Redis: qui un server fakeredis locale
+    sostituisce Redis, così il test gira anche offline.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from fakeredis import TcpFakeServer
+        cls.server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        host, porta = cls.server.server_address
+        cls.channel_layers = {
+            "default": {
+                "BACKEND": "channels_redis.core.RedisChannelLayer",
+                "CONFIG": {"hosts": [f"redis://{host}:{porta}/0"]},
+            }
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_offerta_arriva_al_consumer_tramite_redis(self):
+        venditore = User.objects.create_user(username='venditore_redis', password='password123')
+        Profile.objects.create(user=venditore, ruolo='venditore')
+        acquirente = User.objects.create_user(username='acquirente_redis', password='password123')
+        Profile.objects.create(user=acquirente, ruolo='acquirente')
+        asta = Asta.objects.create(
+            venditore=venditore,
+            titolo="Giradischi",
+            descrizione="Vintage",
+            immagine='aste_images/test_redis.jpg',
+            prezzo_base=Decimal('50.00'),
+            rilancio_minimo=Decimal('5.00'),
+            categoria=Categoria.objects.create(nome='Musica'),
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+        self.client.login(username='acquirente_redis', password='password123')
+
+        def offerta():
+            # Il prezzo viene inviato dopo il commit (qui simulato dentro la transazione del test).
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(
+                    reverse('aste:fai_offerta', args=[asta.pk]), {'importo': '60.00'}, content_type='application/json'
+                )
+
+        async def scenario():
+            communicator = WebsocketCommunicator(AstaConsumer.as_asgi(), f'/ws/asta/{asta.pk}/')
+            communicator.scope['url_route'] = {'kwargs': {'pk': asta.pk}}
+            await communicator.connect()
+            await communicator.receive_json_from(timeout=5)  # istantanea iniziale
+            response = await sync_to_async(offerta)()
+            messaggio = await communicator.receive_json_from(timeout=5)
+            await communicator.disconnect()
+            return response, messaggio
+
+        with override_settings(CHANNEL_LAYERS=self.channel_layers):
+            response, messaggio = async_to_sync(scenario)()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(messaggio['nuovo_prezzo'], '60.00')
+        self.assertEqual(messaggio['acquirente'], 'acquirente_redis')
+
+
+class AggiornamentiAggregatiTests(TestCase):
+
+    @override_settings(ASTE_FINESTRA_AGGIORNAMENTI_MS=50)
+    def test_raffica_di_offerte_inviata_con_ultimo_prezzo(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(AstaConsumer.as_asgi(), '/ws/asta/7/')
+            communicator.scope['url_route'] = {'kwargs': {'pk': 7}}
+            await communicator.connect()
+            for prezzo in range(11, 21):
+                await communicator.send_input({
+                    'type': 'offerta_aggiornata',
+                    'dati_offerta': {'asta_id': 7, 'nuovo_prezzo': f"{prezzo}.00", 'acquirente': 'x'},
+                })
+            ricevuti = [await communicator.receive_json_from()]
+            while not await communicator.receive_nothing(timeout=0.2):
+                ricevuti.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return ricevuti
+
+        ricevuti = async_to_sync(scenario)()
+        # Al più il primo prezzo (inviato subito) e l'ultimo, mai prezzi intermedi superati.
+        self.assertLessEqual(len(ricevuti), 2)
+        self.assertEqual(ricevuti[-1]['nuovo_prezzo'], '20.00')
+
+    @override_settings(ASTE_FINESTRA_AGGIORNAMENTI_MS=50)
+    def test_aggiornamenti_aggregati_dichiarano_seq_da(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(AstaConsumer.as_asgi(), '/ws/asta/7/')
+            communicator.scope['url_route'] = {'kwargs': {'pk': 7}}
+            await communicator.connect()
+            for seq in range(1, 5):
+                await communicator.send_input({
+                    'type': 'offerta_aggiornata',
+                    'dati_offerta': {'asta_id': 7, 'nuovo_prezzo': f"{10 + seq}.00", 'acquirente': 'x', 'seq': seq},
+                })
+            ricevuti = [await communicator.receive_json_from()]
+            while not await communicator.receive_nothing(timeout=0.2):
+                ricevuti.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return ricevuti
+
+        ricevuti = async_to_sync(scenario)()
+        # Ogni messaggio riassume le offerte da `seq_da` a `seq`: la sequenza non ha buchi
+        # anche se i messaggi intermedi sono stati scartati.
+        self.assertLess(len(ricevuti), 4)
+        self.assertEqual(ricevuti[-1]['seq'], 4)
+        ultimo = 0
+        for messaggio in ricevuti:
+            self.assertEqual(messaggio.get('seq_da', messaggio['seq']), ultimo + 1)
+            ultimo = messaggio['seq']
+
+
+class OfferteWebSocketTests(TestCase):
+
+    def setUp(self):
+        self.venditore = User.objects.create_user(username='venditore_ws', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.acquirente = User.objects.create_user(username='acquirente_ws', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        self.asta = Asta.objects.create(
+            venditore=self.venditore,
+            titolo="Orologio",
+            descrizione="Da polso",
+            immagine='aste_images/test_ws.jpg',
+            prezzo_base=Decimal('50.00'),
+            rilancio_minimo=Decimal('5.00'),
+            categoria=Categoria.objects.create(nome='Orologi'),
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+
+    def invia_offerta(self, user, importo):
+        async def scenario():
+            communicator = WebsocketCommunicator(AstaConsumer.as_asgi(), f'/ws/asta/{self.asta.pk}/')
+            communicator.scope['url_route'] = {'kwargs': {'pk': self.asta.pk}}
+            communicator.scope['user'] = user
+            await communicator.connect()
+            await communicator.receive_json_from()  # istantanea iniziale
+            await communicator.send_json_to({'azione': 'offerta', 'importo': importo, 'id': 1})
+            risposte = [await communicator.receive_json_from()]
+            while not await communicator.receive_nothing(timeout=0.1):
+                risposte.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return risposte
+
+        return async_to_sync(scenario)()
+
+    def test_offerta_accettata_con_ack_e_broadcast(self):
+        ack, broadcast = self.invia_offerta(self.acquirente, '60')
+        self.assertEqual(ack['esito'], 'ack')
+        self.assertEqual(ack['id'], 1)
+        self.assertEqual(ack['nuovo_prezzo'], '60.00')
+        self.assertEqual(ack['seq'], 1)
+        # Lo stesso socket è iscritto al gruppo dell'asta e riceve anche l'aggiornamento.
+        self.assertEqual(broadcast['nuovo_prezzo'], '60.00')
+        self.asta.refresh_from_db()
+        self.assertEqual(self.asta.prezzo_attuale, Decimal('60.00'))
+
+    def test_offerta_insufficiente_rifiutata(self):
+        [rifiuto] = self.invia_offerta(self.acquirente, '51')
+        self.assertEqual(rifiuto['esito'], 'rifiuto')
+        self.assertEqual(rifiuto['id'], 1)
+        self.assertFalse(Offerta.objects.exists())
+
+    def test_importo_nan_rifiutato(self):
+        [rifiuto] = self.invia_offerta(self.acquirente, 'NaN')
+        self.assertEqual(rifiuto['esito'], 'rifiuto')
+        self.assertEqual(rifiuto['status'], 400)
+
+    def test_istantanea_alla_connessione_e_su_richiesta(self):
+        piazza_offerta(self.asta.pk, self.acquirente, '60')
+
+        async def scenario():
+            communicator = WebsocketCommunicator(AstaConsumer.as_asgi(), f'/ws/asta/{self.asta.pk}/')
+            communicator.scope['url_route'] = {'kwargs': {'pk': self.asta.pk}}
+            await communicator.connect()
+            iniziale = await communicator.receive_json_from()
+            await communicator.send_json_to({'azione': 'sincronizza'})
+            richiesta = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return iniziale, richiesta
+
+        iniziale, richiesta = async_to_sync(scenario)()
+        self.assertEqual(iniziale, richiesta)
+        self.assertTrue(iniziale['istantanea'])
+        self.assertEqual(iniziale['nuovo_prezzo'], '60.00')
+        self.assertEqual(iniziale['acquirente'], 'acquirente_ws')
+        self.assertEqual(iniziale['seq'], 1)
+        self.assertEqual(iniziale['stato'], 'attiva')
+        self.assertEqual(iniziale['data_fine'], self.asta.data_fine.isoformat())
+
+    def test_utente_anonimo_rifiutato(self):
+        [rifiuto] = self.invia_offerta(AnonymousUser(), '60')
+        self.assertEqual(rifiuto['status'], 401)
+        self.assertFalse(Offerta.objects.exists())
+
+
+class AsteConsumerTests(TestCase):
+    """
+    Una sola connessione segue più aste, con un limite di iscrizioni per connessione.
+    """
+
+    def test_iscrizioni_multiple_e_limite(self):
+        async def invia_offerta(asta_id, prezzo):
+            await get_channel_layer().group_send(f'asta_{asta_id}', {
+                'type': 'offerta_aggiornata',
+                'dati_offerta': {'asta_id': asta_id, 'nuovo_prezzo': prezzo, 'acquirente': 'x'},
+            })
+
+        async def scenario():
+            communicator = WebsocketCommunicator(AsteConsumer.as_asgi(), '/ws/aste/')
+            await communicator.connect()
+            await communicator.send_json_to({'azione': 'iscrivi', 'aste': [1, 2, 3]})
+            limite = await communicator.receive_json_from()
+
+            await invia_offerta(2, '15.00')
+            aggiornamento = await communicator.receive_json_from()
+
+            await communicator.send_json_to({'azione': 'disiscrivi', 'aste': [2]})
+            await asyncio.sleep(0.05)
+            await invia_offerta(2, '16.00')
+            # L'asta 3 ha superato il limite, quindi non è seguita.
+            await invia_offerta(3, '20.00')
+            silenzio = await communicator.receive_nothing(timeout=0.2)
+            await communicator.disconnect()
+            return limite, aggiornamento, silenzio
+
+        with override_settings(ASTE_MAX_ISCRIZIONI_WS=2):
+            limite, aggiornamento, silenzio = async_to_sync(scenario)()
+        self.assertEqual(limite['limite'], 2)
+        self.assertEqual((aggiornamento['asta_id'], aggiornamento['nuovo_prezzo']), (2, '15.00'))
+        self.assertTrue(silenzio)
+
+
+class DettaglioAstaTests(TestCase):
+    """
+    La pagina di dettaglio carica l'asta con una sola query e, per gli anonimi,
+    viene servita dalla cache finché l'asta non riceve offerte o cambia.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.venditore = User.objects.create_user(username='venditore_dettaglio', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.acquirente = User.objects.create_user(username='acquirente_dettaglio', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.asta = Asta.objects.create(
+                venditore=self.venditore,
+                titolo="Macchina fotografica",
+                descrizione="A pellicola",
+                immagine='aste_images/test_dettaglio.jpg',
+                prezzo_base=Decimal('80.00'),
+                rilancio_minimo=Decimal('5.00'),
+                categoria=Categoria.objects.create(nome='Fotografia'),
+                data_fine=timezone.now() + timedelta(days=1)
+            )
+        self.url = reverse('aste:dettaglio_asta', args=[self.asta.pk])
+
+    def test_anonimi_serviti_dalla_cache(self):
+        self.client.get(self.url)
+        # Resta solo la lettura dell'asta, che serve a costruire la chiave del frammento.
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Macchina fotografica")
+
+    def test_offerta_e_modifica_aggiornano_la_pagina_in_cache(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            piazza_offerta(self.asta.pk, self.acquirente, '90')
+        self.assertContains(self.client.get(self.url), "Prezzo attuale: € 90.00")
+
+        self.asta.refresh_from_db()
+        self.asta.titolo = "Reflex"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.asta.save()
+        self.assertContains(self.client.get(self.url), "Reflex")
+
+    def test_utente_loggato_query_limitate(self):
+        piazza_offerta(self.asta.pk, self.acquirente, '90')
+        self.client.login(username='acquirente_dettaglio', password='password123')
+        # Sessione, utente, asta (con venditore, categoria e miglior offerente),
+        # profilo, lista desideri e feedback.
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Offerta fatta da: acquirente_dettaglio")
+
+
+class ReputazioneVenditoreTests(TestCase):
+
+    def setUp(self):
+        self.acquirente = User.objects.create_user(username='acquirente_rep', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        self.categoria = Categoria.objects.create(nome='Libri')
+        self.bravo = self.crea_venditore('venditore_bravo')
+        self.scarso = self.crea_venditore('venditore_scarso')
+
+    def crea_venditore(self, username):
+        venditore = User.objects.create_user(username=username, password='password123')
+        Profile.objects.create(user=venditore, ruolo='venditore')
+        venditore.asta = Asta.objects.create(
+            venditore=venditore,
+            titolo=f"Libro di {username}",
+            descrizione="Prima edizione",
+            immagine='aste_images/test_rep.jpg',
+            prezzo_base=Decimal('10.00'),
+            rilancio_minimo=Decimal('1.00'),
+            categoria=self.categoria,
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+        return venditore
+
+    def lascia_feedback(self, venditore, *voti):
+        return [
+            Feedback.objects.create(
+                asta=venditore.asta, autore=self.acquirente, destinatario=venditore, voto=voto, commento="Ok"
+            )
+            for voto in voti
+        ]
+
+    def test_riepilogo_aggiornato_a_ogni_feedback(self):
+        feedback = self.lascia_feedback(self.bravo, 5, 4, 4)
+        reputazione = ReputazioneVenditore.objects.get(venditore=self.bravo)
+        self.assertEqual(reputazione.conteggio, 3)
+        self.assertAlmostEqual(reputazione.media, 13 / 3)
+        self.assertEqual(reputazione.istogramma()[:2], [(5, 1, 33), (4, 2, 67)])
+
+        for singolo in feedback:
+            singolo.delete()
+        reputazione.refresh_from_db()
+        self.assertEqual((reputazione.conteggio, reputazione.media, reputazione.voti_4), (0, None, 0))
+
+    def test_voto_modificato_aggiorna_il_riepilogo(self):
+        feedback, _ = self.lascia_feedback(self.bravo, 2, 4)
+        feedback.voto = 5
+        feedback.save()
+        reputazione = ReputazioneVenditore.objects.get(venditore=self.bravo)
+        self.assertEqual((reputazione.conteggio, reputazione.somma_voti), (2, 9))
+        self.assertAlmostEqual(reputazione.media, 4.5)
+        self.assertEqual((reputazione.voti_2, reputazione.voti_4, reputazione.voti_5), (0, 1, 1))
+
+        # Il feedback spostato a un altro venditore lascia il primo riepilogo.
+        feedback.destinatario = self.scarso
+        feedback.save()
+        reputazione.refresh_from_db()
+        self.assertEqual((reputazione.conteggio, reputazione.media, reputazione.voti_5), (1, 4.0, 0))
+        self.assertEqual(ReputazioneVenditore.objects.get(venditore=self.scarso).voti_5, 1)
+
+    def test_ordinamento_per_reputazione(self):
+        self.lascia_feedback(self.scarso, 2)
+        self.lascia_feedback(self.bravo, 5, 4)
+        senza_feedback = self.crea_venditore('venditore_nuovo')
+        response = self.client.get(reverse('aste:ricerca'), {'ordina_per': 'reputazione'})
+        venditori = [asta.venditore_id for asta in response.context['aste_list']]
+        self.assertEqual(venditori, [self.bravo.pk, self.scarso.pk, senza_feedback.pk])
+
+    def test_profilo_venditore_paginato(self):
+        self.lascia_feedback(self.bravo, *[5] * 12)
+        url = reverse('aste:profilo_venditore', args=[self.bravo.pk])
+        # Venditore, riepilogo e una pagina di feedback: nessuna COUNT né media su Feedback.
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['feedback_list']), 10)
+        self.assertContains(response, "(12 feedback)")
+        self.assertEqual(len(self.client.get(url, {'page': 2}).context['feedback_list']), 2)
+
+
+class ImmaginiDerivateTests(TestCase):
+    """
+    Le immagini caricate vengono controllate leggendo solo l'intestazione,
+    ripulite dai metadati EXIF e ridotte in WebP e JPEG con nomi basati
+    sull'impronta del contenuto; le card le servono con `srcset`.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        impostazioni = override_settings(
+            MEDIA_ROOT=self.media, ASTE_DERIVATI_IN_BACKGROUND=False, ASTE_LARGHEZZE_IMMAGINI=(320, 640, 1280)
+        )
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        self.venditore = User.objects.create_user(username='venditore_img', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.categoria = Categoria.objects.create(nome='Moto')
+
+    def foto(self, larghezza=2000, altezza=1500, formato='JPEG', **opzioni):
+        buffer = BytesIO()
+        Image.new('RGB', (larghezza, altezza), (200, 30, 30)).save(buffer, formato, **opzioni)
+        return SimpleUploadedFile(f'moto.{formato.lower()}', buffer.getvalue())
+
+    def carica(self, immagine):
+        self.client.login(username='venditore_img', password='password123')
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('aste:crea_asta'), {
+                'titolo': "Moto", 'descrizione': "Naked", 'immagine': immagine,
+                'categoria': self.categoria.pk, 'prezzo_base': '100', 'rilancio_minimo': '5',
+                'data_fine': (timezone.now() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M'),
+            })
+
+    def errore_immagine(self, immagine):
+        response = self.carica(immagine)
+        self.assertFalse(Asta.objects.exists())
+        return response.context['form'].errors['immagine'][0]
+
+    def test_caricamento_genera_derivati_e_srcset(self):
+        self.carica(self.foto())
+        asta = Asta.objects.get(titolo="Moto")
+        self.assertEqual(sorted(asta.derivati['webp'], key=int), ['320', '640', '1280'])
+        nome = asta.derivati['webp']['320']
+        self.assertRegex(nome, r'^aste_images/derivati/[0-9a-f]{16}_320\.webp$')
+        with Image.open(asta.immagine.storage.path(nome)) as ridotta:
+            self.assertEqual((ridotta.format, ridotta.size), ('WEBP', (320, 240)))
+
+        response = self.client.get(reverse('aste:home'))
+        self.assertContains(response, f'{asta.immagine.storage.url(nome)} 320w')
+        self.assertContains(response, 'type="image/webp"')
+
+    def test_derivati_condivisi_tra_estensioni_diverse(self):
+        # Stesso contenuto, estensioni diverse: due originali ma un solo gruppo di derivati.
+        foto = self.foto(400, 300)
+        self.carica(foto)
+        foto.seek(0)
+        self.carica(SimpleUploadedFile('moto.jpg', foto.read()))
+        prima, seconda = Asta.objects.order_by('pk')
+        self.assertNotEqual(prima.immagine.name, seconda.immagine.name)
+        self.assertEqual(prima.derivati, seconda.derivati)
+        derivati = [nome for varianti in prima.derivati.values() for nome in varianti.values()]
+        storage = prima.immagine.storage
+        self.assertTrue(ContenutoImmagine.objects.filter(pk=impronta_breve(derivati[0])).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('aste:elimina_asta', args=[prima.pk]))
+        self.assertFalse(storage.exists(prima.immagine.name))
+        self.assertTrue(all(storage.exists(nome) for nome in derivati))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('aste:elimina_asta', args=[seconda.pk]))
+        self.assertFalse(any(storage.exists(nome) for nome in derivati))
+
+    def test_controlli_sull_intestazione(self):
+        with override_settings(ASTE_MAX_BYTE_IMMAGINE=1000):
+            self.assertIn("troppo grande", self.errore_immagine(self.foto()))
+        with override_settings(ASTE_MAX_PIXEL_IMMAGINE=100 * 100):
+            self.assertIn("dimensioni eccessive", self.errore_immagine(self.foto(101, 100)))
+        self.assertIn("Formato non supportato", self.errore_immagine(self.foto(10, 10, 'BMP')))
+        self.assertIn("valid image", self.errore_immagine(SimpleUploadedFile('finta.jpg', b'non sono una foto')))
+
+    def test_richiesta_troppo_grande_rifiutata_prima_della_lettura(self):
+        with override_settings(ASTE_MAX_BYTE_IMMAGINE=1000):
+            immagine = SimpleUploadedFile('enorme.jpg', b'0' * (1024 * 1024 + 2000))
+            self.assertEqual(self.carica(immagine).status_code, 400)
+
+    def test_exif_rimosso_in_background(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientamento: ruotata di 90 gradi
+        exif[0x010F] = "Telefono"  # Produttore
+        self.carica(self.foto(40, 20, exif=exif.tobytes()))
+        asta = Asta.objects.get()
+        with asta.immagine.open('rb'), Image.open(asta.immagine) as ripulita:
+            self.assertFalse(ripulita.getexif())
+            self.assertEqual(ripulita.size, (20, 40))
+        self.assertEqual(len(os.listdir(os.path.join(self.media, 'aste_images'))), 2)  # originale ripulito e derivati/
+
+    def test_comando_backfill(self):
+        # Con metadati EXIF: il comando deve seguire l'originale sostituito dalla copia ripulita.
+        exif = Image.Exif()
+        exif[0x010F] = "Telefono"
+        foto = self.foto(500, 400, exif=exif.tobytes())
+        nome = Asta._meta.get_field('immagine').storage.save('aste_images/piccola.jpg', foto)
+        asta = Asta.objects.create(
+            venditore=self.venditore, titolo="Casco", descrizione="Integrale", immagine=nome,
+            categoria=self.categoria, prezzo_base=Decimal('50.00'), rilancio_minimo=Decimal('5.00'),
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+        self.assertContains(self.client.get(reverse('aste:home')), asta.immagine.url)
+
+        call_command('genera_derivati_immagini', stdout=StringIO())
+        asta.refresh_from_db()
+        self.assertNotEqual(asta.immagine.name, nome)
+        # Niente ingrandimenti: un'immagine larga 500px ha 320px e la sua larghezza originale.
+        self.assertEqual(sorted(asta.derivati['jpeg'], key=int), ['320', '500'])
+        self.assertTrue(asta.immagine_anteprima_url.endswith('_320.jpg'))
+
+
+class ArchivioImmaginiTests(TestCase):
+    """
+    Le immagini sono salvate con un nome basato sul contenuto: le copie identiche
+    occupano un solo file, cancellato solo quando nessuna asta lo usa più.
+    """
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        impostazioni = override_settings(MEDIA_ROOT=self.media)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        self.venditore = User.objects.create_user(username='venditore_archivio', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.categoria = Categoria.objects.create(nome='Poster')
+
+    def crea_asta(self, immagine):
+        return Asta.objects.create(
+            venditore=self.venditore, titolo="Poster", descrizione="Film", immagine=immagine,
+            categoria=self.categoria, prezzo_base=Decimal('10.00'), rilancio_minimo=Decimal('1.00'),
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+
+    def file_immagini(self):
+        return sorted(os.listdir(os.path.join(self.media, 'aste_images')))
+
+    def test_copie_identiche_condividono_il_file(self):
+        prima = self.crea_asta(SimpleUploadedFile('poster.gif', b'GIF89a stesso contenuto'))
+        seconda = self.crea_asta(SimpleUploadedFile('poster_copia.GIF', b'GIF89a stesso contenuto'))
+        self.assertEqual(prima.immagine.name, seconda.immagine.name)
+        self.assertRegex(prima.immagine.name, r'^aste_images/[0-9a-f]{32}\.gif$')
+        self.assertEqual(len(self.file_immagini()), 1)
+
+        # Cancellare una delle due aste non tocca il file dell'altra.
+        self.client.login(username='venditore_archivio', password='password123')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('aste:elimina_asta', args=[prima.pk]))
+        self.assertTrue(seconda.immagine.storage.exists(seconda.immagine.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('aste:elimina_asta', args=[seconda.pk]))
+        self.assertEqual(self.file_immagini(), [])
+
+    def test_cache_immutabile_solo_per_nomi_da_contenuto(self):
+        asta = self.crea_asta(SimpleUploadedFile('poster.gif', b'GIF89a'))
+        with open(os.path.join(self.media, 'aste_images', 'vecchia.gif'), 'wb') as file:
+            file.write(b'GIF89a')
+        richiesta = RequestFactory().get('/')
+        response = servi_media(richiesta, asta.immagine.name, document_root=self.media)
+        self.assertIn('immutable', response['Cache-Control'])
+        response = servi_media(richiesta, 'aste_images/vecchia.gif', document_root=self.media)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_comando_archivia_unisce_i_duplicati(self):
+        os.makedirs(os.path.join(self.media, 'aste_images'))
+        for nome in ('test_image.gif', 'test_image_RJNJEI0.gif'):
+            with open(os.path.join(self.media, 'aste_images', nome), 'wb') as file:
+                file.write(b'GIF89a duplicata')
+        aste = [self.crea_asta(nome) for nome in ('aste_images/test_image.gif', 'aste_images/test_image_RJNJEI0.gif')]
+
+        call_command('archivia_immagini', stdout=StringIO())
+        nomi = {asta.immagine.name for asta in Asta.objects.filter(pk__in=[asta.pk for asta in aste])}
+        self.assertEqual(len(nomi), 1)
+        self.assertEqual(self.file_immagini(), [nomi.pop().split('/')[1]])
+
+
+class RilascioImmagineConcorrenteTests(TransactionTestCase):
+    # TransactionTestCase: il rilascio gira in un altro thread, con la sua connessione,
+    # e deve vedere l'asta solo quando è davvero salvata.
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        impostazioni = override_settings(MEDIA_ROOT=self.media)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        self.venditore = User.objects.create_user(username='venditore_rilascio', password='password123')
+        self.categoria = Categoria.objects.create(nome='Poster')
+
+    def test_file_ritrovato_dallo_storage_non_viene_cancellato_prima_del_salvataggio(self):
+        # Il file è già nell'archivio ma nessuna asta lo usa più: il suo rilascio è in
+        # corso mentre un venditore ricarica la stessa immagine.
+        contenuto = b'GIF89a ricaricata'
+        storage = Asta._meta.get_field('immagine').storage
+        nome = storage.save('aste_images/poster.gif', ContentFile(contenuto))
+        save_originale = ArchivioContenutiStorage._save
+        rilasci, completati = [], []
+
+        def rilascia_in_attesa(trovato):
+            # Il database in memoria dei test è condiviso senza attesa sul lock
+            # ("table is locked"): riproviamo come fa `timeout` con il database vero.
+            try:
+                for _ in range(250):
+                    try:
+                        rilascia_immagine(trovato)
+                    except OperationalError:
+                        time.sleep(0.02)
+                    else:
+                        completati.append(trovato)
+                        return
+            finally:
+                connection.close()
+
+        def save_con_rilascio(storage, name, content):
+            trovato = save_originale(storage, name, content)
+            # Tra il salvataggio del file e quello dell'asta parte il rilascio concorrente.
+            rilascio = threading.Thread(target=rilascia_in_attesa, args=[trovato])
+            rilascio.start()
+            rilascio.join(0.5)
+            rilasci.append(rilascio)
+            return trovato
+
+        with mock.patch.object(ArchivioContenutiStorage, '_save', save_con_rilascio):
+            asta = Asta.objects.create(
+                venditore=self.venditore, titolo="Poster", descrizione="Film",
+                immagine=SimpleUploadedFile('poster.gif', contenuto), categoria=self.categoria,
+                prezzo_base=Decimal('10.00'), rilancio_minimo=Decimal('1.00'),
+                data_fine=timezone.now() + timedelta(days=1),
+            )
+        rilasci[0].join(10)
+        self.assertEqual(completati, [nome])
+        self.assertEqual(asta.immagine.name, nome)
+        self.assertTrue(storage.exists(nome))
+
+
+class DatiDiCaricoTests(TestCase):
+    # `genera_dati` e `benchmark_viste` con volumi minimi.
+
+    def genera(self, **opzioni):
+        call_command(
+            'genera_dati', utenti=20, aste=60, offerte=600, notifiche=80, stdout=StringIO(), **opzioni
+        )
+
+    def test_campi_denormalizzati_coerenti_con_le_righe_generate(self):
+        self.genera()
+        self.assertEqual(Asta.objects.count(), 60)
+        aste = Asta.objects.annotate(
+            massimo=Max('offerte__importo'), minimo=Min('offerte__importo'), quante=Count('offerte')
+        )
+        for asta in aste:
+            self.assertEqual(asta.numero_offerte, asta.quante)
+            if asta.quante:
+                self.assertEqual(asta.prezzo_attuale, asta.massimo)
+                # Anche la prima offerta rispetta il rilancio minimo sul prezzo base.
+                self.assertGreaterEqual(asta.minimo, asta.prezzo_base + asta.rilancio_minimo)
+                ultima = asta.offerte.get(importo=asta.massimo)
+                self.assertEqual(asta.miglior_offerente_id, ultima.acquirente_id)
+            else:
+                self.assertEqual(asta.prezzo_attuale, asta.prezzo_base)
+
+        voti = {
+            riga['destinatario']: riga
+            for riga in Feedback.objects.values('destinatario').annotate(conteggio=Count('pk'), somma=Sum('voto'))
+        }
+        self.assertEqual(ReputazioneVenditore.objects.count(), len(voti))
+        for reputazione in ReputazioneVenditore.objects.all():
+            self.assertEqual(reputazione.conteggio, voti[reputazione.venditore_id]['conteggio'])
+            self.assertEqual(reputazione.somma_voti, voti[reputazione.venditore_id]['somma'])
+
+        for profilo in Profile.objects.annotate(non_lette=Count('user__notifiche', filter=Q(user__notifiche__letta=False))):
+            self.assertEqual(profilo.notifiche_non_lette, profilo.non_lette)
+
+        # L'indice di ricerca contiene le aste generate.
+        response = self.client.get(reverse('aste:ricerca'), {'keyword': Asta.objects.first().titolo.split()[0]})
+        self.assertTrue(response.context['aste_list'])
+
+        with self.assertRaises(CommandError):
+            self.genera()
+
+    def test_benchmark_salva_json_e_annulla_le_offerte(self):
+        self.genera()
+        offerte = Offerta.objects.count()
+        output = os.path.join(tempfile.mkdtemp(), 'benchmark.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+
+        call_command('benchmark_viste', ripetizioni=3, riscaldamento=0, output=output, stdout=StringIO())
+
+        with open(output, encoding='utf-8') as file:
+            risultati = json.load(file)
+        self.assertIn('fai_offerta', risultati['viste'])
+        self.assertIn('ricerca_desc_prezzo_attuale', risultati['viste'])
+        for nome, valori in risultati['viste'].items():
+            self.assertEqual(valori['errori'], 0, nome)
+            self.assertGreaterEqual(valori['p95_ms'], valori['p50_ms'])
+        self.assertEqual(Offerta.objects.count(), offerte)
+
+
+class RaccomandazioniTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.venditore = User.objects.create_user(username='venditore_racc', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.acquirente = User.objects.create_user(username='acquirente_racc', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        self.altro = User.objects.create_user(username='altro_racc', password='password123')
+        Profile.objects.create(user=self.altro, ruolo='acquirente')
+        self.categorie = [Categoria.objects.create(nome=f'Categoria {i}') for i in range(4)]
+
+    def crea_asta(self, categoria, conclusa_da=None):
+        asta = Asta.objects.create(
+            venditore=self.venditore,
+            titolo="Asta",
+            descrizione="Test raccomandazioni",
+            prezzo_base=Decimal('10.00'),
+            rilancio_minimo=Decimal('1.00'),
+            categoria=categoria,
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+        if conclusa_da:
+            asta.registra_offerta(conclusa_da, Decimal('20.00'))
+            Asta.objects.filter(pk=asta.pk).update(stato='conclusa')
+        return asta
+
+    def test_suggerimenti_limitati_per_categoria_con_query_costanti(self):
+        """
+        Con più categorie nei desideri servono comunque due query (suggerimenti e aste),
+        e ogni categoria riceve al massimo 3 suggerimenti, escluse le aste vinte dall'utente.
+        """
+        desideri = []
+        for categoria in self.categorie:
+            desideri.append(self.crea_asta(categoria))
+            for _ in range(5):
+                self.crea_asta(categoria, conclusa_da=self.altro)
+            vinta = self.crea_asta(categoria, conclusa_da=self.acquirente)
+
+        with self.assertNumQueries(2):
+            raccomandazioni = raccomandazioni_per_categoria(self.acquirente, desideri)
+        self.assertEqual(len(raccomandazioni), len(self.categorie))
+        for categoria in self.categorie:
+            suggerite = raccomandazioni[categoria.pk]
+            self.assertEqual(len(suggerite), 3)
+            self.assertTrue(all(asta.categoria_id == categoria.pk for asta in suggerite))
+            self.assertNotIn(vinta, suggerite)
+
+        # Alla seconda richiesta gli id arrivano dalla cache.
+        with self.assertNumQueries(1):
+            raccomandazioni_per_categoria(self.acquirente, desideri)
+
+    def test_cache_invalidata_quando_cambia_la_lista_dei_desideri(self):
+        categoria = self.categorie[0]
+        desiderata = self.crea_asta(categoria)
+        suggerita = self.crea_asta(categoria, conclusa_da=self.altro)
+        self.assertEqual(raccomandazioni_per_categoria(self.acquirente, [desiderata])[categoria.pk], [suggerita])
+
+        # Aggiungendo ai desideri l'asta suggerita, non deve più essere suggerita.
+        self.client.login(username='acquirente_racc', password='password123')
+        self.client.post(reverse('aste:gestisci_desideri', args=[suggerita.pk]))
+        raccomandazioni = raccomandazioni_per_categoria(self.acquirente, [desiderata, suggerita])
+        self.assertEqual(raccomandazioni.get(categoria.pk, []), [])
+
+
+class SchedeQueryCostantiTests(TestCase):
+    """
+    Le pagine con le card delle aste devono eseguire lo stesso numero di query
+    indipendentemente dal numero di card mostrate.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.venditore = User.objects.create_user(username='venditore_schede', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.acquirente = User.objects.create_user(username='acquirente_schede', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        self.altro = User.objects.create_user(username='altro_schede', password='password123')
+        Profile.objects.create(user=self.altro, ruolo='acquirente')
+        self.categoria = Categoria.objects.create(nome='Giochi')
+        self.client.login(username='acquirente_schede', password='password123')
+
+    def aggiungi_aste(self, quante):
+        for i in range(quante):
+            asta = Asta.objects.create(
+                venditore=self.venditore,
+                titolo=f"Gioco {i}",
+                descrizione="Gioco da tavolo",
+                immagine='aste_images/test_schede.jpg',
+                prezzo_base=Decimal('10.00'),
+                rilancio_minimo=Decimal('1.00'),
+                categoria=self.categoria,
+                data_fine=timezone.now() + timedelta(days=1)
+            )
+            # Alterniamo offerte dell'utente, di altri e nessuna offerta; metà nei desideri.
+            if i % 3 == 0:
+                asta.registra_offerta(self.acquirente, Decimal('15.00'))
+            elif i % 3 == 1:
+                asta.registra_offerta(self.altro, Decimal('15.00'))
+            if i % 2 == 0:
+                asta.utenti_lista_desideri.add(self.acquirente)
+            # Un'asta conclusa per ogni asta attiva, usata dai suggerimenti del profilo.
+            conclusa = Asta.objects.create(
+                venditore=self.venditore,
+                titolo=f"Gioco concluso {i}",
+                descrizione="Gioco da tavolo",
+                immagine='aste_images/test_schede.jpg',
+                prezzo_base=Decimal('10.00'),
+                rilancio_minimo=Decimal('1.00'),
+                categoria=self.categoria,
+                data_fine=timezone.now() + timedelta(days=1)
+            )
+            conclusa.registra_offerta(self.altro, Decimal('12.00'))
+            Asta.objects.filter(pk=conclusa.pk).update(stato='conclusa')
+
+    def conta_query(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as contesto:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(contesto.captured_queries)
+
+    def assert_query_costanti(self, url):
+        self.aggiungi_aste(2)
+        poche = self.conta_query(url)
+        self.aggiungi_aste(6)
+        self.assertEqual(self.conta_query(url), poche)
+
+    def test_home(self):
+        self.assert_query_costanti(reverse('aste:home'))
+
+    def test_ricerca(self):
+        self.assert_query_costanti(reverse('aste:ricerca') + '?includi_concluse=on')
+
+    def test_profilo(self):
+        self.assert_query_costanti(reverse('aste:profilo'))
+
+
+class RicercaTestualeTests(TestCase):
+
+    def setUp(self):
+        self.venditore = User.objects.create_user(username='venditore_ricerca', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.categoria = Categoria.objects.create(nome='Strumenti')
+
+    def crea_asta(self, titolo, descrizione):
+        return Asta.objects.create(
+            venditore=self.venditore,
+            titolo=titolo,
+            descrizione=descrizione,
+            immagine='aste_images/test_ricerca.jpg',
+            prezzo_base=Decimal('10.00'),
+            rilancio_minimo=Decimal('1.00'),
+            categoria=self.categoria,
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+
+    def cerca(self, keyword):
+        response = self.client.get(reverse('aste:ricerca'), {'keyword': keyword})
+        return [asta.pk for asta in response.context['aste_list']]
+
+    def test_cerca_in_titolo_e_descrizione_ordinando_per_rilevanza(self):
+        nella_descrizione = self.crea_asta("Amplificatore", "Perfetto per chitarra elettrica")
+        nel_titolo = self.crea_asta("Chitarra elettrica", "Ottimo strumento")
+        self.crea_asta("Batteria", "Completa di piatti")
+
+        self.assertEqual(self.cerca("chitarra"), [nel_titolo.pk, nella_descrizione.pk])
+        # Anche un prefisso della parola trova le aste.
+        self.assertEqual(len(self.cerca("chit")), 2)
+
+    def test_indice_sincronizzato_con_modifiche_e_cancellazioni(self):
+        asta = self.crea_asta("Violino", "Antico")
+        self.assertEqual(self.cerca("violino"), [asta.pk])
+
+        asta.titolo = "Viola"
+        asta.save()
+        self.assertEqual(self.cerca("violino"), [])
+        self.assertEqual(self.cerca("viola"), [asta.pk])
+
+        asta.delete()
+        self.assertEqual(self.cerca("viola"), [])
+
+    def test_caratteri_speciali_non_generano_errori(self):
+        self.crea_asta("Flauto", "Traverso")
+        response = self.client.get(reverse('aste:ricerca'), {'keyword': '"flauto* OR ('})
+        self.assertEqual(response.status_code, 200)
+
+
+class StatisticheRicercaTests(TestCase):
+    """
+    Il massimo del cursore dei prezzi e i conteggi per categoria vengono dalla
+    cache e restano corretti mentre le aste ricevono offerte, nascono e si chiudono.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.venditore = User.objects.create_user(username='venditore_stat', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.acquirente = User.objects.create_user(username='acquirente_stat', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        self.categoria = Categoria.objects.create(nome='Orologi')
+
+    def crea_asta(self, prezzo='10.00', **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Asta.objects.create(
+                venditore=self.venditore,
+                titolo="Orologio",
+                descrizione="Da polso",
+                immagine='aste_images/test_stat.jpg',
+                prezzo_base=Decimal(prezzo),
+                rilancio_minimo=Decimal('1.00'),
+                categoria=self.categoria,
+                data_fine=extra.get('data_fine', timezone.now() + timedelta(days=1))
+            )
+
+    def conteggio(self):
+        return statistiche_categorie().get(self.categoria.pk, {}).get('conteggio', 0)
+
+    def test_offerta_alza_il_massimo_senza_ricalcolo(self):
+        asta = self.crea_asta('50.00')
+        self.assertEqual(prezzo_max(), Decimal('50.00'))
+        self.assertEqual(statistiche_categorie()[self.categoria.pk]['prezzo_max'], Decimal('50.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            esito = piazza_offerta(asta.pk, self.acquirente, '80.00')
+        self.assertTrue(esito.accettata)
+        with self.assertNumQueries(0):
+            self.assertEqual(prezzo_max(), Decimal('80.00'))
+            self.assertEqual(statistiche_categorie()[self.categoria.pk]['prezzo_max'], Decimal('80.00'))
+
+    def test_conteggi_seguono_creazione_e_chiusura(self):
+        self.crea_asta()
+        self.assertEqual(self.conteggio(), 1)
+        scaduta = self.crea_asta(data_fine=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.conteggio(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            chiudi_aste_scadute(pks=[scaduta.pk])
+        self.assertEqual(self.conteggio(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Asta.objects.get(pk=scaduta.pk).delete()
+        self.assertEqual(self.conteggio(), 1)
+
+    def test_menu_categorie_mostra_i_conteggi(self):
+        self.crea_asta()
+        response = self.client.get(reverse('aste:ricerca'))
+        self.assertContains(response, "Orologi (1)")
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN è specifico di SQLite")
+class PianiDiEsecuzioneTests(TestCase):
+    """
+    Esegue EXPLAIN QUERY PLAN su tutte le query delle pagine più visitate e fallisce
+    se una tabella viene letta per intero invece che attraverso un indice.
+    """
+
+    # Tabelle piccole e lette per intero di proposito (es. il menu delle categorie).
+    TABELLE_AMMESSE = {'aste_categoria'}
+    # Indici parziali che è giusto scorrere per intero: contengono solo le aste attive,
+    # in ordine di scadenza (home, conteggi della ricerca) o per categoria (statistiche).
+    INDICI_AMMESSI = {'asta_attive_scadenza_idx', 'asta_attive_categoria_idx'}
+    # Ogni SCAN (anche `USING INDEX` / `USING COVERING INDEX`) legge tutta la tabella
+    # o tutto l'indice: solo SEARCH usa l'indice per restringere le righe.
+    SCANSIONE_COMPLETA = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?')
+
+    def setUp(self):
+        cache.clear()
+        self.venditore = User.objects.create_user(username='venditore_piani', password='password123')
+        Profile.objects.create(user=self.venditore, ruolo='venditore')
+        self.acquirente = User.objects.create_user(username='acquirente_piani', password='password123')
+        Profile.objects.create(user=self.acquirente, ruolo='acquirente')
+        categoria = Categoria.objects.create(nome='Piani')
+        self.asta = Asta.objects.create(
+            venditore=self.venditore,
+            titolo="Lampada",
+            descrizione="Da tavolo",
+            immagine='aste_images/test_piani.jpg',
+            prezzo_base=Decimal('10.00'),
+            rilancio_minimo=Decimal('1.00'),
+            categoria=categoria,
+            data_fine=timezone.now() + timedelta(days=1)
+        )
+        self.asta.registra_offerta(self.acquirente, Decimal('12.00'))
+        Feedback.objects.create(asta=self.asta, autore=self.acquirente, destinatario=self.venditore, voto=5, commento="Ok")
+        Notifica.objects.create(utente_destinatario=self.acquirente, messaggio="Benvenuto")
+
+    def piano(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            return [riga[3] for riga in cursor.fetchall()]
+
+    def scansioni_complete(self, url):
+        with CaptureQueriesContext(connection) as contesto:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        trovate = []
+        for query in contesto.captured_queries:
+            for passo in self.piano(query['sql']):
+                scansione = self.SCANSIONE_COMPLETA.match(passo)
+                if scansione is None:
+                    continue
+                tabella, indice = scansione.groups()
+                if tabella not in self.TABELLE_AMMESSE and indice not in self.INDICI_AMMESSI:
+                    trovate.append(f"{passo}: {query['sql']}")
+        return trovate
+
+    def assert_nessuna_scansione(self, *urls):
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.scansioni_complete(url), [])
+
+    def test_pagine_pubbliche(self):
+        self.assert_nessuna_scansione(
+            reverse('aste:home'),
+            reverse('aste:ricerca'),
+            reverse('aste:dettaglio_asta', args=[self.asta.pk]),
+            reverse('aste:profilo_venditore', args=[self.venditore.pk]),
+        )
+
+    def test_pagine_acquirente(self):
+        self.client.login(username='acquirente_piani', password='password123')
+        self.assert_nessuna_scansione(reverse('aste:home'), reverse('aste:profilo'), reverse('aste:notifiche'))
+
+    def test_pagine_venditore(self):
+        self.client.login(username='venditore_piani', password='password123')
+        self.assert_nessuna_scansione(reverse('aste:profilo'), reverse('aste:notifiche'))
+
+    def test_indici_dedicati(self):
+        # Le aste attive e le notifiche non lette devono usare gli indici parziali.
+        attive = Asta.objects.filter(stato='attiva').order_by('data_fine', 'pk')
+        self.assertIn('asta_attive_scadenza_idx', attive.explain())
+        scadute = Asta.objects.filter(stato='attiva', data_fine__lte=timezone.now())
+        self.assertIn('asta_attive_scadenza_idx', scadute.explain())
+        # Il conteggio del badge non ha ordinamento, come `count()` nel context processor.
+        non_lette = Notifica.objects.filter(utente_destinatario=self.acquirente, letta=False).order_by()
+        self.assertIn('notifica_non_lette_idx', non_lette.explain())
+
+
 # --- Test per le Viste (Pagine Utente) ---
 
+class StrumentazioneTests(TestCase):
+
+    def setUp(self):
+        registro.azzera()
+        self.addCleanup(registro.azzera)
+
+    def test_disattivata_non_aggiunge_intestazioni(self):
+        response = self.client.get(reverse('aste:home'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(registro.riepilogo(), [])
+
+    @override_settings(ASTE_STRUMENTAZIONE=True)
+    def test_server_timing_e_registro_per_vista(self):
+        response = self.client.get(reverse('aste:home'))
+        self.assertRegex(response['Server-Timing'], r'sql;dur=[\d.]+;desc="\d+ query", render;dur=[\d.]+, totale;dur=')
+        riga, = registro.riepilogo()
+        self.assertEqual(riga['vista'], 'aste:home')
+        self.assertEqual(riga['richieste'], 1)
+        self.assertGreater(riga['media_render_ms'], 0)
+
+    @override_settings(ASTE_STRUMENTAZIONE=True)
+    def test_render_dei_template_ripristinato_dopo_la_richiesta(self):
+        self.client.get(reverse('aste:home'))
+        self.assertEqual(Template.render.__qualname__, 'Template.render')
+
+    @override_settings(ASTE_STRUMENTAZIONE=True)
+    async def test_vista_async_misurata_senza_conversione(self):
+        # Il middleware non deve obbligare Django a convertire `fai_offerta` in una vista sincrona.
+        async def vista(request):
+            pass
+        self.assertTrue(iscoroutinefunction(StrumentazioneMiddleware(vista)))
+
+        acquirente, asta = await sync_to_async(self.crea_asta_con_acquirente)()
+        await self.async_client.aforce_login(acquirente)
+        response = await self.async_client.post(
+            reverse('aste:fai_offerta', args=[asta.pk]), {'importo': '15.00'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        # Le query della vista girano nel thread di `sync_to_async`: vengono contate lo stesso.
+        query = int(re.search(r'desc="(\d+) query"', response['Server-Timing']).group(1))
+        self.assertGreater(query, 0)
+        riga, = registro.riepilogo()
+        self.assertEqual(riga['vista'], 'aste:fai_offerta')
+
+    def crea_asta_con_acquirente(self):
+        venditore = User.objects.create_user(username='venditore_misure', password='password123')
+        acquirente = User.objects.create_user(username='acquirente_misure', password='password123')
+        Profile.objects.create(user=venditore, ruolo='venditore')
+        Profile.objects.create(user=acquirente, ruolo='acquirente')
+        asta = Asta.objects.create(
+            venditore=venditore, titolo="Lampada", descrizione="Vintage",
+            categoria=Categoria.objects.create(nome='Arredamento'), prezzo_base=Decimal('10.00'),
+            rilancio_minimo=Decimal('1.00'), data_fine=timezone.now() + timedelta(days=1),
+        )
+        return acquirente, asta
+
+    @override_settings(ASTE_SOGLIA_QUERY_RIPETUTE=3)
+    def test_query_ripetute_stessa_firma(self):
+        misure = MisureRichiesta()
+        with connection.execute_wrapper(misure):
+            for pk in range(3):
+                Asta.objects.filter(pk=pk).exists()
+            Asta.objects.filter(pk__in=[1, 2]).exists()
+            Asta.objects.filter(pk__in=[1, 2, 3]).exists()
+        self.assertEqual(misure.query, 5)
+        self.assertEqual(list(misure.query_ripetute().values()), [3])
+
+        with self.assertLogs('aste.strumentazione', 'WARNING'):
+            registro.registra('aste:prova', 10, misure)
+        self.assertEqual(list(registro.riepilogo()[0]['query_ripetute'].values()), [3])
+
+    @override_settings(ASTE_STRUMENTAZIONE=True)
+    def test_pagina_solo_per_lo_staff(self):
+        utente = User.objects.create_user(username='utente', password='password123')
+        self.client.force_login(utente)
+        self.assertEqual(self.client.get(reverse('strumentazione')).status_code, 302)
+
+        utente.is_staff = True
+        utente.save()
+        self.client.get(reverse('aste:home'))
+        dati = self.client.get(reverse('strumentazione'), {'formato': 'json'}).json()
+        self.assertTrue(dati['attiva'])
+        self.assertIn('aste:home', [riga['vista'] for riga in dati['viste']])
+        self.assertContains(self.client.get(reverse('strumentazione')), 'aste:home')
+
+        self.client.post(reverse('strumentazione'))
+        self.assertNotIn('aste:home', [riga['vista'] for riga in registro.riepilogo()])
+
+
 class HomeViewTests(TestCase):
 
     def setUp(self):
@@ -121,6 +1723,36 @@ class HomeViewTests(TestCase):
         # Controlliamo che il titolo della nostra asta sia presente nel contenuto HTML della pagina
         self.assertContains(response, "Un Titolo di Prova")
 
+    def test_home_paginazione_keyset(self):
+        """
+        Seguendo i cursori dell'endpoint JSON si vedono tutte le aste attive una sola volta,
+        anche quando più aste hanno la stessa data di fine.
+        """
+        stessa_fine = timezone.now() + timedelta(days=2)
+        for i in range(DIMENSIONE_PAGINA + 3):
+            Asta.objects.create(
+                venditore=self.venditore,
+                titolo=f"Asta {i}",
+                descrizione="Paginazione",
+                immagine='aste_images/test_paginazione.jpg',
+                prezzo_base=10.00,
+                rilancio_minimo=1.00,
+                categoria=self.categoria,
+                data_fine=stessa_fine
+            )
+
+        response = self.client.get(reverse('aste:home'))
+        self.assertEqual(len(response.context['aste_list']), DIMENSIONE_PAGINA)
+        visti = [asta.pk for asta in response.context['aste_list']]
+        prossimo = response.context['prossimo_cursore']
+        while prossimo:
+            dati = self.client.get(reverse('aste:home_json'), {'dopo': prossimo}).json()
+            visti += [asta['id'] for asta in dati['aste']]
+            prossimo = dati['prossimo']
+
+        attese = Asta.objects.filter(stato='attiva').order_by('data_fine', 'pk').values_list('pk', flat=True)
+        self.assertEqual(visti, list(attese))
+
     def test_home_view_no_aste_message(self):
         """
         Verifica che, se non ci sono aste, venga mostrato il messaggio corretto.
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+def max_byte_immagine():
+    return getattr(settings, 'ASTE_MAX_BYTE_IMMAGINE', 10 * 1024 * 1024)
+
+
+class LimiteUploadHandler(FileUploadHandler):
+    """
+    Primo gestore degli upload (vedi FILE_UPLOAD_HANDLERS): rifiuta con un 400
+    le richieste multipart molto più grandi dell'immagine massima consentita,
+    prima di leggerne il corpo. I file entro il limite passano al gestore
+    successivo, che li scrive a blocchi in un file temporaneo; il controllo
+    preciso della dimensione lo fa poi il campo del form (`ImmagineAstaField`).
+    """
+
+    # Margine per gli altri campi del form (titolo, descrizione, ...).
+    MARGINE = 1024 * 1024
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > max_byte_immagine() + self.MARGINE:
+            raise RequestDataTooBig("Il caricamento supera la dimensione massima consentita.")
+
+    def receive_data_chunk(self, raw_data, start):
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
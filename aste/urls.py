@@ -9,6 +9,8 @@ app_name = 'aste'
 urlpatterns = [
     # La stringa vuota '' corrisponde alla root dell'app (che sarà / come definito nel file urls.py principale)
     path('', HomeAsteView.as_view(), name='home'),
+    # Pagine successive della homepage in JSON, per lo scroll infinito.
+    path('api/aste/', HomeAsteJsonView.as_view(), name='home_json'),
     # Aggiungeremo l'URL per il dettaglio tra un attimo
     # Spiegazione: Questo è un path dinamico.
     # `<int:pk>` è un "path converter". Dice a Django di aspettarsi in questa
@@ -1,19 +1,34 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.contrib import admin
+from django.template.loader import render_to_string
 from django.views.generic import *
 from .models import * 
 from django.contrib import messages
 from django.contrib.auth.views import LoginView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from .forms import * # Importa il nostro nuovo form
+from .offerte import piazza_offerta
+from .raccomandazioni import invalida_raccomandazioni, raccomandazioni_per_categoria
+from .paginazione import pagina_keyset
+from .ricerca import backend_ricerca
+from .schede import prepara_schede
+from .statistiche import prezzo_max, statistiche_categorie
+from .storage import nome_per_contenuto
+from .strumentazione import registro, soglia_query_ripetute, strumentazione_attiva
 from django.contrib.auth.mixins import *
+from django.core.paginator import Paginator
+from django.views.static import serve
+from django.core.handlers.asgi import ASGIRequest
 from django.http import JsonResponse # Per inviare risposte in formato JSON
+import asyncio
 import json # Per decodificare i dati in arrivo
 from django.db.models import * # Per trovare facilmente l'offerta massima
 from django.contrib.auth.decorators import login_required # Importa il decoratore
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from django.utils import timezone
 from datetime import timedelta
+from django.db import transaction
 from django.db.models.functions import Coalesce
 
 
@@ -36,36 +51,46 @@ class HomeAsteView(ListView):
         # Spiegazione: Stiamo sovrascrivendo il metodo `get_queryset`.
         # Invece di prendere TUTTE le aste (`Asta.objects.all()`),
         # prendiamo solo quelle 'attive' e le ordiniamo per data di fine.
-        # Ora anche la homepage calcola il prezzo_attuale per ogni asta,
-        # usando il prezzo base come default se non ci sono offerte.
-        # Usiamo Coalesce per gestire il caso in cui non ci siano offerte, usando il prezzo_base.
-        
-        aste_con_prezzo = Asta.objects.filter(stato='attiva').annotate(
-            prezzo_attuale=Coalesce(Max('offerte__importo'), F('prezzo_base'))
-        )
-        # Usiamo Prefetch per caricare in modo efficiente l'offerta più alta per ogni asta.
-        #    Questo farà una sola query aggiuntiva per tutte le offerte, invece di una per asta.
-        offerte_prefetch = Prefetch(
-            'offerte', # Nome del related_name nel modello Asta
-            queryset=Offerta.objects.select_related('acquirente').order_by('-importo'),
-            to_attr='offerte_ordinate' # Salviamo il risultato in un nuovo attributo sull'oggetto asta
-        )
-        
-        return aste_con_prezzo.prefetch_related(offerte_prefetch).order_by('data_fine').distinct()
+        # Il prezzo attuale e il miglior offerente sono salvati direttamente sull'asta
+        # (vedi `Asta.registra_offerta`), quindi non serve più aggregare le offerte:
+        # ci basta una JOIN per avere l'username del miglior offerente.
+        return Asta.objects.filter(stato='attiva').select_related('miglior_offerente').order_by('data_fine')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        if self.request.user.is_authenticated:
-            aste_vincenti_utente = set()
-            for asta in context['aste_list']:
-                # `asta.offerte_ordinate` esiste grazie al to_attr nel Prefetch.
-                # Questa operazione NON fa una nuova query al database.
-                if hasattr(asta, 'offerte_ordinate') and asta.offerte_ordinate:
-                    offerta_top = asta.offerte_ordinate[0]
-                    if offerta_top.acquirente == self.request.user:
-                        aste_vincenti_utente.add(asta.pk)
-            context['aste_vincenti_utente'] = aste_vincenti_utente
+        # Paginazione "keyset" su (data_fine, id): il parametro `dopo` è il cursore
+        # dell'ultima asta già mostrata (vedi aste/paginazione.py).
+        aste, prossimo_cursore = pagina_keyset(self.object_list, self.request.GET.get('dopo'))
+        # Precalcoliamo per tutte le card della pagina miglior offerente,
+        # "stai vincendo" e lista dei desideri, con un numero fisso di query.
+        context['aste_list'] = prepara_schede(aste, self.request.user)
+        context['prossimo_cursore'] = prossimo_cursore
         return context
+
+
+class HomeAsteJsonView(HomeAsteView):
+    # Spiegazione: Endpoint usato dallo scroll infinito della homepage.
+    # Riusa queryset e paginazione di HomeAsteView, ma invece della pagina intera
+    # restituisce in JSON solo i dati delle card, il loro HTML e il cursore successivo.
+
+    def render_to_response(self, context, **response_kwargs):
+        aste = context['aste_list']
+        return JsonResponse({
+            'aste': [
+                {
+                    'id': asta.pk,
+                    'titolo': asta.titolo,
+                    'url': reverse('aste:dettaglio_asta', args=[asta.pk]),
+                    'immagine': asta.immagine_anteprima_url,
+                    'prezzo_attuale': f"{asta.prezzo_attuale:.2f}",
+                    'miglior_offerente': asta.miglior_offerente.username if asta.miglior_offerente else None,
+                    'data_fine': asta.data_fine.isoformat(),
+                }
+                for asta in aste
+            ],
+            'html': render_to_string('aste/_pagina_aste.html', {'aste_list': aste}, request=self.request),
+            'prossimo': context['prossimo_cursore'],
+        })
     
 
 class DettaglioAstaView(DetailView):
@@ -81,30 +106,25 @@ class DettaglioAstaView(DetailView):
     #    chiamata `object`. Le diamo un nome più chiaro e intuitivo.
     context_object_name = 'asta'
     
-    def get_object(self, queryset=None):
-        # Spiegazione: Sovrascriviamo get_object, il metodo che recupera
-        # il singolo oggetto Asta dal database.
-        asta = super().get_object(queryset)
-        asta.aggiorna_stato_se_scaduta() # Chiamiamo il nostro metodo di aggiornamento!
-        return asta
+    def get_queryset(self):
+        # Spiegazione: Una sola query per asta, venditore, categoria e miglior offerente.
+        # Prezzo e vincitore sono già sull'asta (campi denormalizzati), quindi non serve
+        # cercare l'offerta più alta.
+        return Asta.objects.select_related('venditore', 'categoria', 'miglior_offerente')
 
     def get_context_data(self, **kwargs):
         # Spiegazione: Stiamo sovrascrivendo questo metodo per aggiungere
         # più informazioni (il "contesto") da passare al template.
-        # Oltre ai dettagli dell'asta, vogliamo anche mostrare la sua offerta più alta.
-
-        # Chiamiamo prima l'implementazione base per ottenere il contesto di default
+        # `self.object` è l'asta già caricata da `get()`: non la rileggiamo.
         context = super().get_context_data(**kwargs)
-        asta = self.get_object()
-        # Recuperiamo l'offerta più alta per l'asta corrente.
-        # `self.get_object()` ci dà l'istanza dell'asta che la vista sta mostrando.
-        # Usiamo `first()` perché abbiamo ordinato le offerte in modo decrescente nel modello.
-        offerta_piu_alta = self.get_object().offerte.first()
-        
-        # Aggiungiamo l'offerta al contesto che passeremo al template.
-        context['offerta_piu_alta'] = offerta_piu_alta
-        if self.request.user.is_authenticated and offerta_piu_alta and offerta_piu_alta.acquirente == self.request.user:
-            context['utente_sta_vincendo'] = True
+        asta = self.object
+        user = self.request.user
+
+        # Il queryset è pigro: per gli anonimi con la pagina già in cache non viene mai eseguito.
+        context['feedback_asta'] = asta.feedback.select_related('autore')
+        if user.is_authenticated:
+            context['utente_sta_vincendo'] = asta.miglior_offerente_id == user.pk
+            context['in_lista_desideri'] = user.lista_desideri.filter(pk=asta.pk).exists()
         return context
     
 class RegistrazioneView(CreateView):
@@ -145,31 +165,22 @@ class ProfiloView(LoginRequiredMixin, TemplateView):
 
         # Logica specifica per il ruolo ACQUIRENTE
         if user.profile.ruolo == 'acquirente':
-            desideri = user.lista_desideri.all()
-            desideri_ids = list(desideri.values_list('id', flat=True))
-            context['offerte_fatte'] = Offerta.objects.filter(acquirente=user).order_by('-data_offerta')
-            context['lista_desideri'] = user.lista_desideri.all()
+            desideri = list(user.lista_desideri.select_related('miglior_offerente'))
+            context['offerte_fatte'] = Offerta.objects.filter(acquirente=user).select_related('asta').order_by('-data_offerta')
+            context['lista_desideri'] = desideri
             context['aste_vinte'] = Asta.objects.get_aste_vinte(user)
-            # Raccomandazioni semplificate: per ogni asta nei desideri, suggeriamo 3 aste concluse
-            # della stessa categoria, vinte da altri utenti
-            aste_vinte_ids = context['aste_vinte'].values_list('id', flat=True)
-            raccomandazioni = {}
-            for asta in desideri:
-                altre = Asta.objects.filter(
-                    categoria=asta.categoria,
-                    stato='conclusa',
-                    offerte__isnull=False
-                ).exclude(
-                    pk=asta.pk
-                ).exclude(
-                    pk__in=aste_vinte_ids
-                ).exclude(
-                    pk__in=desideri_ids
-                ).distinct()[:3]
-                raccomandazioni[asta.pk] = altre
+            # Raccomandazioni: per ogni categoria dei desideri suggeriamo fino a 3 aste concluse
+            # della stessa categoria, vinte da altri utenti. Vengono calcolate con un'unica
+            # query per tutte le categorie e messe in cache per utente (vedi aste/raccomandazioni.py).
+            raccomandazioni = raccomandazioni_per_categoria(user, desideri)
             context['lista_desideri_con_raccomandazioni'] = [
-                (asta, raccomandazioni[asta.pk]) for asta in desideri
+                (asta, raccomandazioni.get(asta.categoria_id, [])) for asta in desideri
             ]
+            # Prepariamo insieme tutte le card della pagina: desideri e suggerimenti.
+            prepara_schede(
+                desideri + [suggerita for suggerite in raccomandazioni.values() for suggerita in suggerite],
+                user
+            )
 
         return context
     
@@ -223,70 +234,51 @@ class CreaAstaView(VenditoreRequiredMixin, CreateView):
 
 
 @login_required # 1. Proteggiamo la vista: solo utenti loggati
-def fai_offerta(request, pk):
+async def fai_offerta(request, pk):
     # Spiegazione: Questa vista gestisce la logica per piazzare una nuova offerta.
+    # È una vista asincrona: sotto Daphne non occupa un thread mentre aspetta
+    # il database o il channel layer.
     
     # 2. Controlliamo che la richiesta sia di tipo POST
     if request.method == 'POST':
-        
-            
-        if request.method != 'POST':
-            return JsonResponse({'success': False, 'error': 'Metodo non consentito.'}, status=405)
-        
-        asta = Asta.objects.get(pk=pk)
-        
-        # 3. Controlliamo che solo gli acquirenti possano fare offerte
-        if request.user.profile.ruolo != 'acquirente':
-            return JsonResponse({'success': False, 'error': 'Solo gli acquirenti possono fare offerte.'}, status=403)
-
-        if asta.stato != 'attiva':
-            return JsonResponse({'success': False, 'error': 'Questa asta è conclusa.'}, status=400)
-            
-        try:    
-            # 4. Validazione logica
-            # Prendiamo l'offerta più alta esistente o il prezzo base se non ci sono offerte
-            offerta_corrente = asta.offerte.aggregate(Max('importo'))['importo__max'] or asta.prezzo_base
-            
-            # Leggiamo l'importo inviato dal client via AJAX
+        # 3. Leggiamo l'importo inviato dal client via AJAX
+        try:
             data = json.loads(request.body)
-            importo_offerta = float(data.get('importo'))
-
-            if importo_offerta < (offerta_corrente + asta.rilancio_minimo):
-                return JsonResponse({'success': False, 'error': 'La tua offerta non rispetta il rilancio minimo.'}, status=400)
-
-            # 5. Se tutto è valido, creiamo e salviamo la nuova offerta
-            nuova_offerta = Offerta.objects.create(
-                asta=asta,
-                acquirente=request.user,
-                importo=importo_offerta
-            )
-
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f'asta_{asta.id}',
-                {
-                    'type': 'offerta_aggiornata',
-                    'dati_offerta': {
-                        'nuovo_prezzo': f"{nuova_offerta.importo:.2f}",
-                        'acquirente': nuova_offerta.acquirente.username,
-                    }
-                }
+        except ValueError:
+            data = None
+        # Anche un JSON valido che non è un oggetto (es. `[1]`) è una richiesta non valida.
+        if not isinstance(data, dict):
+            return JsonResponse({'success': False, 'error': 'Richiesta non valida.'}, status=400)
+
+        # 4. Validazione e registrazione vengono fatte dal servizio `piazza_offerta`,
+        #    che serializza le offerte concorrenti sulla stessa asta e restituisce
+        #    sempre un esito (accettata, rifiutata o superata) invece di un'eccezione.
+        #    Il servizio usa transazioni e SELECT ... FOR UPDATE, che l'ORM asincrono
+        #    non offre: lo eseguiamo quindi in un thread con `sync_to_async`
+        #    (un thread per richiesta sotto ASGI, quindi le offerte restano concorrenti).
+        #    Dopo il commit il nuovo prezzo arriva in tempo reale a chi sta guardando l'asta,
+        #    e la notifica "offerta superata" a chi conduceva. Sotto ASGI (Daphne) il loop vive
+        #    quanto il server: gli invii partono lì in background e la risposta non li aspetta.
+        #    Sotto un handler sincrono (WSGI, `Client` dei test) il loop è creato da asgiref
+        #    per questa sola chiamata e chiuso alla risposta: gli invii avvengono nel commit.
+        user = await request.auser()
+        loop_annunci = asyncio.get_running_loop() if isinstance(request, ASGIRequest) else None
+        esito = await sync_to_async(piazza_offerta)(
+            pk, user, data.get('importo'), annuncia_prezzo=True, loop_annunci=loop_annunci
+        )
+        if not esito.accettata:
+            return JsonResponse(
+                {'success': False, 'error': esito.errore, 'superata': esito.superata},
+                status=esito.status
             )
+        nuova_offerta = esito.offerta
 
-            print("[DEBUG] VIEW sending to group:", f"asta_{asta.id}")
-
-            
-            # 6. Restituiamo una risposta JSON di successo con i nuovi dati
-            return JsonResponse({
-                'success': True,
-                'nuovo_prezzo': f"{nuova_offerta.importo:.2f}",
-                'acquirente': nuova_offerta.acquirente.username
-            })
-
-        except Asta.DoesNotExist:
-            return JsonResponse({'success': False, 'error': 'Asta non trovata.'}, status=404)
-        except Exception as e:
-            return JsonResponse({'success': False, 'error': str(e)}, status=500)
+        # 5. Restituiamo una risposta JSON di successo con i nuovi dati
+        return JsonResponse({
+            'success': True,
+            'nuovo_prezzo': f"{nuova_offerta.importo:.2f}",
+            'acquirente': nuova_offerta.acquirente.username
+        })
     
     # Se la richiesta non è POST, restituiamo un errore
     return JsonResponse({'success': False, 'error': 'Metodo non consentito.'}, status=405)
@@ -312,6 +304,9 @@ def gestisci_lista_desideri(request, pk):
                 user.lista_desideri.add(asta)
                 added = True # Flag per comunicare al client che abbiamo aggiunto l'asta.
 
+            # La lista dei desideri è cambiata: le raccomandazioni dell'utente vanno ricalcolate.
+            invalida_raccomandazioni(user)
+
             # Restituiamo una risposta JSON di successo.
             return JsonResponse({'success': True, 'added': added})
 
@@ -368,22 +363,13 @@ class RisultatiRicercaView(ListView):
     paginate_by = 10 # Mostriamo 10 risultati per pagina
 
     def get_queryset(self):
-       
-        offerte_prefetch = Prefetch(
-            'offerte',
-            queryset=Offerta.objects.select_related('acquirente').order_by('-importo')
-        )
         # Spiegazione: Questo è il cuore della ricerca.
-        # Iniziamo con un queryset di tutte le aste.
-        queryset = Asta.objects.annotate(
-            prezzo_attuale=Coalesce(
-                Max('offerte__importo'), 
-                F('prezzo_base'), 
-                0.0, 
-                output_field=DecimalField()
-            ),
-            reputazione_venditore=Avg('venditore__feedback_ricevuti__voto')
-        ).prefetch_related(offerte_prefetch)
+        # Iniziamo con un queryset di tutte le aste. Il prezzo attuale è un campo
+        # dell'asta, quindi i filtri e l'ordinamento per prezzo lavorano direttamente su di esso.
+        # La reputazione del venditore non si calcola qui: è già riassunta in
+        # ReputazioneVenditore (una riga per venditore, vedi aste/signals.py) e serve
+        # solo per l'ordinamento, con una semplice JOIN uno-a-uno.
+        queryset = Asta.objects.select_related('miglior_offerente')
         # Recuperiamo i dati dal form passato come parametri GET.
         form = SearchForm(self.request.GET)
         
@@ -401,8 +387,10 @@ class RisultatiRicercaView(ListView):
                 # Filtro di base: mostra solo le aste attive.
                 queryset = queryset.filter(stato='attiva')
             if keyword:
-                # Filtro per parola chiave su titolo.
-                queryset = queryset.filter(titolo__icontains=keyword)
+                # Ricerca testuale su titolo e descrizione tramite il motore di ricerca
+                # configurato (FTS5 su SQLite, tsvector su PostgreSQL, vedi aste/ricerca.py).
+                # Aggiunge l'annotazione `rilevanza` usata per l'ordinamento.
+                queryset = backend_ricerca().filtra(queryset, keyword)
             if categoria:
                 queryset = queryset.filter(categoria=categoria)
                 
@@ -420,59 +408,60 @@ class RisultatiRicercaView(ListView):
                 data_limite = timezone.now() + timedelta(days=int(durata))
                 queryset = queryset.filter(data_fine__lte=data_limite)
             
-            if ordina_per:
+            if ordina_per == 'rilevanza' or (not ordina_per and keyword):
+                # Senza parola chiave non c'è una rilevanza: usiamo l'ordinamento di default.
+                queryset = queryset.order_by('-rilevanza', 'data_fine') if keyword else queryset.order_by('data_fine')
+            elif ordina_per:
                 if ordina_per == 'reputazione':
-                    queryset = queryset.order_by('-reputazione_venditore', 'data_fine')
+                    # I venditori senza feedback vanno in fondo.
+                    queryset = queryset.order_by(
+                        F('venditore__reputazione__media').desc(nulls_last=True), 'data_fine'
+                    )
                 else:
                     queryset = queryset.order_by(ordina_per)
             else:
                 queryset = queryset.order_by('data_fine')
-        return queryset.distinct()   
+        return queryset   
     
     
     def get_context_data(self, **kwargs):
         # Passiamo il form al contesto per poter mostrare i filtri applicati.
         context = super().get_context_data(**kwargs)
-        context['form'] = SearchForm(self.request.GET or None)
-        
-        # Calcoliamo il prezzo massimo tra tutte le aste
-        max_price_agg = Asta.objects.annotate(
-            prezzo_attuale=Case(
-                When(offerte__importo__isnull=False, then=Max('offerte__importo')),
-                default=F('prezzo_base'),
-                output_field=DecimalField()
-            )
-        ).aggregate(max_val=Max('prezzo_attuale'))
-        
-        max_price = 1000  # Valore di default se non ci sono aste
-        if max_price_agg['max_val'] is not None:
-            max_price = int(max_price_agg['max_val'])
-            
-        context['max_prezzo_asta'] = max_price
-        
-        if self.request.user.is_authenticated:
-            # Creiamo un 'set' (un tipo di lista molto veloce per le ricerche) 
-            # contenente gli ID di tutte le aste nella pagina corrente che l'utente sta vincendo.
-            aste_vincenti = set(
-                asta.pk for asta in context['aste_list'] 
-                if asta.offerte.first() and asta.offerte.first().acquirente == self.request.user
-            )
-            context['aste_vincenti_utente'] = aste_vincenti
-        else:
-            # Se l'utente non è loggato, passiamo una lista vuota per sicurezza
-            context['aste_vincenti_utente'] = set()
+        form = SearchForm(self.request.GET or None)
+
+        # Statistiche dei filtri lette dalla cache (vedi aste/statistiche.py):
+        # niente aggregati sull'intera tabella a ogni ricerca.
+        categorie = statistiche_categorie()
+        form.mostra_conteggi(categorie)
+        context['form'] = form
+        context['statistiche_categorie'] = categorie
+        context['max_prezzo_asta'] = int(prezzo_max())
+
+        # Precalcoliamo i dati delle card della pagina corrente (vedi aste/schede.py).
+        context['aste_list'] = prepara_schede(context['aste_list'], self.request.user)
         return context
     
 
 class ProfiloVenditoreView(View):
+    # Feedback mostrati per pagina nel profilo del venditore.
+    paginate_by = 10
+
     def get(self, request, user_id):
         venditore = get_object_or_404(User, id=user_id)
-        feedback_list = Feedback.objects.filter(destinatario=venditore).order_by('-data_creazione')
-        media_voto = feedback_list.aggregate(Avg('voto'))['voto__avg']
+        # Media, conteggio e istogramma arrivano già calcolati (vedi ReputazioneVenditore).
+        reputazione = ReputazioneVenditore.objects.filter(venditore=venditore).first()
+        feedback_list = Feedback.objects.filter(destinatario=venditore).select_related(
+            'autore', 'asta'
+        ).order_by('-data_creazione')
+        paginator = Paginator(feedback_list, self.paginate_by)
+        # Il totale è già nel riepilogo: evitiamo la COUNT del paginator.
+        paginator.count = reputazione.conteggio if reputazione else 0
+        page_obj = paginator.get_page(request.GET.get('page'))
         return render(request, 'aste/profilo_venditore.html', {
             'venditore': venditore,
-            'feedback_list': feedback_list,
-            'media_voto': media_voto,
+            'reputazione': reputazione,
+            'feedback_list': page_obj.object_list,
+            'page_obj': page_obj,
         })
         
         
@@ -486,12 +475,21 @@ class VenditoreAstaOwnerMixin(UserPassesTestMixin):
         # self.get_object() è un metodo delle viste di dettaglio (Detail, Update, Delete)
         # che recupera l'oggetto Asta corrente.
         asta = self.get_object()
-        return self.request.user == asta.venditore and asta.offerte.count() == 0
+        return self.request.user == asta.venditore and asta.numero_offerte == 0
 
     def handle_no_permission(self):
         # Se test_func ritorna False, l'utente viene reindirizzato con un messaggio di errore.
         messages.error(self.request, "Azione non consentita: puoi modificare solo le tue aste che non hanno ancora ricevuto offerte.")
         return redirect('aste:home')
+
+    def form_valid(self, form):
+        # Spiegazione: `test_func` ha controllato le offerte all'apertura della richiesta,
+        # ma un'offerta può arrivare prima del salvataggio. Ripetiamo il controllo sulla
+        # riga bloccata, nella stessa transazione della modifica o della cancellazione.
+        with transaction.atomic():
+            if Asta.objects.select_for_update().filter(pk=self.object.pk, numero_offerte__gt=0).exists():
+                return self.handle_no_permission()
+            return super().form_valid(form)
     
 class ModificaAstaView(VenditoreAstaOwnerMixin, UpdateView):
     model = Asta
@@ -508,12 +506,10 @@ class EliminaAstaView(VenditoreAstaOwnerMixin, DeleteView):
     model = Asta
     template_name = 'aste/asta_confirm_delete.html'
     
-    # Dopo l'eliminazione, reindirizza al profilo del venditore.
-    success_url = reverse_lazy('aste:profilo')
-
-    def form_valid(self, form):
+    def get_success_url(self):
+        # Dopo l'eliminazione, reindirizza al profilo del venditore.
         messages.success(self.request, f"L'asta '{self.object.titolo}' è stata eliminata.")
-        return super().form_valid(form)
+        return reverse_lazy('aste:profilo')
     
     
 class NotificheView(LoginRequiredMixin, ListView):
@@ -531,9 +527,38 @@ class NotificheView(LoginRequiredMixin, ListView):
         queryset = Notifica.objects.filter(utente_destinatario=self.request.user)
 
         # --- AZIONE CHIAVE: Segniamo le notifiche come lette ---
-        # Prendiamo solo quelle non lette e le aggiorniamo nel database
-        # con un'unica, efficiente query.
-        queryset.filter(letta=False).update(letta=True)
+        # Un'unica query per le notifiche e una per azzerare il contatore del badge.
+        Notifica.objects.segna_tutte_lette(self.request.user)
 
         # Restituiamo l'intero queryset (lette e non) da mostrare
-        return queryset
\ No newline at end of file
+        return queryset
+
+def servi_media(request, path, document_root=None):
+    # Spiegazione: Come `django.views.static.serve` (usata in sviluppo per i file media),
+    # ma i file con nome basato sul contenuto (vedi aste/storage.py) non cambiano mai:
+    # il browser può tenerli in cache per un anno senza ricontrollarli.
+    # In produzione le stesse intestazioni vanno impostate sul web server.
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200 and nome_per_contenuto(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+def strumentazione(request):
+    # Spiegazione: Pagina di amministrazione con le statistiche raccolte da
+    # `StrumentazioneMiddleware` nel processo che risponde (vedi aste/strumentazione.py).
+    # È protetta da `admin.site.admin_view` in aste_project/urls.py: solo lo staff la vede.
+    # Con ?formato=json restituisce gli stessi dati, per salvarli e confrontarli.
+    if request.method == 'POST':
+        registro.azzera()
+        return redirect('strumentazione')
+    righe = registro.riepilogo()
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({'attiva': strumentazione_attiva(), 'viste': righe})
+    return render(request, 'admin/strumentazione.html', {
+        **admin.site.each_context(request),
+        'title': 'Strumentazione delle richieste',
+        'attiva': strumentazione_attiva(),
+        'soglia': soglia_query_ripetute(),
+        'righe': righe,
+    })
@@ -10,17 +10,18 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import aste.routing
-
 # Imposta la variabile d'ambiente PRIMA di fare qualsiasi altro import di Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aste_project.settings')
 
 # Importa l'applicazione HTTP standard di Django DOPO aver impostato la variabile d'ambiente
 django_asgi_app = get_asgi_application()
 
-# Importa i componenti di Channels
+# Importa i componenti di Channels (aste.routing importa i consumer, che usano i modelli:
+# per questo va importato solo dopo che Django è stato inizializzato)
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.auth import AuthMiddlewareStack
+from channels.security.websocket import AllowedHostsOriginValidator
+import aste.routing
 
 
 # Definisci l'applicazione principale che il server ASGI eseguirà
@@ -29,9 +30,13 @@ application = ProtocolTypeRouter({
     "http": django_asgi_app,
 
     # Se la connessione è di tipo WebSocket, gestiscila con la nostra logica
-    "websocket": AuthMiddlewareStack(
-        URLRouter(
-            aste.routing.websocket_urlpatterns
+    # Le connessioni WebSocket usano la sessione (e ora accettano anche offerte):
+    # AllowedHostsOriginValidator rifiuta quelle aperte da pagine di altri siti.
+    "websocket": AllowedHostsOriginValidator(
+        AuthMiddlewareStack(
+            URLRouter(
+                aste.routing.websocket_urlpatterns
+            )
         )
     ),
 })
\ No newline at end of file
@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Prima di tutti gli altri, così misura l'intera richiesta (vedi ASTE_STRUMENTAZIONE).
+    'aste.strumentazione.StrumentazioneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,6 +89,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Con IMMEDIATE ogni transazione prende subito il lock in scrittura:
+            # le offerte concorrenti sulla stessa asta vengono messe in coda
+            # (fino a `timeout` secondi) invece di fallire con "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -150,10 +159,76 @@ WSGI_APPLICATION = 'aste_project.wsgi.application'
 # per la comunicazione tra i componenti (es. tra una vista e un consumer).
 
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+# - Senza configurazione usiamo InMemoryChannelLayer: va bene in sviluppo, ma i gruppi
+#   esistono solo dentro un processo, quindi con più worker Daphne un'offerta
+#   arriverebbe solo ai client collegati allo stesso processo.
+# - Impostando la variabile d'ambiente REDIS_URL (es. redis://localhost:6379/0)
+#   usiamo channels_redis e i gruppi sono condivisi da tutti i processi.
+#   Per provarlo senza un vero Redis: `python manage.py benchmark_broadcast --fakeredis`.
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
     }
+
+# Finestra (in millisecondi) in cui gli aggiornamenti di prezzo della stessa asta
+# vengono accorpati prima di essere inviati ai client WebSocket (vedi aste/consumers.py).
+ASTE_FINESTRA_AGGIORNAMENTI_MS = 20
+
+# Numero massimo di aste che una singola connessione a ws/aste/ può seguire.
+ASTE_MAX_ISCRIZIONI_WS = 200
+
+# Larghezze (in pixel) delle versioni ridotte delle immagini delle aste, in WebP e JPEG
+# (vedi aste/immagini.py). Vengono generate in un thread separato dopo il caricamento.
+ASTE_LARGHEZZE_IMMAGINI = (320, 640, 1280)
+ASTE_DERIVATI_IN_BACKGROUND = True
+
+# Limiti delle immagini caricate (vedi aste/upload.py e ImmagineAstaField in aste/forms.py).
+# Gli upload vengono scritti a blocchi in un file temporaneo e le immagini vengono
+# controllate leggendo solo l'intestazione, senza decodificarle nella richiesta.
+ASTE_MAX_BYTE_IMMAGINE = 10 * 1024 * 1024
+ASTE_MAX_PIXEL_IMMAGINE = 40_000_000
+ASTE_FORMATI_IMMAGINE = ('JPEG', 'PNG', 'WEBP', 'GIF')
+FILE_UPLOAD_HANDLERS = [
+    'aste.upload.LimiteUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Strumentazione delle richieste (vedi aste/strumentazione.py): numero di query, tempo SQL,
+# tempo di rendering e query ripetute (N+1) per vista, nell'intestazione Server-Timing e
+# nella pagina admin/strumentazione/. Disattivata di default: si attiva con la variabile
+# d'ambiente ASTE_STRUMENTAZIONE=1. Una query eseguita almeno ASTE_SOGLIA_QUERY_RIPETUTE
+# volte nella stessa richiesta viene segnalata come ripetuta.
+ASTE_STRUMENTAZIONE = os.environ.get('ASTE_STRUMENTAZIONE') == '1'
+ASTE_SOGLIA_QUERY_RIPETUTE = 5
+
+# Log dell'app `aste` sulla console (scheduler delle chiusure, WebSocket, ...).
+# Di default solo avvisi ed errori; il livello si può cambiare con la variabile
+# d'ambiente ASTE_LOG_LEVEL (es. INFO per lo scheduler, DEBUG per i WebSocket).
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "semplice": {"format": "%(asctime)s %(levelname)s %(name)s: %(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "semplice"},
+    },
+    "loggers": {
+        "aste": {"handlers": ["console"], "level": os.environ.get("ASTE_LOG_LEVEL", "WARNING")},
+    },
 }
 
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
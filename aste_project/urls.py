@@ -18,8 +18,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings # Importa settings
 from django.conf.urls.static import static # Importa static
+from aste.views import servi_media, strumentazione
 
 urlpatterns = [
+    # Statistiche di StrumentazioneMiddleware (solo staff), prima degli URL dell'admin.
+    path('admin/strumentazione/', admin.site.admin_view(strumentazione), name='strumentazione'),
     path('admin/', admin.site.urls),
     # Includeremo gli URL della nostra app 'aste' tra poco
     path('', include('aste.urls')),
@@ -27,5 +30,6 @@ urlpatterns = [
 
 
 # Questa riga serve i file media solo se siamo in modalità DEBUG
+# (con le intestazioni di cache per le immagini con nome basato sul contenuto)
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.MEDIA_URL, view=servi_media, document_root=settings.MEDIA_ROOT)
\ No newline at end of file